@@ -1,7 +1,18 @@
 
+import json
+import mimetypes
 import os
 import requests
 
+# 優先度ごとの応答待ちの上限（秒）。バックエンドにも期限として伝え、間に合わない処理は打ち切らせる
+REQUEST_TIMEOUTS = {
+    "interactive": float(os.environ.get("SENP_AI_REQUEST_TIMEOUT", "60")),
+    "navigation": float(os.environ.get("SENP_AI_NAVIGATION_TIMEOUT", "20")),
+    "batch": float(os.environ.get("SENP_AI_BATCH_TIMEOUT", "300")),
+}
+# セッションに送る前に保持するローカルの会話ターン数の上限（バックエンドに届かない間に増え続けないように）
+MAX_PENDING_TURNS = 20
+
 class RemoteAIModule:
     """
     Cloud Run上のバックエンドAIサービスを利用するクライアントモジュール
@@ -27,6 +38,12 @@ class RemoteAIModule:
             print(f"Cloud AI Client initialized with default URL: {self.backend_url}")
             
         self.current_model = "gemini-3-flash-preview" # デフォルトモデル
+        # 1回の回答にかけてよい時間の目安（ミリ秒）。指定するとバックエンドが予算内のモデルを選ぶ
+        budget = os.environ.get("SENP_AI_LATENCY_BUDGET_MS")
+        self.latency_budget_ms = int(budget) if budget else None
+        self.latency_mode = "balanced" # レイテンシモード（instant / balanced / thorough）
+        self.session_id = None # バックエンド側の会話セッションID
+        self.pending_turns = [] # ローカルで答えた、まだセッションに送っていない会話ターン
 
     def set_model(self, model):
         """
@@ -38,6 +55,25 @@ class RemoteAIModule:
     def get_model(self):
         return self.current_model
 
+    def set_latency_mode(self, mode):
+        """
+        レイテンシモード（思考量・回答の長さ）を設定
+        """
+        self.latency_mode = mode
+        print(f"Latency mode selected: {self.latency_mode}")
+
+    def get_latency_mode(self):
+        return self.latency_mode
+
+    @staticmethod
+    def get_available_latency_modes():
+        """UIで選択可能なレイテンシモードのリストを返す"""
+        return [
+            ("instant", "速さ優先 (短く即答)"),
+            ("balanced", "標準"),
+            ("thorough", "じっくり (詳しく考える)"),
+        ]
+
     @staticmethod
     def get_available_models():
         """UIで選択可能なモデルリストを返す"""
@@ -46,45 +82,136 @@ class RemoteAIModule:
             ("gemini-3-pro-preview", "Gemini 3 Pro (Preview)"),
             ("gemini-2.5-flash", "Gemini 2.5 Flash"),
             ("gemini-2.0-flash", "Gemini 2.0 Flash (推奨・安定)"),
+            ("auto", "自動 (質問に合わせて選択)"),
         ]
 
-    def analyze_screen(self, screenshot_path, user_question):
+    def request_timeout(self, priority):
+        """
+        優先度ごとの応答待ちの上限（秒）
+        ナビゲーションでも、思考量の多い thorough モードや Pro モデル（検索への自動切り替えを含む）では
+        20秒を超えることが多いので、対話と同じ上限まで延ばす
+        """
+        timeout = REQUEST_TIMEOUTS.get(priority, REQUEST_TIMEOUTS["interactive"])
+        if priority == "navigation" and (self.latency_mode == "thorough" or "-pro" in (self.current_model or "")):
+            timeout = max(timeout, REQUEST_TIMEOUTS["interactive"])
+        return timeout
+
+    def start_session(self):
+        """
+        バックエンドに会話セッションを作成
+        以降の質問では画像や履歴を再送せずに session_id だけを送ればよくなる
+        """
+        try:
+            response = requests.post(f"{self.backend_url}/sessions", timeout=10)
+            if response.status_code == 200:
+                self.session_id = response.json().get("session_id")
+                print(f"Backend session started: {self.session_id}")
+                return self.session_id
+            print(f"Session Error ({response.status_code}): {response.text}")
+        except Exception as e:
+            print(f"Session Connection Error: {str(e)}")
+        self.session_id = None
+        return None
+
+    def end_session(self):
+        """現在のセッションを破棄"""
+        if not self.session_id:
+            return
+        try:
+            requests.delete(f"{self.backend_url}/sessions/{self.session_id}", timeout=5)
+        except Exception as e:
+            print(f"Session Connection Error: {str(e)}")
+        self.session_id = None
+
+    def record_local_turn(self, user_question, answer):
+        """
+        モデルを呼ばずにローカルで答えたやり取りを、次のセッションへのリクエストで一緒に送る
+        （バックエンドのセッションの会話履歴に残し、続く質問の文脈に含めるため）
+        """
+        self.pending_turns.append({"role": "user", "text": user_question})
+        self.pending_turns.append({"role": "assistant", "text": answer})
+        del self.pending_turns[:-MAX_PENDING_TURNS]
+
+    def analyze_screen(self, screenshot_path, user_question, priority="interactive"):
         """
         スクリーンショットをバックエンドに送信して分析
+        priority: "interactive"（ユーザーの質問）/ "navigation"（自動ナビゲーション）/ "batch"（一括処理）
         """
         if not self.backend_url:
             return {"success": False, "error": "Backend URL not configured"}
 
+        # モデル情報を含める
+        data = {
+            'question': user_question,
+            'model': self.current_model
+        }
+        return self._post_analyze(data, screenshot_path, priority)
+
+    def analyze_in_session(self, user_question, screenshot_path=None, priority="interactive"):
+        """
+        セッションを使って分析
+        screenshot_path を省略した場合はセッションにアップロード済みの画像を使う（質問文だけを送信）
+        """
+        if not self.backend_url:
+            return {"success": False, "error": "Backend URL not configured"}
+
+        if not self.session_id and not self.start_session():
+            return {"success": False, "error": "Session unavailable", "session_unavailable": True}
+
+        data = {
+            'question': user_question,
+            'model': self.current_model,
+            'session_id': self.session_id
+        }
+        turns = list(self.pending_turns)
+        if turns:
+            data['turns'] = json.dumps(turns, ensure_ascii=False)
+        result = self._post_analyze(data, screenshot_path, priority)
+        if result.get("session_expired"):
+            # 期限切れ: 次回は新しいセッションを作成する（ローカルのターンはそのセッションに送る）
+            self.session_id = None
+        if turns and result.get("turns_recorded") == len(turns):
+            # バックエンドが記録したと返したターンだけを消す（接続エラー・タイムアウトなどでは次の送信で送り直す）
+            del self.pending_turns[:len(turns)]
+        return result
+
+    def _post_analyze(self, data, screenshot_path=None, priority="interactive"):
+        """/analyze にフォームデータと画像を送信（優先度と期限をヘッダーで伝える）"""
+        if self.latency_budget_ms:
+            data['latency_budget_ms'] = str(self.latency_budget_ms)
+        if self.latency_mode:
+            data['mode'] = self.latency_mode
+        files = []
+        opened_files = []
         try:
-            files = []
             # パスのリストか単一パスかを判定
-            paths = screenshot_path if isinstance(screenshot_path, list) else [screenshot_path]
+            if screenshot_path:
+                paths = screenshot_path if isinstance(screenshot_path, list) else [screenshot_path]
+            else:
+                paths = []
             
             # ファイルを開いてリストに追加
-            opened_files = []
             for path in paths:
                 try:
                     f = open(path, 'rb')
                     opened_files.append(f)
                     # keyを 'images' にして複数送信対応
-                    files.append(('images', (os.path.basename(path), f, 'image/png')))
+                    # JPEG/WebP はバックエンドで再エンコードせずにそのまま使われるため、形式を正しく伝える
+                    mime_type = mimetypes.guess_type(path)[0] or 'image/png'
+                    files.append(('images', (os.path.basename(path), f, mime_type)))
                 except Exception as e:
                     print(f"Error opening file {path}: {e}")
 
-            # モデル情報を含める
-            data = {
-                'question': user_question,
-                'model': self.current_model
-            }
-            
             # リクエスト送信
             target_url = f"{self.backend_url}/analyze"
-            print(f"Sending request to: {target_url} (Model: {self.current_model})")
-            response = requests.post(target_url, data=data, files=files)
-            
-            # ファイルを閉じる
-            for f in opened_files:
-                f.close()
+            timeout = self.request_timeout(priority)
+            headers = {
+                'X-Request-Priority': priority,
+                'X-Request-Timeout-Ms': str(int(timeout * 1000)),
+            }
+            print(f"Sending request to: {target_url} (Model: {self.current_model}, Images: {len(files)}, Priority: {priority})")
+            # バックエンドの期限切れ応答（504）を受け取れるよう、接続の待ち時間には少し余裕を持たせる
+            response = requests.post(target_url, data=data, files=files, headers=headers, timeout=timeout + 5)
             
             if response.status_code == 200:
                 result = response.json()
@@ -92,12 +219,30 @@ class RemoteAIModule:
             else:
                 error_msg = f"Server Error ({response.status_code}): {response.text}"
                 print(error_msg)
-                return {"success": False, "error": error_msg}
+                result = {"success": False, "error": error_msg, "status_code": response.status_code}
+                try:
+                    # 断られた・失敗した場合でも、セッションに記録済みのローカルのターン数は返ってくる
+                    result["turns_recorded"] = int(response.json().get("turns_recorded") or 0)
+                except (ValueError, AttributeError):
+                    pass
+                if response.status_code == 404:
+                    try:
+                        result["session_expired"] = bool(response.json().get("session_expired"))
+                    except ValueError:
+                        pass
+                elif response.status_code == 413 and data.get('session_id'):
+                    # 画像がセッションに保持できる上限を超えた: セッションを使わずに送り直させる
+                    result["session_unavailable"] = True
+                return result
                 
         except Exception as e:
             error_msg = f"Connection Error: {str(e)}"
             print(error_msg)
             return {"success": False, "error": error_msg}
+        finally:
+            # ファイルを閉じる
+            for f in opened_files:
+                f.close()
 
 # テスト用
 if __name__ == "__main__":
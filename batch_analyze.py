@@ -0,0 +1,247 @@
+"""
+SENP_AI - Batch Analysis CLI
+スクリーンショットのディレクトリ（またはマニフェスト）をまとめて分析するコマンドラインツール
+
+UI（Tk）を使わないので、ディスプレイのない環境でも実行できる。
+結果は1件1行のJSONLで書き出し、途中で止めても同じ出力ファイルを指定すれば続きから再開する。
+
+使い方:
+    # screenshots/ の全画像に同じ質問をする（クラウドバックエンド経由）
+    python batch_analyze.py --images screenshots --question "この画面を要約してください。" --output results.jsonl
+
+    # マニフェスト（1行1件のJSONL: {"id": ..., "image": "path" または ["path", ...], "question": "..."}）
+    python batch_analyze.py --manifest qa.jsonl --concurrency 4 --rate 2 --output qa_results.jsonl
+
+    # バックエンドを介さず、cloud_backend の AIModule を直接使う（GOOGLE_API_KEY が必要）
+    python batch_analyze.py --images screenshots --question "..." --local
+"""
+
+import argparse
+import glob
+import hashlib
+import json
+import os
+import statistics
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".webp")
+
+# リトライする一時的なエラー（レート制限・受付制御による拒否・サーバー側の一時障害）
+# 結果の status_code（バックエンドの HTTP ステータス、または Gemini API のエラーコード）で判定する
+RETRYABLE_STATUS = (429, 500, 502, 503, 504)
+
+
+class RateLimiter:
+    """1秒あたりのリクエスト数を制限するトークンバケット（スレッドセーフ）"""
+
+    def __init__(self, rate, burst=1):
+        self.rate = rate
+        self.capacity = max(1, burst)
+        self.tokens = float(self.capacity)
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        if not self.rate:
+            return
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+def item_id(paths, question):
+    """画像パスと質問から、再開時に同じ項目を識別するIDを作る"""
+    key = json.dumps([[os.path.normpath(p) for p in paths], question], ensure_ascii=False)
+    return hashlib.sha1(key.encode("utf-8")).hexdigest()[:16]
+
+
+def load_items(args):
+    """ディレクトリまたはマニフェストから分析する項目のリストを作る"""
+    items = []
+    if args.manifest:
+        base = os.path.dirname(os.path.abspath(args.manifest))
+        with open(args.manifest, encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                entry = json.loads(line)
+                paths = entry.get("images") or entry.get("image")
+                paths = paths if isinstance(paths, list) else [paths]
+                # マニフェストからの相対パスを許容する
+                paths = [p if os.path.isabs(p) else os.path.join(base, p) for p in paths]
+                question = entry.get("question") or args.question[0]
+                items.append({"id": str(entry.get("id") or item_id(paths, question)),
+                              "images": paths, "question": question})
+    else:
+        paths = sorted(p for p in glob.glob(os.path.join(args.images, "*"))
+                       if p.lower().endswith(IMAGE_EXTENSIONS))
+        for path in paths:
+            for question in args.question:
+                items.append({"id": item_id([path], question), "images": [path], "question": question})
+    if args.limit:
+        items = items[:args.limit]
+    return items
+
+
+def load_done(output_path, retry_failed):
+    """既存の出力ファイルから完了済みの項目IDを読み込む（再開用）"""
+    done = set()
+    if not os.path.exists(output_path):
+        return done
+    with open(output_path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue  # 中断時に書きかけになった行
+            if record.get("success") or not retry_failed:
+                done.add(record.get("id"))
+    return done
+
+
+class RemoteAnalyzer:
+    """クラウドバックエンド（RemoteAIModule）経由で分析"""
+
+    def __init__(self, args):
+        from ai_client import RemoteAIModule
+        self.module = RemoteAIModule(args.backend)
+        if args.model:
+            self.module.set_model(args.model)
+        if args.mode:
+            self.module.set_latency_mode(args.mode)
+        self.priority = args.priority
+
+    def analyze(self, paths, question):
+        return self.module.analyze_screen(paths if len(paths) > 1 else paths[0], question, priority=self.priority)
+
+
+class LocalAnalyzer:
+    """cloud_backend の AIModule を直接使って分析"""
+
+    def __init__(self, args):
+        sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "cloud_backend"))
+        from ai_logic import AIModule
+        from preprocess import PreprocessConfig, preprocess_images
+        self.module = AIModule()
+        self.model = args.model
+        self.mode = args.mode
+        self.config = PreprocessConfig.from_env()
+        self.preprocess_images = preprocess_images
+
+    def analyze(self, paths, question):
+        from PIL import Image
+        images = []
+        for path in paths:
+            with Image.open(path) as img:
+                img.load()
+                images.append(img.copy())
+        images = self.preprocess_images(images, self.config)
+        return self.module.analyze_images(images, question, model_override=self.model, mode=self.mode)
+
+
+def run_item(analyzer, limiter, item, retries):
+    """1項目を分析（一時的なエラーは指数バックオフでリトライ）"""
+    attempt = 0
+    while True:
+        limiter.acquire()
+        start = time.perf_counter()
+        result = analyzer.analyze(item["images"], item["question"])
+        latency_ms = (time.perf_counter() - start) * 1000
+        if result.get("success") or attempt >= retries or result.get("status_code") not in RETRYABLE_STATUS:
+            return result, latency_ms, attempt
+        attempt += 1
+        time.sleep(min(30.0, 2 ** attempt))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="SENP_AI batch analysis (headless)")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--images", help="分析する画像のディレクトリ")
+    source.add_argument("--manifest", help="項目を1行ずつ書いたJSONL（id / image(s) / question）")
+    parser.add_argument("--question", action="append", default=None,
+                        help="質問（複数指定可。マニフェストで質問を省略した項目にも使う）")
+    parser.add_argument("--output", default="batch_results.jsonl", help="結果を追記するJSONL")
+    parser.add_argument("--concurrency", type=int, default=2, help="同時に実行するリクエスト数")
+    parser.add_argument("--rate", type=float, default=1.0, help="1秒あたりの最大リクエスト数（0で無制限）")
+    parser.add_argument("--retries", type=int, default=3, help="一時的なエラーのリトライ回数")
+    parser.add_argument("--retry-failed", action="store_true", help="再開時に失敗した項目もやり直す")
+    parser.add_argument("--limit", type=int, default=0, help="先頭から N 件だけ実行")
+    parser.add_argument("--model", default=None)
+    parser.add_argument("--mode", default=None, choices=["instant", "balanced", "thorough"])
+    parser.add_argument("--priority", default="batch", choices=["interactive", "navigation", "batch"])
+    parser.add_argument("--backend", default=None, help="バックエンドのURL（省略時は SENP_AI_BACKEND_URL）")
+    parser.add_argument("--local", action="store_true", help="バックエンドを介さず AIModule を直接使う")
+    args = parser.parse_args()
+    if not args.question:
+        args.question = ["この画面の内容を要約して、何ができるページか教えてください。"]
+
+    items = load_items(args)
+    done = load_done(args.output, args.retry_failed)
+    pending = [item for item in items if item["id"] not in done]
+    print(f"{len(items)} items, {len(items) - len(pending)} already done, {len(pending)} to run")
+    if not pending:
+        return
+
+    analyzer = LocalAnalyzer(args) if args.local else RemoteAnalyzer(args)
+    limiter = RateLimiter(args.rate, burst=args.concurrency)
+    write_lock = threading.Lock()
+    latencies = []
+    errors = 0
+
+    with open(args.output, "a", encoding="utf-8") as out, \
+            ThreadPoolExecutor(max_workers=max(1, args.concurrency)) as executor:
+        futures = {executor.submit(run_item, analyzer, limiter, item, args.retries): item for item in pending}
+        for count, future in enumerate(as_completed(futures), 1):
+            item = futures[future]
+            try:
+                result, latency_ms, retried = future.result()
+            except Exception as e:
+                result, latency_ms, retried = {"success": False, "error": str(e)}, 0.0, 0
+            record = {
+                "id": item["id"],
+                "images": item["images"],
+                "question": item["question"],
+                "success": bool(result.get("success")),
+                "answer": result.get("answer"),
+                "model": result.get("model"),
+                "target_boxes": result.get("target_boxes"),
+                "error": result.get("error"),
+                "status_code": result.get("status_code"),
+                "latency_ms": round(latency_ms, 1),
+                "retries": retried,
+                "finished_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            }
+            # 1件ごとに書き出して flush する（中断しても完了分は失われない）
+            with write_lock:
+                out.write(json.dumps(record, ensure_ascii=False) + "\n")
+                out.flush()
+            if record["success"]:
+                latencies.append(latency_ms)
+            else:
+                errors += 1
+            status = "ok " if record["success"] else "ERR"
+            print(f"[{count}/{len(pending)}] {status} {latency_ms:8.1f}ms {item['id']} {os.path.basename(item['images'][0])}")
+
+    if latencies:
+        ordered = sorted(latencies)
+        p95 = ordered[min(len(ordered) - 1, int(round(0.95 * (len(ordered) - 1))))]
+        print(f"Done: {len(latencies)} ok, {errors} errors, "
+              f"latency p50={statistics.median(ordered):.1f}ms p95={p95:.1f}ms")
+    else:
+        print(f"Done: 0 ok, {errors} errors")
+    print(f"Results appended to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,130 @@
+"""
+OCR ベンチマーク
+
+画面全体の OCR にかかる時間を、次の3つの状態で計測する。
+
+- cold:      タイルのキャッシュが空の状態（初めて見る画面）
+- changed:   画面の約10%（--change-ratio）を書き換えた状態（変わったタイルだけを読み直す）
+- unchanged: 同じ画面をもう一度読む状態（すべてのタイルがキャッシュに当たる）
+
+比較用に、タイルに分けずに1プロセスで画面全体を OCR した時間（full）も計測する。
+pytesseract と Tesseract 本体が必要。
+
+使い方:
+    python bench_ocr.py                       # 3840x2160 の合成画面
+    python bench_ocr.py --image screenshots/screenshot_xxx.png --workers 4
+    python bench_ocr.py --skip-full
+"""
+
+import argparse
+import random
+import time
+
+from PIL import Image, ImageDraw, ImageFont
+
+import ocr_index
+from ocr_index import TiledOCR, run_ocr
+
+SAMPLE_WORDS = ["File", "Edit", "View", "Settings", "Save", "Cancel", "Open", "Export", "Search",
+                "Help", "Account", "Profile", "Display", "Theme", "Language", "Apply", "Close"]
+
+
+def load_font(size):
+    for name in ("arial.ttf", "DejaVuSans.ttf", "meiryo.ttc"):
+        try:
+            return ImageFont.truetype(name, size)
+        except OSError:
+            continue
+    return ImageFont.load_default()
+
+
+def synthetic_screen(width, height, seed=0):
+    """メニュー・ボタン・本文の行が並ぶ合成画面"""
+    rng = random.Random(seed)
+    image = Image.new("L", (width, height), 245)
+    draw = ImageDraw.Draw(image)
+    font = load_font(22)
+    # メニューバー
+    draw.rectangle((0, 0, width, 40), fill=225)
+    x = 20
+    for word in SAMPLE_WORDS[:8]:
+        draw.text((x, 8), word, fill=20, font=font)
+        x += 140
+    # 本文の行（左右2段組み、ところどころ空白を残す）
+    for column in (0, width // 2):
+        y = 80
+        while y < height - 60:
+            if rng.random() < 0.75:
+                line = " ".join(rng.choice(SAMPLE_WORDS) for _ in range(rng.randint(3, 9)))
+                draw.text((column + 40, y), line, fill=30, font=font)
+            y += 36
+    return image
+
+
+def change_region(image, ratio, seed=1):
+    """画面の ratio の面積を、別の内容の矩形で書き換えた画像を返す"""
+    changed = image.copy()
+    width, height = changed.size
+    region_w = int(width * (ratio ** 0.5))
+    region_h = int(height * (ratio ** 0.5))
+    left = (width - region_w) // 3
+    top = (height - region_h) // 3
+    patch = synthetic_screen(region_w, region_h, seed=seed)
+    changed.paste(patch, (left, top))
+    return changed
+
+
+def timed(func, *args):
+    started = time.perf_counter()
+    result = func(*args)
+    return (time.perf_counter() - started) * 1000, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="SENP_AI tiled OCR benchmark")
+    parser.add_argument("--image", help="計測に使う画面（省略時は合成画面）")
+    parser.add_argument("--width", type=int, default=3840)
+    parser.add_argument("--height", type=int, default=2160)
+    parser.add_argument("--workers", type=int, default=None, help="OCR のプロセス数（0 でプロセスを使わない）")
+    parser.add_argument("--change-ratio", type=float, default=0.1, help="changed で書き換える面積の割合")
+    parser.add_argument("--skip-full", action="store_true", help="タイルに分けない OCR の計測を省く")
+    args = parser.parse_args()
+
+    if ocr_index.pytesseract is None:
+        print("pytesseract がインストールされていません: pip install pytesseract")
+        return
+
+    if args.image:
+        screen = Image.open(args.image).convert("L")
+    else:
+        screen = synthetic_screen(args.width, args.height)
+    changed = change_region(screen, args.change_ratio)
+    print(f"screen: {screen.size[0]}x{screen.size[1]}")
+
+    ocr = TiledOCR(max_workers=args.workers)
+    try:
+        # プロセスの起動時間を含めないように、先に1タイル分を読ませておく
+        ocr.run(screen.crop((0, 0, ocr.tile_width, ocr.tile_height)))
+        ocr.clear()
+
+        rows = []
+        if not args.skip_full:
+            elapsed, words = timed(run_ocr, screen)
+            rows.append(("full", elapsed, len(words), None))
+        for label, image in (("cold", screen), ("changed", changed), ("unchanged", changed)):
+            elapsed, (words, stats) = timed(ocr.run, image)
+            rows.append((label, elapsed, len(words), stats))
+
+        print(f"workers: {ocr.max_workers}, tile: {ocr.tile_width}x{ocr.tile_height} (overlap {ocr.overlap})")
+        for label, elapsed, word_count, stats in rows:
+            detail = ""
+            if stats:
+                detail = (f"  tiles: {stats['ocr']:3d} read / {stats['cached']:3d} cached / "
+                          f"{stats['blank']:3d} blank of {stats['tiles']}")
+            print(f"{label:9s} {elapsed:9.1f} ms  words={word_count:5d}{detail}")
+    finally:
+        ocr.shutdown()
+
+
+if __name__ == "__main__":
+    main()
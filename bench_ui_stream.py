@@ -0,0 +1,141 @@
+"""
+ストリーミング表示ベンチマーク
+
+ワーカースレッドから一定の速度で回答のチャンクを流し込み、
+履歴ペインに描画できた文字数（chars/s）と Tk のイベントループの遅れを計測する。
+
+- batched: SENPAI_UI.append_stream（バッファに溜めて約30fpsでまとめて描画）
+- naive:   チャンクごとに state の切り替え・挿入・see(END) を行う（従来の add_message と同じやり方）
+
+ディスプレイが必要（Tk のウィンドウを開く）。
+
+使い方:
+    python bench_ui_stream.py --chars-per-sec 4000 --chunk 4 --duration 5
+    python bench_ui_stream.py --mode naive
+"""
+
+import argparse
+import statistics
+import threading
+import time
+import tkinter as tk
+
+from ui import SENPAI_UI
+
+SAMPLE_TEXT = ("この画面では、右上の設定ボタンから表示の言語やテーマを変更できます。"
+               "保存する場合は、画面下部の「保存」ボタンを押してください。\n")
+
+# イベントループの遅れを測るプローブの間隔（ミリ秒）
+PROBE_INTERVAL_MS = 10
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(pct / 100.0 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+class LoopProbe:
+    """root.after の予定時刻からの遅れを計測"""
+
+    def __init__(self, root):
+        self.root = root
+        self.lags = []
+        self.running = True
+        self._expected = None
+
+    def start(self):
+        self._expected = time.monotonic() + PROBE_INTERVAL_MS / 1000
+        self.root.after(PROBE_INTERVAL_MS, self._tick)
+
+    def _tick(self):
+        now = time.monotonic()
+        self.lags.append(max(0.0, (now - self._expected) * 1000))
+        if self.running:
+            self.start()
+
+
+def naive_append(ui, text, counter):
+    """チャンクごとにウィジェットを更新する（比較用）"""
+    ui.history_text.config(state=tk.NORMAL)
+    ui.history_text.insert(tk.END, text, "assistant")
+    ui.history_text.see(tk.END)
+    ui.history_text.config(state=tk.DISABLED)
+    counter["chars"] += len(text)
+
+
+def run(mode, chars_per_sec, chunk, duration):
+    ui = SENPAI_UI([("bench", "Bench")], lambda q: None, lambda: None, lambda e: None, lambda m: None)
+    probe = LoopProbe(ui.root)
+    naive_counter = {"chars": 0}
+    sent = {"chars": 0}
+    result = {}
+
+    def producer():
+        interval = chunk / chars_per_sec
+        text = SAMPLE_TEXT * (int(chars_per_sec * duration) // len(SAMPLE_TEXT) + 1)
+        if mode == "batched":
+            ui.begin_stream("assistant", "00:00:00")
+        start = time.perf_counter()
+        position = 0
+        while time.perf_counter() - start < duration:
+            piece = text[position:position + chunk]
+            position += chunk
+            if mode == "batched":
+                ui.append_stream(piece)
+            else:
+                ui.dispatcher.post(naive_append, (ui, piece, naive_counter))
+            sent["chars"] += len(piece)
+            # 送信のタイミングは開始時刻基準で決める（遅れても速度を保つ）
+            next_at = start + position / chunk * interval
+            time.sleep(max(0.0, next_at - time.perf_counter()))
+        if mode == "batched":
+            ui.end_stream(model="bench")
+        # 描画が追いつくのを待ってから集計
+        ui.dispatcher.call(lambda: None, timeout=30)
+        time.sleep(0.2)
+        ui.dispatcher.call(finish, timeout=30)
+
+    def finish():
+        rendered = ui.stream_stats["chars"] if mode == "batched" else naive_counter["chars"]
+        probe.running = False
+        result.update({
+            "mode": mode,
+            "sent_chars": sent["chars"],
+            "rendered_chars": rendered,
+            "rendered_chars_per_sec": round(rendered / duration, 1),
+            "flushes": ui.stream_stats["flushes"] if mode == "batched" else sent["chars"] // chunk,
+            "loop_lag_ms_p50": round(percentile(probe.lags, 50), 2),
+            "loop_lag_ms_p95": round(percentile(probe.lags, 95), 2),
+            "loop_lag_ms_max": round(max(probe.lags), 2) if probe.lags else 0.0,
+            "loop_lag_ms_mean": round(statistics.mean(probe.lags), 2) if probe.lags else 0.0,
+        })
+        ui.close()
+
+    ui.root.after(200, probe.start)
+    ui.root.after(300, lambda: threading.Thread(target=producer, daemon=True).start())
+    ui.run()
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="SENP_AI streaming render benchmark")
+    parser.add_argument("--mode", choices=["batched", "naive", "both"], default="both")
+    parser.add_argument("--chars-per-sec", type=float, default=4000.0, help="流し込む速度（文字/秒）")
+    parser.add_argument("--chunk", type=int, default=4, help="1チャンクの文字数")
+    parser.add_argument("--duration", type=float, default=5.0, help="流し込む時間（秒）")
+    args = parser.parse_args()
+
+    modes = ["batched", "naive"] if args.mode == "both" else [args.mode]
+    for mode in modes:
+        r = run(mode, args.chars_per_sec, args.chunk, args.duration)
+        print(f"{r['mode']:8s} rendered={r['rendered_chars_per_sec']:9.1f} chars/s "
+              f"({r['rendered_chars']}/{r['sent_chars']})  flushes={r['flushes']:6d}  "
+              f"loop lag: p50={r['loop_lag_ms_p50']:6.2f}ms p95={r['loop_lag_ms_p95']:6.2f}ms "
+              f"max={r['loop_lag_ms_max']:7.2f}ms")
+
+
+if __name__ == "__main__":
+    main()
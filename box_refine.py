@@ -0,0 +1,125 @@
+"""
+Box Refine Module
+モデルが返した大まかな矩形を、キャプチャ画像上の実際の UI 要素の輪郭に合わせて補正する
+
+- 矩形の周辺だけを切り出してエッジを検出し、輪郭の外接矩形を候補にする
+- 枠線のないボタン（文字だけのリンクなど）に備えて、矩形内のエッジを囲む最小の矩形も候補にする
+- 各候補を「元の矩形との重なり（IoU）」と「候補の辺がエッジに乗っている割合」で採点し、最も良いものを返す
+- 採点結果をそのまま確からしさ（0-1）として返すので、呼び出し側は低ければ元の矩形を使う
+"""
+
+import cv2
+import numpy as np
+
+# 元の矩形の周囲を探す幅（矩形の大きさに対する割合と最小値、ピクセル）
+SEARCH_PAD_RATIO = 0.5
+SEARCH_MIN_PAD = 24
+# 候補として認める大きさ（元の矩形の面積に対する比）
+MIN_AREA_RATIO = 0.2
+MAX_AREA_RATIO = 3.0
+# 文字だけの要素の外接矩形に足す余白（ピクセル）
+CONTENT_PADDING = 4
+
+
+def refine_box(gray, box):
+    """
+    大まかな矩形を、周辺で最も当てはまりの良い UI 要素の矩形に補正する
+
+    Args:
+        gray: キャプチャ画像（グレースケールの numpy 配列、物理ピクセル）
+        box: (left, top, right, bottom) モデルが返した矩形（物理ピクセル）
+
+    Returns:
+        ((left, top, right, bottom), confidence): 補正後の矩形と確からしさ（0-1）
+        候補が見つからなければ元の矩形と 0.0
+    """
+    height, width = gray.shape[:2]
+    left, top, right, bottom = (int(round(v)) for v in box)
+    left, right = max(0, left), min(width, right)
+    top, bottom = max(0, top), min(height, bottom)
+    if right - left < 2 or bottom - top < 2:
+        return tuple(box), 0.0
+
+    # 周辺の探索範囲だけを処理する
+    pad_x = max(SEARCH_MIN_PAD, int((right - left) * SEARCH_PAD_RATIO))
+    pad_y = max(SEARCH_MIN_PAD, int((bottom - top) * SEARCH_PAD_RATIO))
+    roi_left, roi_top = max(0, left - pad_x), max(0, top - pad_y)
+    roi_right, roi_bottom = min(width, right + pad_x), min(height, bottom + pad_y)
+    roi = gray[roi_top:roi_bottom, roi_left:roi_right]
+
+    edges = cv2.Canny(roi, 50, 150)
+    # 枠線の途切れをつないでから輪郭を取り、辺の判定は1px のずれを許す
+    closed = cv2.morphologyEx(edges, cv2.MORPH_CLOSE, np.ones((3, 3), np.uint8))
+    support_map = cv2.dilate(edges, np.ones((3, 3), np.uint8))
+    contours, _ = cv2.findContours(closed, cv2.RETR_LIST, cv2.CHAIN_APPROX_SIMPLE)
+
+    coarse = (left - roi_left, top - roi_top, right - roi_left, bottom - roi_top)
+    candidates = []
+    for contour in contours:
+        x, y, w, h = cv2.boundingRect(contour)
+        candidates.append((x, y, x + w, y + h))
+    content = _content_rect(edges, coarse)
+    if content is not None:
+        candidates.append(content)
+
+    center_x = (coarse[0] + coarse[2]) / 2
+    center_y = (coarse[1] + coarse[3]) / 2
+    coarse_area = float((coarse[2] - coarse[0]) * (coarse[3] - coarse[1]))
+    best, best_score = None, 0.0
+    for rect in candidates:
+        x0, y0, x1, y1 = rect
+        if x1 - x0 < 6 or y1 - y0 < 6:
+            continue
+        # 元の矩形の中心を含まない候補は別の要素とみなす
+        if not (x0 <= center_x <= x1 and y0 <= center_y <= y1):
+            continue
+        area_ratio = (x1 - x0) * (y1 - y0) / coarse_area
+        if not (MIN_AREA_RATIO <= area_ratio <= MAX_AREA_RATIO):
+            continue
+        score = 0.5 * _iou(rect, coarse) + 0.5 * _border_support(support_map, rect)
+        if score > best_score:
+            best, best_score = rect, score
+
+    if best is None:
+        return tuple(box), 0.0
+    refined = (best[0] + roi_left, best[1] + roi_top, best[2] + roi_left, best[3] + roi_top)
+    return refined, round(best_score, 3)
+
+
+def _content_rect(edges, coarse):
+    """矩形内のエッジ（文字やアイコン）を囲む最小の矩形（余白付き）"""
+    x0, y0, x1, y1 = coarse
+    ys, xs = np.nonzero(edges[y0:y1, x0:x1])
+    if len(xs) == 0:
+        return None
+    height, width = edges.shape[:2]
+    return (
+        max(0, x0 + int(xs.min()) - CONTENT_PADDING),
+        max(0, y0 + int(ys.min()) - CONTENT_PADDING),
+        min(width, x0 + int(xs.max()) + 1 + CONTENT_PADDING),
+        min(height, y0 + int(ys.max()) + 1 + CONTENT_PADDING),
+    )
+
+
+def _iou(a, b):
+    inter_w = min(a[2], b[2]) - max(a[0], b[0])
+    inter_h = min(a[3], b[3]) - max(a[1], b[1])
+    if inter_w <= 0 or inter_h <= 0:
+        return 0.0
+    inter = inter_w * inter_h
+    union = (a[2] - a[0]) * (a[3] - a[1]) + (b[2] - b[0]) * (b[3] - b[1]) - inter
+    return inter / float(union)
+
+
+def _border_support(support_map, rect):
+    """矩形の4辺のうち、エッジの上に乗っているピクセルの割合"""
+    x0, y0, x1, y1 = rect
+    border = np.concatenate([
+        support_map[y0, x0:x1],
+        support_map[y1 - 1, x0:x1],
+        support_map[y0:y1, x0],
+        support_map[y0:y1, x1 - 1],
+    ])
+    if border.size == 0:
+        return 0.0
+    return float(np.count_nonzero(border)) / border.size
@@ -0,0 +1,189 @@
+"""
+Admission Control
+同時実行数の制限・優先度付きの待ち行列・期限（デッドライン）による受付制御
+
+- interactive（ユーザーの質問）> navigation（自動ナビゲーション）> batch（一括処理）の順に処理する
+- 待ち行列が満杯の場合は、より優先度の低い待機中のリクエストを追い出すか、新しいリクエストを拒否する
+- 期限までに処理を終えられない見込みのリクエストは、待たせずに（または待機中に）打ち切る
+- クライアントが切断したリクエストは待ち行列から外し、実行中であれば上流の呼び出しを取り消す
+"""
+
+import heapq
+import itertools
+import os
+import socket
+import threading
+import time
+
+PRIORITIES = {"interactive": 0, "navigation": 1, "batch": 2}
+DEFAULT_PRIORITY = "interactive"
+
+# 待機中に期限・切断を確認する間隔（秒）
+POLL_INTERVAL = 0.25
+
+
+class AdmissionRejected(Exception):
+    """受付を拒否・打ち切ったリクエスト"""
+
+    def __init__(self, reason, status, retry_after=None):
+        super().__init__(reason)
+        self.reason = reason
+        self.status = status
+        self.retry_after = retry_after
+
+
+def client_disconnected(environ):
+    """
+    クライアントが接続を閉じたかを判定（gunicorn のソケットを読み取らずに覗く）
+    リクエスト本文は読み終えているので、EOF が読めれば切断されている
+    """
+    sock = environ.get("gunicorn.socket")
+    if sock is None:
+        return False
+    try:
+        return sock.recv(1, socket.MSG_PEEK | socket.MSG_DONTWAIT) == b""
+    except (BlockingIOError, InterruptedError):
+        return False
+    except OSError:
+        return True
+
+
+class _Waiter:
+    def __init__(self, priority, deadline):
+        self.priority = priority
+        self.deadline = deadline
+        self.admitted = False
+        self.rejected = None
+
+
+class AdmissionController:
+    """
+    同時実行数を制限し、待ち行列を優先度順に処理するスレッドセーフな受付制御
+    """
+
+    def __init__(self, max_concurrent=None, max_queue=None):
+        """
+        Args:
+            max_concurrent: 同時に Gemini を呼び出すリクエスト数の上限
+            max_queue: 待ち行列の長さの上限
+        """
+        if max_concurrent is None:
+            max_concurrent = int(os.environ.get("ADMISSION_MAX_CONCURRENT", "8"))
+        if max_queue is None:
+            max_queue = int(os.environ.get("ADMISSION_MAX_QUEUE", "24"))
+
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+
+        self._cond = threading.Condition()
+        self._queue = []  # heap of (priority, seq, waiter)
+        self._seq = itertools.count()
+        self._in_flight = 0
+        # 1リクエストの処理時間の指数移動平均（期限に間に合うかの見積もりに使う）
+        self._service_seconds = float(os.environ.get("ADMISSION_INITIAL_SERVICE_SECONDS", "5.0"))
+        self._counters = {
+            "admitted": 0,
+            "rejected_queue_full": 0,
+            "shed_deadline": 0,
+            "shed_priority": 0,
+            "cancelled_disconnect": 0,
+        }
+
+    def _expected_wait_locked(self, rank):
+        """待ち行列の rank 番目のリクエストが実行を始めるまでの見込み時間"""
+        free = self.max_concurrent - self._in_flight
+        if rank < free:
+            return 0.0
+        return ((rank - free) // self.max_concurrent + 1) * self._service_seconds
+
+    def _remove_locked(self, waiter):
+        self._queue = [item for item in self._queue if item[2] is not waiter]
+        heapq.heapify(self._queue)
+
+    def _admit_waiting_locked(self):
+        """空きスロットに優先度の高い順に待機中のリクエストを入れる"""
+        while self._queue and self._in_flight < self.max_concurrent:
+            _, _, waiter = heapq.heappop(self._queue)
+            waiter.admitted = True
+            self._in_flight += 1
+            self._counters["admitted"] += 1
+        self._cond.notify_all()
+
+    def acquire(self, priority=DEFAULT_PRIORITY, deadline=None, should_cancel=None):
+        """
+        実行枠を確保する（確保できるまで待つ）
+
+        Args:
+            priority: "interactive" / "navigation" / "batch"
+            deadline: time.monotonic() 基準の期限（None なら期限なし）
+            should_cancel: クライアントが切断したかを返す呼び出し可能オブジェクト
+
+        Raises:
+            AdmissionRejected: 待ち行列が満杯・期限に間に合わない・クライアントが切断した場合
+        """
+        rank = PRIORITIES.get(priority, PRIORITIES[DEFAULT_PRIORITY])
+        waiter = _Waiter(rank, deadline)
+        with self._cond:
+            ahead = sum(1 for item in self._queue if item[0] <= rank)
+            if deadline is not None:
+                expected_finish = time.monotonic() + self._expected_wait_locked(ahead) + self._service_seconds
+                if expected_finish > deadline:
+                    # 待っても間に合わないので、すぐに断ってクライアントに判断を任せる
+                    self._counters["shed_deadline"] += 1
+                    raise AdmissionRejected("deadline cannot be met", 503, retry_after=1)
+
+            if len(self._queue) >= self.max_queue:
+                lowest = max(self._queue, key=lambda item: (item[0], item[1]))
+                if lowest[0] <= rank:
+                    self._counters["rejected_queue_full"] += 1
+                    raise AdmissionRejected("admission queue is full", 503, retry_after=2)
+                # より優先度の低い待機中のリクエストを追い出して場所を空ける
+                lowest[2].rejected = AdmissionRejected("shed for a higher priority request", 503, retry_after=5)
+                self._remove_locked(lowest[2])
+                self._counters["shed_priority"] += 1
+                self._cond.notify_all()
+
+            heapq.heappush(self._queue, (rank, next(self._seq), waiter))
+            self._admit_waiting_locked()
+
+            while not waiter.admitted:
+                if waiter.rejected is not None:
+                    raise waiter.rejected
+                now = time.monotonic()
+                if deadline is not None and now + self._service_seconds > deadline:
+                    self._remove_locked(waiter)
+                    self._counters["shed_deadline"] += 1
+                    raise AdmissionRejected("deadline exceeded while queued", 504)
+                if should_cancel is not None and should_cancel():
+                    self._remove_locked(waiter)
+                    self._counters["cancelled_disconnect"] += 1
+                    raise AdmissionRejected("client disconnected", 499)
+                self._cond.wait(POLL_INTERVAL)
+
+    def release(self, service_seconds=None):
+        """実行枠を返す（処理時間を渡すと見積もりを更新する）"""
+        with self._cond:
+            self._in_flight -= 1
+            if service_seconds is not None:
+                self._service_seconds = 0.8 * self._service_seconds + 0.2 * service_seconds
+            self._admit_waiting_locked()
+
+    def record_cancelled(self):
+        """実行中にクライアントが切断して上流の呼び出しを取り消した"""
+        with self._cond:
+            self._counters["cancelled_disconnect"] += 1
+
+    def stats(self):
+        with self._cond:
+            depth = {name: 0 for name in PRIORITIES}
+            names = {rank: name for name, rank in PRIORITIES.items()}
+            for rank, _, _ in self._queue:
+                depth[names[rank]] += 1
+            return {
+                "in_flight": self._in_flight,
+                "max_concurrent": self.max_concurrent,
+                "queue_depth": depth,
+                "max_queue": self.max_queue,
+                "service_seconds_ewma": round(self._service_seconds, 3),
+                **self._counters,
+            }
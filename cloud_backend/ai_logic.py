@@ -1,10 +1,185 @@
 import os
 import io
 import json
-import re
+import asyncio
+import threading
+import concurrent.futures
 from google import genai
 from google.genai import types
 from PIL import Image
+import fake_genai
+from context_cache import ContextCacheManager
+from response_parser import BATCH_RESPONSE_SCHEMA, RESPONSE_SCHEMA, parse_batch_response, parse_response
+from tokens import estimate_tokens
+
+# 404などでモデルが使えない場合のフォールバック先（安定版）
+FALLBACK_MODEL = "gemini-2.0-flash"
+
+# システムプロンプト（全リクエスト共通。system_instruction として送信する）
+_BASE_PROMPT = """あなたはSENP_AIという画面分析AIアシスタントです。
+ユーザーの画面を見て、質問に丁寧に答えてください。
+こちらはWebページなどをスクロールして撮影した複数の画像（上から順）である可能性があります。
+その場合は、画像全体を通してページの内容を理解し、質問に答えてください。
+
+回答のガイドライン:
+- 画面に表示されている内容を正確に分析
+- もし質問の答えが画面上の情報に見つからない場合は、あなたの持つ一般知識を使って回答してください
+- 画面外の知識を使用する場合、「画面にはありませんが」等の前置きは不要です
+- 具体的で分かりやすい説明
+- 必要に応じて手順を示す
+- 日本語で回答
+- 親切で丁寧な口調
+- 専門用語が出た際は、初心者にもわかるように補足説明を加えてください。
+- あなたは「PCに詳しい頼れる先輩」です。わからないことは適当に答えず、検索機能を使って調べ、正確な回答を心がけてください。
+- 重要: 出力に「**」などのマークダウンによる強調（太字）は使用しないでください。プレーンテキストで回答してください。"""
+
+# 従来形式（回答末尾の [TARGET_BOX: ...] タグ）の座標ルール
+_TAG_BOX_RULES = """
+
+バウンディングボックスについて:
+もし回答の中で、ユーザーが画面上の特定の場所（ボタンやアイコンなど）を見るべき、または操作すべきだと判断した場合は、
+その要素の正確なバウンディングボックスを検出し、回答の最後に追記してください。
+
+座標のルール:
+- 座標は画像全体を基準にした0-1000のスケールで指定してください
+- フォーマット: [TARGET_BOX: y_min, x_min, y_max, x_max]
+- y_min: 対象要素の上端のy座標 (0=画像の上端, 1000=画像の下端)
+- x_min: 対象要素の左端のx座標 (0=画像の左端, 1000=画像の右端)
+- y_max: 対象要素の下端のy座標
+- x_max: 対象要素の右端のx座標
+- 座標は極めて正確に特定してください。対象の要素と少しでもズレているとユーザーが混乱します。
+- ボックスは対象の要素を「余白を含まずぴったりと」囲むように指定してください
+- もし対象が2枚目以降の画像にある場合は、BOXは出力せず言葉で補足してください
+
+例:
+- 画面中央のボタン(画面の50%の位置): [TARGET_BOX: 470, 450, 530, 550]
+- 画面左上の小さなアイコン: [TARGET_BOX: 50, 30, 100, 80]
+- 画面右下のボタン: [TARGET_BOX: 900, 850, 950, 950]"""
+
+# 構造化出力（JSON）の出力形式と座標ルール
+_JSON_BOX_RULES = """
+
+出力形式:
+指定されたJSONスキーマに従って出力してください。
+- answer: ユーザーへの回答（プレーンテキスト）
+- targets: ユーザーが画面上で見るべき、または操作すべき要素のリスト（複数可。該当がなければ空配列）
+  - label: 要素の短い名前（例: 保存ボタン）
+  - image_index: 要素が写っている画像の番号（1枚目=0, 2枚目=1, ...）
+  - box_2d: [y_min, x_min, y_max, x_max]
+- continue_navigation: ユーザーの操作後に続けて案内が必要な場合は true
+
+座標のルール:
+- 座標は画像全体を基準にした0-1000のスケールで指定してください
+- y_min, y_max: 対象要素の上端・下端のy座標 (0=画像の上端, 1000=画像の下端)
+- x_min, x_max: 対象要素の左端・右端のx座標 (0=画像の左端, 1000=画像の右端)
+- 座標は極めて正確に特定してください。対象の要素と少しでもズレているとユーザーが混乱します。
+- ボックスは対象の要素を「余白を含まずぴったりと」囲むように指定してください
+- 手順に複数の要素が関わる場合は、操作する順にすべての要素を targets に含めてください
+
+例:
+- 画面中央のボタン(画面の50%の位置): {"label": "OKボタン", "image_index": 0, "box_2d": [470, 450, 530, 550]}
+- 画面左上の小さなアイコン: {"label": "メニュー", "image_index": 0, "box_2d": [50, 30, 100, 80]}"""
+
+# 検索なしで回答させる場合に質問に添える指示（検索が必要なら合図だけを返させる）
+NEED_SEARCH_TAG = "[NEED_SEARCH]"
+NEED_SEARCH_INSTRUCTION = f"""
+
+（この回答では検索機能は使えません。画面の内容とあなたの知識だけでは正確に答えられない場合は、回答の代わりに {NEED_SEARCH_TAG} とだけ出力してください）"""
+
+SYSTEM_PROMPT = _BASE_PROMPT + _TAG_BOX_RULES
+STRUCTURED_SYSTEM_PROMPT = _BASE_PROMPT + _JSON_BOX_RULES
+
+# レイテンシモード（instant: 速さ優先 / balanced: 標準 / thorough: 品質優先）
+LATENCY_MODES = ("instant", "balanced", "thorough")
+
+# 回答（構造化出力の JSON。回答本文と複数のターゲット、バッチでは質問ごとの回答）に確保する出力トークン数
+ANSWER_OUTPUT_TOKENS = 4096
+
+# モデルファミリーごとのレイテンシモードの設定（モデル名の前方一致で、上から順に判定）
+# - Gemini 3 系は thinking_level、2.5 系は thinking_budget（トークン数、-1 は動的）で思考量を制御する
+# - 2.0 系は思考機能がないため、出力トークン数と温度のみ
+# - Gemini 3 系は温度を既定値（1.0）から下げると回答がループしやすいため指定しない
+# - max_output_tokens には思考トークンも含まれるので、思考量で速さを制御するモデルには上限を付けない。
+#   思考トークン数が決まっている 2.5 系は latency_mode_settings で「思考 + ANSWER_OUTPUT_TOKENS」を上限にする
+#   （上限で打ち切られた回答は check_complete で失敗として扱う）
+LATENCY_MODE_SETTINGS = [
+    ("gemini-3-pro", {
+        "instant": {"thinking_level": "LOW"},
+        "balanced": {"thinking_level": "LOW"},
+        "thorough": {"thinking_level": "HIGH"},
+    }),
+    ("gemini-3", {
+        "instant": {"thinking_level": "MINIMAL"},
+        "balanced": {"thinking_level": "LOW"},
+        "thorough": {"thinking_level": "HIGH"},
+    }),
+    ("gemini-2.5-pro", {
+        "instant": {"thinking_budget": 128, "temperature": 0.3},
+        "balanced": {"thinking_budget": 1024, "temperature": 0.5},
+        "thorough": {"thinking_budget": -1, "temperature": 0.7},
+    }),
+    ("gemini-2.5", {
+        "instant": {"thinking_budget": 0, "temperature": 0.3},
+        "balanced": {"thinking_budget": 512, "temperature": 0.5},
+        "thorough": {"thinking_budget": -1, "temperature": 0.7},
+    }),
+    ("gemini-2.0", {
+        "instant": {"max_output_tokens": ANSWER_OUTPUT_TOKENS, "temperature": 0.3},
+        "balanced": {"max_output_tokens": ANSWER_OUTPUT_TOKENS, "temperature": 0.5},
+        "thorough": {"max_output_tokens": 8192, "temperature": 0.7},
+    }),
+]
+
+
+# 会話履歴としてプロンプトに載せる推定トークン数の上限
+HISTORY_TOKEN_BUDGET = int(os.environ.get("GEMINI_HISTORY_TOKEN_BUDGET", "2000"))
+
+# 取り消し確認の間隔（秒）
+CANCEL_POLL_INTERVAL = 0.25
+
+
+class RequestCancelled(Exception):
+    """期限切れ・クライアント切断により Gemini の呼び出しを取り消した"""
+
+
+class IncompleteResponse(Exception):
+    """回答が出力トークンの上限で打ち切られた、または空だった（成功として返さず、キャッシュもさせない）"""
+
+
+def check_complete(response):
+    """
+    回答が最後まで生成されたかを確かめる（途中で切れた JSON を回答として返さないため）
+
+    Raises:
+        IncompleteResponse: finish_reason が MAX_TOKENS、または本文が空の場合
+    """
+    candidates = getattr(response, "candidates", None) or []
+    finish_reason = getattr(candidates[0], "finish_reason", None) if candidates else None
+    reason = getattr(finish_reason, "name", finish_reason)
+    if reason == "MAX_TOKENS":
+        raise IncompleteResponse("Response truncated at max_output_tokens")
+    if not (response.text or "").strip():
+        raise IncompleteResponse(f"Empty response (finish_reason={reason})")
+
+
+def error_status(error):
+    """Gemini API のエラーの HTTP ステータス（google-genai の APIError.code、それ以外の例外は None）"""
+    code = getattr(error, "code", None)
+    return code if isinstance(code, int) else None
+
+
+def latency_mode_settings(model, mode):
+    """モデルとレイテンシモードに対応する生成設定を返す（該当がなければ空の辞書）"""
+    for prefix, modes in LATENCY_MODE_SETTINGS:
+        if model.startswith(prefix):
+            settings = dict(modes.get(mode, {}))
+            budget = settings.get("thinking_budget")
+            if budget is not None and budget >= 0 and "max_output_tokens" not in settings:
+                # 思考トークン数が決まっていれば、回答の分を足して上限にする（暴走した出力だけを止める）
+                settings["max_output_tokens"] = budget + ANSWER_OUTPUT_TOKENS
+            return settings
+    return {}
+
 
 class AIModule:
     # 利用可能なGeminiモデル一覧（2026年最新）
@@ -21,129 +196,295 @@ class AIModule:
         """
         # APIキーの取得
         api_key = os.environ.get("GOOGLE_API_KEY") or os.environ.get("GEMINI_API_KEY")
-        if not api_key:
+        if not api_key and not fake_genai.enabled():
             print("WARNING: GOOGLE_API_KEY not set. Please set GOOGLE_API_KEY environment variable.")
         
         if genai is None:
             raise ImportError("google-genai library is missing.")
         
-        # Gemini APIクライアントの設定
-        self.client = genai.Client(api_key=api_key)
+        # Gemini APIクライアントの設定（SENP_AI_FAKE_GEMINI=1 ならオフライン用のフェイククライアント）
+        if fake_genai.enabled():
+            self.client = fake_genai.Client(api_key=api_key)
+            print("WARNING: SENP_AI_FAKE_GEMINI is set. Using the fake Gemini client (canned answers).")
+        else:
+            self.client = genai.Client(api_key=api_key)
         self.model = model
+        
+        # 回答形式: "json"（構造化出力）または "text"（従来のタグ形式）
+        self.response_format = os.environ.get("GEMINI_RESPONSE_FORMAT", "json")
+        
+        # リクエストでモードが指定されない場合のレイテンシモード
+        self.latency_mode = os.environ.get("GEMINI_LATENCY_MODE", "balanced")
+        if self.latency_mode not in LATENCY_MODES:
+            raise ValueError(f"GEMINI_LATENCY_MODE must be one of {LATENCY_MODES}: {self.latency_mode}")
+        
+        # セッション単位のコンテキストキャッシュ（システムプロンプト + 画像）
+        self.context_cache = None
+        if os.environ.get("GEMINI_CONTEXT_CACHE", "1") != "0":
+            self.context_cache = ContextCacheManager(self.client)
+        
+        # 取り消し可能な呼び出し（非同期クライアント）を実行するイベントループ（初回利用時に起動）
+        self._loop = None
+        self._loop_lock = threading.Lock()
         print(f"AI Module initialized with Gemini model: {model}")
     
-    def analyze_images(self, images, user_question, model_override=None):
+    @staticmethod
+    def format_history(turns, budget_tokens=None):
+        """
+        会話ターンのリストをプロンプト用の履歴テキストに変換
+        新しいターンから順に、推定トークン数が予算に収まるだけ載せる（溢れた古いターンは捨てる）
+        """
+        budget = HISTORY_TOKEN_BUDGET if budget_tokens is None else budget_tokens
+        lines = []
+        for msg in reversed(turns):
+            role_name = "User" if msg['role'] == "user" else "AI"
+            line = f"{role_name}: {msg['text']}\n"
+            tokens = estimate_tokens(line)
+            if tokens > budget:
+                if not lines and budget > 0:
+                    # 直前の回答だけで予算を超える場合は、先頭だけを載せる
+                    lines.append(line[:budget] + "…\n")
+                break
+            lines.append(line)
+            budget -= tokens
+        return "".join(reversed(lines))
+
+    @staticmethod
+    def _search_tools():
+        return [types.Tool(google_search=types.GoogleSearch())]
+
+    @staticmethod
+    def _image_part(img):
+        """PIL画像をキャッシュ作成用のPartに変換（既にPartの場合はそのまま）"""
+        if isinstance(img, types.Part):
+            return img
+        fmt = img.format if img.format in ("PNG", "JPEG", "WEBP") else "PNG"
+        buf = io.BytesIO()
+        img.save(buf, format=fmt)
+        return types.Part.from_bytes(data=buf.getvalue(), mime_type=Image.MIME[fmt])
+
+    @staticmethod
+    def _usage(response):
+        """レスポンスから入力トークン（キャッシュ済み/未キャッシュ）・出力トークン・思考トークン数を取り出す"""
+        meta = getattr(response, "usage_metadata", None)
+        prompt_tokens = (meta.prompt_token_count or 0) if meta else 0
+        cached_tokens = (meta.cached_content_token_count or 0) if meta else 0
+        return {
+            "prompt_tokens": prompt_tokens,
+            "cached_tokens": cached_tokens,
+            "uncached_tokens": max(0, prompt_tokens - cached_tokens),
+            "output_tokens": (meta.candidates_token_count or 0) if meta else 0,
+            "thoughts_tokens": (getattr(meta, "thoughts_token_count", None) or 0) if meta else 0,
+        }
+
+    def _use_structured_output(self, model, use_search=True):
+        """
+        構造化出力（JSON）を使うか判定
+        Google検索ツールとresponse_schemaの併用はGemini 3系のみ対応のため、検索付きのそれ以外のモデルは従来のタグ形式を使う
+        """
+        return self.response_format == "json" and (not use_search or model.startswith("gemini-3"))
+
+    def _system_prompt(self, model, use_search=True):
+        return STRUCTURED_SYSTEM_PROMPT if self._use_structured_output(model, use_search) else SYSTEM_PROMPT
+
+    @staticmethod
+    def _generation_kwargs(model, mode):
+        """レイテンシモードを GenerateContentConfig の引数（思考量・出力トークン数・温度）に変換"""
+        settings = latency_mode_settings(model, mode)
+        kwargs = {}
+        if "thinking_level" in settings:
+            kwargs["thinking_config"] = types.ThinkingConfig(thinking_level=settings["thinking_level"])
+        elif "thinking_budget" in settings:
+            kwargs["thinking_config"] = types.ThinkingConfig(thinking_budget=settings["thinking_budget"])
+        if "max_output_tokens" in settings:
+            kwargs["max_output_tokens"] = settings["max_output_tokens"]
+        if "temperature" in settings:
+            kwargs["temperature"] = settings["temperature"]
+        return kwargs
+
+    def _event_loop(self):
+        with self._loop_lock:
+            if self._loop is None:
+                self._loop = asyncio.new_event_loop()
+                threading.Thread(target=self._loop.run_forever, daemon=True).start()
+            return self._loop
+
+    def _generate_cancellable(self, model, contents, config, cancel_check):
+        """
+        非同期クライアントで生成し、cancel_check() が理由を返したら上流の呼び出しを取り消す
+        （タスクを取り消すとHTTP接続が閉じられ、Gemini側の生成も打ち切られる）
+        """
+        future = asyncio.run_coroutine_threadsafe(
+            self.client.aio.models.generate_content(model=model, contents=contents, config=config),
+            self._event_loop())
+        while True:
+            try:
+                return future.result(timeout=CANCEL_POLL_INTERVAL)
+            except concurrent.futures.TimeoutError:
+                reason = cancel_check()
+                if reason:
+                    future.cancel()
+                    raise RequestCancelled(reason)
+
+    def _generate(self, model, contents, cached_content=None, use_search=True, mode=None, cancel_check=None,
+                  response_schema=None):
+        """generate_content の呼び出し（キャッシュ利用時はプロンプトとツールをキャッシュ側に持たせる）"""
+        kwargs = self._generation_kwargs(model, mode or self.latency_mode)
+        if self._use_structured_output(model, use_search):
+            kwargs["response_mime_type"] = "application/json"
+            kwargs["response_schema"] = response_schema or RESPONSE_SCHEMA
+        if cached_content:
+            config = types.GenerateContentConfig(
+                cached_content=cached_content,
+                response_modalities=["TEXT"],
+                **kwargs
+            )
+        else:
+            config = types.GenerateContentConfig(
+                system_instruction=self._system_prompt(model, use_search),
+                tools=self._search_tools() if use_search else None,
+                response_modalities=["TEXT"],
+                **kwargs
+            )
+        if cancel_check is not None:
+            return self._generate_cancellable(model, contents, config, cancel_check)
+        return self.client.models.generate_content(model=model, contents=contents, config=config)
+
+    def _generate_with_fallback(self, use_model, prompt, images, cached_content=None, context_cache_key=None,
+                                use_search=True, mode=None, cancel_check=None, response_schema=None):
+        """
+        キャッシュ切れ・モデル未提供時のフォールバック付きで生成
+        
+        Returns:
+            tuple: (response, 実際に使用したモデル名, キャッシュを使ったか)
+        """
+        try:
+            contents = [prompt] if cached_content else [prompt, *images]
+            response = self._generate(use_model, contents, cached_content, use_search, mode, cancel_check,
+                                      response_schema)
+            return response, use_model, bool(cached_content)
+        except RequestCancelled:
+            raise
+        except Exception as e:
+            if cached_content:
+                # キャッシュが期限切れなどで使えない場合はキャッシュなしで再試行
+                print(f"WARNING: Cached request failed ({e}). Retrying without context cache.")
+                self.context_cache.invalidate(context_cache_key)
+                return self._generate_with_fallback(use_model, prompt, images, use_search=use_search, mode=mode,
+                                                    cancel_check=cancel_check, response_schema=response_schema)
+            # 404エラー（モデルが見つからない）などの場合、安定版の2.0 Flashにフォールバック
+            if ("404" in str(e) or "not found" in str(e).lower()) and use_model != FALLBACK_MODEL:
+                print(f"WARNING: Model {use_model} not found. Falling back to {FALLBACK_MODEL}.")
+                return self._generate_with_fallback(FALLBACK_MODEL, prompt, images, use_search=use_search, mode=mode,
+                                                    cancel_check=cancel_check, response_schema=response_schema)
+            raise e
+
+    def _context_cache_name(self, context_cache_key, use_model, images_fingerprint, images, use_search):
+        """セッションのコンテキストキャッシュ名を取得（検索ツールの有無でキャッシュを分ける）"""
+        if self.context_cache is None or not context_cache_key or not images_fingerprint:
+            return None, None
+        cache_key = f"{context_cache_key}:{'search' if use_search else 'nosearch'}"
+        name = self.context_cache.get_or_create(
+            cache_key, use_model, images_fingerprint,
+            system_instruction=self._system_prompt(use_model, use_search),
+            tools=self._search_tools() if use_search else None,
+            build_contents=lambda: [types.Content(role="user", parts=[self._image_part(img) for img in images])]
+        )
+        return name, cache_key
+
+    def analyze_images(self, images, user_question, model_override=None, history=None,
+                       context_cache_key=None, images_fingerprint=None, use_search=True, allow_escalation=False,
+                       mode=None, cancel_check=None):
         """
         画像オブジェクトのリストを分析して質問に回答
         
         Args:
-            images: PIL.Image オブジェクトのリスト
+            images: PIL.Image オブジェクト、または画像の types.Part のリスト
             user_question: ユーザーの質問
             model_override: 使用するモデル名（オーバーライド）
+            history: これまでの会話ターン [{"role": "user"|"assistant", "text": str}, ...]
+            context_cache_key: コンテキストキャッシュを紐付けるキー（セッションID）
+            images_fingerprint: 画像セットのハッシュ（画像が変わったらキャッシュを作り直す）
+            use_search: Google検索（グラウンディング）を使うか
+            allow_escalation: 検索なしで答えられないとモデルが判断した場合に、検索ありで再実行するか
+            mode: レイテンシモード（"instant" / "balanced" / "thorough"、None なら既定値）
+            cancel_check: 取り消す場合に理由を返す呼び出し可能オブジェクト（期限切れ・クライアント切断）
             
         Returns:
             dict: 結果
         """
         # 使用するモデルを決定
         use_model = model_override if model_override else self.model
+        mode = mode or self.latency_mode
         
         try:
-            # システムプロンプト
-            system_prompt = """あなたはSENP_AIという画面分析AIアシスタントです。
-ユーザーの画面を見て、質問に丁寧に答えてください。
-こちらはWebページなどをスクロールして撮影した複数の画像（上から順）である可能性があります。
-その場合は、画像全体を通してページの内容を理解し、質問に答えてください。
-
-回答のガイドライン:
-- 画面に表示されている内容を正確に分析
-- もし質問の答えが画面上の情報に見つからない場合は、あなたの持つ一般知識を使って回答してください
-- 画面外の知識を使用する場合、「画面にはありませんが」等の前置きは不要です
-- 具体的で分かりやすい説明
-- 必要に応じて手順を示す
-- 日本語で回答
-- 親切で丁寧な口調
-- 専門用語が出た際は、初心者にもわかるように補足説明を加えてください。
-- あなたは「PCに詳しい頼れる先輩」です。わからないことは適当に答えず、検索機能を使って調べ、正確な回答を心がけてください。
-- 重要: 出力に「**」などのマークダウンによる強調（太字）は使用しないでください。プレーンテキストで回答してください。
-
-バウンディングボックスについて:
-もし回答の中で、ユーザーが画面上の特定の場所（ボタンやアイコンなど）を見るべき、または操作すべきだと判断した場合は、
-その要素の正確なバウンディングボックスを検出し、回答の最後に追記してください。
-
-座標のルール:
-- 座標は画像全体を基準にした0-1000のスケールで指定してください
-- フォーマット: [TARGET_BOX: y_min, x_min, y_max, x_max]
-- y_min: 対象要素の上端のy座標 (0=画像の上端, 1000=画像の下端)
-- x_min: 対象要素の左端のx座標 (0=画像の左端, 1000=画像の右端)
-- y_max: 対象要素の下端のy座標
-- x_max: 対象要素の右端のx座標
-- 座標は極めて正確に特定してください。対象の要素と少しでもズレているとユーザーが混乱します。
-- ボックスは対象の要素を「余白を含まずぴったりと」囲むように指定してください
-- もし対象が2枚目以降の画像にある場合は、BOXは出力せず言葉で補足してください
-
-例:
-- 画面中央のボタン(画面の50%の位置): [TARGET_BOX: 470, 450, 530, 550]
-- 画面左上の小さなアイコン: [TARGET_BOX: 50, 30, 100, 80]
-- 画面右下のボタン: [TARGET_BOX: 900, 850, 950, 950]"""
+            # コンテンツの構築（システムプロンプトは system_instruction として別送）
+            prompt = ""
+            history_text = self.format_history(history) if history else ""
+            if history_text:
+                prompt += f"これまでの会話履歴:\n{history_text}\n\n"
+            prompt += f"ユーザーの質問: {user_question}"
             
-            # コンテンツの構築
-            contents = [system_prompt, f"\n\nユーザーの質問: {user_question}"]
+            search_escalated = False
+            if not use_search and allow_escalation:
+                # まず画面だけで回答させ、検索が必要な場合のみ合図を出させる
+                screen_prompt = prompt + NEED_SEARCH_INSTRUCTION
+            else:
+                screen_prompt = prompt
             
-            # 画像をcontentsに追加
-            for img in images:
-                contents.append(img)
+            # セッション内ではシステムプロンプトと画像をコンテキストキャッシュに載せる
+            cached_content, cache_key = self._context_cache_name(
+                context_cache_key, use_model, images_fingerprint, images, use_search)
             
             # Gemini APIで画像分析
-            try:
-                response = self.client.models.generate_content(
-                    model=use_model,
-                    contents=contents,
-                    config=types.GenerateContentConfig(
-                        tools=[types.Tool(google_search=types.GoogleSearch())],
-                        response_modalities=["TEXT"]
-                    )
-                )
-            except Exception as e:
-                # 404エラー（モデルが見つからない）などの場合、安定版の2.0 Flashにフォールバック
-                if "404" in str(e) or "not found" in str(e).lower():
-                    print(f"WARNING: Model {use_model} not found. Falling back to gemini-2.0-flash.")
-                    use_model = "gemini-2.0-flash"
-                    response = self.client.models.generate_content(
-                        model=use_model,
-                        contents=contents,
-                        config=types.GenerateContentConfig(
-                            tools=[types.Tool(google_search=types.GoogleSearch())],
-                            response_modalities=["TEXT"]
-                        )
-                    )
-                else:
-                    raise e
+            response, used_model, used_cache = self._generate_with_fallback(
+                use_model, screen_prompt, images, cached_content, cache_key, use_search, mode, cancel_check)
             
-            answer = response.text
+            if not use_search and allow_escalation and NEED_SEARCH_TAG in (response.text or ""):
+                # 画面だけでは答えられない: 検索を付けて再実行
+                print("DEBUG: Model requested search grounding. Escalating.")
+                search_escalated = True
+                use_search = True
+                cached_content, cache_key = self._context_cache_name(
+                    context_cache_key, use_model, images_fingerprint, images, use_search)
+                response, used_model, used_cache = self._generate_with_fallback(
+                    use_model, prompt, images, cached_content, cache_key, use_search, mode, cancel_check)
+            use_model = used_model
+            usage = self._usage(response)
+            check_complete(response)
             
-            # 座標抽出
-            target_box = None
-            box_match = re.search(r"\[TARGET_BOX:\s*(\d+)\s*,\s*(\d+)\s*,\s*(\d+)\s*,\s*(\d+)\s*\]", answer)
-            if box_match:
-                # y_min, x_min, y_max, x_max
-                target_box = [int(box_match.group(1)), int(box_match.group(2)), int(box_match.group(3)), int(box_match.group(4))]
-                answer = answer.replace(box_match.group(0), "").strip()
-                print(f"DEBUG: Extracted TARGET_BOX: {target_box}")
-
-            # 継続フラグ抽出
-            continue_navigation = False
-            if "[CONTINUE]" in answer:
-                continue_navigation = True
-                answer = answer.replace("[CONTINUE]", "").strip()
+            # 回答テキスト・ターゲット領域・フラグを抽出（JSONが壊れていれば従来のタグ形式として解釈）
+            parsed = parse_response(response.text)
+            target_boxes = parsed["target_boxes"]
+            
+            # 互換性のため、現在の画面（1枚目）の最初のボックスを target_box としても返す
+            target_box = next((t["box"] for t in target_boxes if t["image_index"] == 0), None)
+            if target_boxes:
+                print(f"DEBUG: Extracted {len(target_boxes)} target box(es) ({parsed['response_format']}): {target_boxes}")
 
             return {
                 "success": True,
-                "answer": answer.replace("[SHOW_ARROW]", "").strip(),
+                "answer": parsed["answer"],
                 "model": use_model,
                 "target_box": target_box,
-                "continue_navigation": continue_navigation
+                "target_boxes": target_boxes,
+                "continue_navigation": parsed["continue_navigation"],
+                "response_format": parsed["response_format"],
+                "context_cache": used_cache,
+                "search": use_search,
+                "search_escalated": search_escalated,
+                "mode": mode,
+                "usage": usage
             }
 
+        except RequestCancelled as e:
+            print(f"AI Analysis cancelled: {e}")
+            return {
+                "success": False,
+                "error": f"Cancelled: {e}",
+                "model": use_model,
+                "cancelled": True
+            }
         except Exception as e:
             error_msg = str(e)
             print(f"AI Analysis Error: {error_msg}")
@@ -152,6 +493,67 @@ class AIModule:
             return {
                 "success": False,
                 "error": error_msg,
+                "status_code": error_status(e),
                 "model": use_model
             }
 
+    def supports_batch_call(self, model=None, use_search=True):
+        """複数の質問を1回の構造化出力の呼び出しでまとめて回答できるか"""
+        return self._use_structured_output(model or self.model, use_search)
+
+    def analyze_batch(self, images, questions, model_override=None, use_search=True, mode=None, cancel_check=None):
+        """
+        同じ画像に対する複数の質問に、1回の呼び出し（構造化出力）でまとめて回答
+        
+        Args:
+            images: PIL.Image オブジェクト、または画像の types.Part のリスト
+            questions: 質問のリスト
+            
+        Returns:
+            dict: {"success", "model", "results": 質問ごとの結果（回答が欠けた質問は None）, "usage"}
+        """
+        use_model = model_override if model_override else self.model
+        mode = mode or self.latency_mode
+        
+        try:
+            numbered = "\n".join(f"{i}. {question}" for i, question in enumerate(questions))
+            prompt = (f"次の{len(questions)}個の質問に、それぞれ独立して回答してください。\n"
+                      f"answers には質問ごとに1つずつ、index に質問の番号を入れて、質問と同じ順序で出力してください。\n\n"
+                      f"{numbered}")
+            response, use_model, _ = self._generate_with_fallback(
+                use_model, prompt, images, use_search=use_search, mode=mode, cancel_check=cancel_check,
+                response_schema=BATCH_RESPONSE_SCHEMA)
+            usage = self._usage(response)
+            check_complete(response)
+            parsed = parse_batch_response(response.text, len(questions))
+            if parsed is None:
+                return {"success": False, "error": "Invalid batch response", "model": use_model, "usage": usage}
+            
+            results = []
+            for item in parsed:
+                if item is None:
+                    results.append(None)
+                    continue
+                target_boxes = item["target_boxes"]
+                results.append({
+                    "success": True,
+                    "answer": item["answer"],
+                    "model": use_model,
+                    "target_box": next((t["box"] for t in target_boxes if t["image_index"] == 0), None),
+                    "target_boxes": target_boxes,
+                    "continue_navigation": item["continue_navigation"],
+                    "response_format": item["response_format"],
+                    "search": use_search,
+                    "mode": mode,
+                })
+            return {"success": True, "model": use_model, "results": results, "usage": usage}
+        
+        except RequestCancelled as e:
+            print(f"AI Batch Analysis cancelled: {e}")
+            return {"success": False, "error": f"Cancelled: {e}", "model": use_model, "cancelled": True}
+        except Exception as e:
+            error_msg = str(e)
+            print(f"AI Batch Analysis Error: {error_msg}")
+            import traceback
+            traceback.print_exc()
+            return {"success": False, "error": error_msg, "status_code": error_status(e), "model": use_model}
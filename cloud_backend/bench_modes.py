@@ -0,0 +1,93 @@
+"""
+レイテンシモードのベンチマーク
+
+モデル × レイテンシモード（instant / balanced / thorough）ごとに Gemini を呼び出し、
+回答レイテンシの分布（p50 / p90 / p95 / max）と出力・思考トークン数を計測する（GOOGLE_API_KEY が必要）。
+
+使い方:
+    python bench_modes.py --images ../screenshots --limit 10
+    python bench_modes.py --models gemini-2.5-flash gemini-3-flash-preview --repeat 3 --json modes.json
+"""
+
+import argparse
+import json
+import os
+import statistics
+import time
+
+from ai_logic import LATENCY_MODES, AIModule
+from bench_preprocess import load_images, percentile
+from preprocess import PreprocessConfig, preprocess_images
+
+
+def bench_mode(module, images, model, mode, question, batch_size, repeat):
+    """1つのモデル・モードで全画像を repeat 回解析し、レイテンシとトークン数を集める"""
+    latencies = []
+    output_tokens = []
+    thoughts_tokens = []
+    errors = 0
+    for _ in range(repeat):
+        for i in range(0, len(images), batch_size):
+            batch = images[i:i + batch_size]
+            start = time.perf_counter()
+            result = module.analyze_images(batch, question, model_override=model, mode=mode)
+            elapsed = (time.perf_counter() - start) * 1000
+            if not result.get("success"):
+                errors += 1
+                continue
+            latencies.append(elapsed)
+            usage = result.get("usage") or {}
+            output_tokens.append(usage.get("output_tokens", 0))
+            thoughts_tokens.append(usage.get("thoughts_tokens", 0))
+    return latencies, output_tokens, thoughts_tokens, errors
+
+
+def main():
+    parser = argparse.ArgumentParser(description="SENP_AI latency mode benchmark")
+    parser.add_argument("--images", default=os.path.join(os.path.dirname(__file__), "..", "screenshots"))
+    parser.add_argument("--limit", type=int, default=10)
+    parser.add_argument("--batch-size", type=int, default=1, help="1リクエストあたりの画像数")
+    parser.add_argument("--repeat", type=int, default=1, help="各画像を解析する回数")
+    parser.add_argument("--models", nargs="*", default=[model for model, _ in AIModule.AVAILABLE_MODELS])
+    parser.add_argument("--modes", nargs="*", default=list(LATENCY_MODES), choices=list(LATENCY_MODES))
+    parser.add_argument("--question", default="この画面の内容を要約してください。")
+    parser.add_argument("--json", dest="json_path", default=None, help="結果をJSONで保存するパス")
+    args = parser.parse_args()
+
+    # 本番と同じ前処理をかけてから計測する
+    images = preprocess_images(load_images(args.images, args.limit), PreprocessConfig.from_env())
+    if not images:
+        print(f"No images found in {args.images}")
+        return
+    print(f"Loaded {len(images)} images from {args.images}")
+
+    module = AIModule()
+    # 同じ画像・質問でもモードごとに別々に呼び出す（結果キャッシュを通さない）
+    results = {}
+    for model in args.models:
+        for mode in args.modes:
+            latencies, output_tokens, thoughts_tokens, errors = bench_mode(
+                module, images, model, mode, args.question, args.batch_size, args.repeat)
+            row = {
+                "requests": len(latencies) + errors,
+                "latency_ms_p50": round(percentile(latencies, 50), 1),
+                "latency_ms_p90": round(percentile(latencies, 90), 1),
+                "latency_ms_p95": round(percentile(latencies, 95), 1),
+                "latency_ms_max": round(max(latencies), 1) if latencies else 0.0,
+                "output_tokens_mean": round(statistics.mean(output_tokens), 1) if output_tokens else 0,
+                "thoughts_tokens_mean": round(statistics.mean(thoughts_tokens), 1) if thoughts_tokens else 0,
+                "errors": errors,
+            }
+            results[f"{model}/{mode}"] = row
+            print(f"{model:24s} {mode:9s} p50={row['latency_ms_p50']:8.1f}ms p90={row['latency_ms_p90']:8.1f}ms "
+                  f"p95={row['latency_ms_p95']:8.1f}ms max={row['latency_ms_max']:8.1f}ms "
+                  f"out={row['output_tokens_mean']:.0f}tok think={row['thoughts_tokens_mean']:.0f}tok err={errors}")
+
+    if args.json_path:
+        with open(args.json_path, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+        print(f"Saved results to {args.json_path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,148 @@
+"""
+前処理ベンチマーク
+
+設定ごとに 1枚あたりの前処理時間と出力サイズを計測する。
+--with-model を指定すると、実際に Gemini を呼び出して回答レイテンシと出力トークン数も計測する
+（GOOGLE_API_KEY が必要）。
+
+使い方:
+    python bench_preprocess.py --images ../screenshots --limit 20
+    python bench_preprocess.py --limit 5 --with-model --model gemini-3-flash-preview
+"""
+
+import argparse
+import glob
+import json
+import os
+import statistics
+import time
+
+from PIL import Image
+
+from preprocess import PreprocessConfig, preprocess_images
+
+# ベンチマーク対象の設定
+SETTINGS = {
+    "original": PreprocessConfig(max_pixels=0, tile_snap_tolerance=0.0, drop_alpha=False),
+    "drop_alpha": PreprocessConfig(max_pixels=0),
+    "max_1440p": PreprocessConfig(max_pixels=2560 * 1440),
+    "max_1440p_tile": PreprocessConfig(max_pixels=2560 * 1440, tile_snap_tolerance=0.1),
+    "max_1080p_tile": PreprocessConfig(max_pixels=1920 * 1080, tile_snap_tolerance=0.1),
+    "max_1080p_gray_auto": PreprocessConfig(max_pixels=1920 * 1080, tile_snap_tolerance=0.1, grayscale="auto"),
+    "max_720p_gray": PreprocessConfig(max_pixels=1280 * 720, tile_snap_tolerance=0.1, grayscale="on"),
+}
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(pct / 100.0 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def load_images(directory, limit):
+    paths = sorted(glob.glob(os.path.join(directory, "*.png")))[:limit]
+    images = []
+    for path in paths:
+        with Image.open(path) as img:
+            img.load()
+            images.append(img.copy())
+    return images
+
+
+def bench_setting(images, config, batch_size):
+    """前処理時間（1枚あたり）を計測"""
+    per_image_ms = []
+    output_pixels = []
+    for i in range(0, len(images), batch_size):
+        batch = images[i:i + batch_size]
+        start = time.perf_counter()
+        processed = preprocess_images(batch, config)
+        elapsed = (time.perf_counter() - start) * 1000
+        per_image_ms.extend([elapsed / len(batch)] * len(batch))
+        output_pixels.extend(img.width * img.height for img in processed)
+    return per_image_ms, output_pixels
+
+
+def bench_model(images, config, module, model, question, batch_size):
+    """前処理後の画像で Gemini を呼び出し、回答レイテンシとトークン数を計測"""
+    latencies = []
+    output_tokens = []
+    prompt_tokens = []
+    errors = 0
+    for i in range(0, len(images), batch_size):
+        processed = preprocess_images(images[i:i + batch_size], config)
+        start = time.perf_counter()
+        result = module.analyze_images(processed, question, model_override=model)
+        latencies.append((time.perf_counter() - start) * 1000)
+        if not result.get("success"):
+            errors += 1
+            continue
+        usage = result.get("usage") or {}
+        output_tokens.append(usage.get("output_tokens", 0))
+        prompt_tokens.append(usage.get("prompt_tokens", 0))
+    return latencies, prompt_tokens, output_tokens, errors
+
+
+def main():
+    parser = argparse.ArgumentParser(description="SENP_AI image preprocessing benchmark")
+    parser.add_argument("--images", default=os.path.join(os.path.dirname(__file__), "..", "screenshots"))
+    parser.add_argument("--limit", type=int, default=20)
+    parser.add_argument("--batch-size", type=int, default=3, help="1リクエストあたりの画像数（スクロールキャプチャは3枚）")
+    parser.add_argument("--settings", nargs="*", default=list(SETTINGS), choices=list(SETTINGS))
+    parser.add_argument("--with-model", action="store_true", help="Gemini を呼び出してレイテンシとトークン数も計測")
+    parser.add_argument("--model", default=None)
+    parser.add_argument("--question", default="この画面の内容を要約してください。")
+    parser.add_argument("--json", dest="json_path", default=None, help="結果をJSONで保存するパス")
+    args = parser.parse_args()
+
+    images = load_images(args.images, args.limit)
+    if not images:
+        print(f"No images found in {args.images}")
+        return
+    print(f"Loaded {len(images)} images from {args.images}")
+
+    module = None
+    if args.with_model:
+        from ai_logic import AIModule
+        module = AIModule()
+
+    results = {}
+    for name in args.settings:
+        config = SETTINGS[name]
+        per_image_ms, output_pixels = bench_setting(images, config, args.batch_size)
+        row = {
+            "config": config.to_dict(),
+            "preprocess_ms_mean": round(statistics.mean(per_image_ms), 2),
+            "preprocess_ms_p50": round(percentile(per_image_ms, 50), 2),
+            "preprocess_ms_p95": round(percentile(per_image_ms, 95), 2),
+            "output_megapixels_mean": round(statistics.mean(output_pixels) / 1e6, 3),
+        }
+        line = (f"{name:22s} preprocess/img: mean={row['preprocess_ms_mean']:7.2f}ms "
+                f"p95={row['preprocess_ms_p95']:7.2f}ms  out={row['output_megapixels_mean']:.2f}MP")
+
+        if module is not None:
+            latencies, prompt_tokens, output_tokens, errors = bench_model(
+                images, config, module, args.model, args.question, args.batch_size)
+            row.update({
+                "answer_ms_p50": round(percentile(latencies, 50), 1),
+                "answer_ms_p95": round(percentile(latencies, 95), 1),
+                "prompt_tokens_mean": round(statistics.mean(prompt_tokens), 1) if prompt_tokens else 0,
+                "output_tokens_mean": round(statistics.mean(output_tokens), 1) if output_tokens else 0,
+                "errors": errors,
+            })
+            line += (f"  answer: p50={row['answer_ms_p50']:7.1f}ms p95={row['answer_ms_p95']:7.1f}ms "
+                     f"in={row['prompt_tokens_mean']:.0f}tok out={row['output_tokens_mean']:.0f}tok err={errors}")
+
+        results[name] = row
+        print(line)
+
+    if args.json_path:
+        with open(args.json_path, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+        print(f"Saved results to {args.json_path}")
+
+
+if __name__ == "__main__":
+    main()
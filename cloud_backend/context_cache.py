@@ -0,0 +1,163 @@
+"""
+Context Cache Manager
+Gemini の明示的コンテキストキャッシュ（client.caches）をセッション単位で管理する
+
+システムプロンプトとセッションの画像をキャッシュに載せておき、
+フォローアップの質問では質問文だけを送信する。キャッシュはTTL付きで作成し、
+期限切れ・セッション破棄時に削除する。
+"""
+
+import os
+import threading
+import time
+
+from google.genai import types
+
+
+class ContextCacheManager:
+    """
+    キー（"<セッションID>:<検索ツールの有無>"）ごとに1つのキャッシュハンドルを保持する
+    """
+
+    def __init__(self, client, ttl_seconds=None, max_entries=None):
+        """
+        Args:
+            client: genai.Client
+            ttl_seconds: キャッシュの有効期限（秒）
+            max_entries: 同時に保持するキャッシュの最大数
+        """
+        if ttl_seconds is None:
+            ttl_seconds = int(os.environ.get("GEMINI_CONTEXT_CACHE_TTL", "600"))
+        if max_entries is None:
+            max_entries = int(os.environ.get("GEMINI_CONTEXT_CACHE_MAX_ENTRIES", "100"))
+
+        self.client = client
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+
+        self._lock = threading.Lock()
+        # key -> {"name", "model", "fingerprint", "expires_at"}
+        # name が None のエントリは「作成に失敗した（トークン数不足など）」ことを表し、
+        # 入力が変わるか期限が切れるまで再作成を試みない
+        self._entries = {}
+        self._created = 0
+        self._reused = 0
+        self._failed = 0
+        self._deleted = 0
+
+    def get_or_create(self, key, model, fingerprint, system_instruction, tools, build_contents):
+        """
+        キャッシュ名を返す（未作成・入力変更時は作成する）
+
+        Args:
+            key: キャッシュを紐付けるキー（セッションIDなど）
+            model: 使用するモデル名（キャッシュはモデルごと）
+            fingerprint: キャッシュ対象の内容を表す値（画像のハッシュなど）
+            system_instruction: システムプロンプト
+            tools: キャッシュに含めるツール
+            build_contents: キャッシュに載せるコンテンツのリストを返す呼び出し可能オブジェクト
+
+        Returns:
+            str or None: キャッシュ名（使えない場合は None）
+        """
+        self.purge_expired()
+
+        now = time.monotonic()
+        stale = None
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if entry["model"] == model and entry["fingerprint"] == fingerprint and entry["expires_at"] > now:
+                    if entry["name"]:
+                        self._reused += 1
+                    return entry["name"]
+                stale = self._entries.pop(key)
+
+        if stale is not None:
+            self._delete_remote(stale["name"])
+
+        name = None
+        try:
+            cache = self.client.caches.create(
+                model=model,
+                config=types.CreateCachedContentConfig(
+                    display_name=f"senp-ai-{key}"[:128],
+                    system_instruction=system_instruction,
+                    tools=tools,
+                    contents=build_contents(),
+                    ttl=f"{int(self.ttl_seconds)}s",
+                )
+            )
+            name = cache.name
+            print(f"DEBUG: Context cache created: {name} (model={model})")
+        except Exception as e:
+            # 最小トークン数に満たない場合やモデル非対応の場合は通常リクエストにフォールバック
+            print(f"WARNING: Context cache unavailable for {model}: {e}")
+
+        evicted = []
+        with self._lock:
+            if name:
+                self._created += 1
+            else:
+                self._failed += 1
+            # サーバー側の期限より少し早めに手元のハンドルを失効させる
+            self._entries[key] = {
+                "name": name,
+                "model": model,
+                "fingerprint": fingerprint,
+                "expires_at": time.monotonic() + max(1.0, self.ttl_seconds - 30),
+            }
+            while len(self._entries) > self.max_entries:
+                oldest_key = min(self._entries, key=lambda k: self._entries[k]["expires_at"])
+                evicted.append(self._entries.pop(oldest_key)["name"])
+
+        for old_name in evicted:
+            self._delete_remote(old_name)
+        return name
+
+    def invalidate(self, key):
+        """キャッシュが使えなかった（期限切れなど）場合にハンドルを破棄する"""
+        with self._lock:
+            entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._delete_remote(entry["name"])
+
+    def release(self, key_prefix):
+        """キー（"<セッションID>:..." 形式を含む）に紐付くキャッシュをすべて削除（セッション破棄時）"""
+        with self._lock:
+            keys = [k for k in self._entries if k == key_prefix or k.startswith(f"{key_prefix}:")]
+            names = [self._entries.pop(k)["name"] for k in keys]
+        for name in names:
+            self._delete_remote(name)
+
+    def purge_expired(self):
+        """手元で期限切れになったハンドルを破棄"""
+        now = time.monotonic()
+        with self._lock:
+            expired = [k for k, entry in self._entries.items() if entry["expires_at"] <= now]
+            names = [self._entries.pop(k)["name"] for k in expired]
+        for name in names:
+            self._delete_remote(name)
+        return len(expired)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "entries": sum(1 for entry in self._entries.values() if entry["name"]),
+                "created": self._created,
+                "reused": self._reused,
+                "failed": self._failed,
+                "deleted": self._deleted,
+                "ttl_seconds": self.ttl_seconds,
+            }
+
+    def _delete_remote(self, name):
+        if not name:
+            return
+        try:
+            self.client.caches.delete(name=name)
+            with self._lock:
+                self._deleted += 1
+        except Exception as e:
+            # サーバー側でTTLにより既に削除されている場合もある
+            print(f"WARNING: Failed to delete context cache {name}: {e}")
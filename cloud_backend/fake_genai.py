@@ -0,0 +1,395 @@
+"""
+Fake Gemini Client
+APIキーもネットワークもない環境で cloud_backend を動かすための genai.Client の代替
+
+SENP_AI_FAKE_GEMINI=1 のとき AIModule はこのクライアントを使う。
+質問と画像から決まる固定の回答（TARGET_BOX タグ、または構造化出力のJSON）を返し、
+レイテンシの分布・エラー（404/429/500）・ストリーミングの分割を環境変数で注入できる。
+キャッシュ・リトライ・ルーティング・ストリーミングの計測や回帰確認に使う。
+
+環境変数:
+    FAKE_GEMINI_LATENCY          "fixed" / "uniform" / "lognormal"（既定: lognormal）
+    FAKE_GEMINI_LATENCY_MS       レイテンシの中央値（ミリ秒、既定: 1500）
+    FAKE_GEMINI_LATENCY_SPREAD   lognormal の sigma、uniform の中央値に対する幅の割合（既定: 0.4）
+    FAKE_GEMINI_ERROR_RATES      エラーの発生率（例: "429=0.05,500=0.01,404=0"）
+    FAKE_GEMINI_MISSING_MODELS   常に 404 を返すモデル名（カンマ区切り）
+    FAKE_GEMINI_STREAM_CHUNK_CHARS  ストリーミング1チャンクの文字数（既定: 24）
+    FAKE_GEMINI_STREAM_CHUNK_MS     チャンク間の間隔（ミリ秒、既定: 40）
+    FAKE_GEMINI_SEED             乱数のシード（同じシードなら同じ順序でレイテンシ・エラーが出る）
+"""
+
+import asyncio
+import hashlib
+import io
+import itertools
+import json
+import math
+import os
+import random
+import re
+import threading
+import time
+
+from google.genai import errors, types
+from PIL import Image
+
+from tokens import estimate_tokens
+
+LATENCY_DISTRIBUTIONS = ("fixed", "uniform", "lognormal")
+
+# モデルごとのレイテンシの倍率（前方一致、上から順に判定）
+MODEL_LATENCY_SCALE = [
+    ("gemini-3-pro", 2.5),
+    ("gemini-3", 1.0),
+    ("gemini-2.5-pro", 2.0),
+    ("gemini-2.5", 0.8),
+    ("gemini-2.0", 0.5),
+]
+
+# 思考量ごとのレイテンシの倍率
+THINKING_LEVEL_SCALE = {"MINIMAL": 0.6, "LOW": 1.0, "MEDIUM": 1.5, "HIGH": 2.5}
+
+# キャッシュ済みの入力は処理が速い
+CACHED_CONTENT_SCALE = 0.7
+
+# 画像1タイル（768x768）あたりの入力トークン数
+TOKENS_PER_TILE = 258
+
+ERROR_STATUS = {
+    404: "NOT_FOUND",
+    429: "RESOURCE_EXHAUSTED",
+    500: "INTERNAL",
+    503: "UNAVAILABLE",
+}
+
+_QUESTION_PATTERN = re.compile(r"ユーザーの質問:\s*(.+)", re.DOTALL)
+_NUMBERED_PATTERN = re.compile(r"^(\d+)\.\s*(.+)$", re.MULTILINE)
+
+
+def enabled():
+    """フェイクモードが有効か"""
+    return os.environ.get("SENP_AI_FAKE_GEMINI", "0") not in ("", "0")
+
+
+def _parse_rates(text):
+    rates = {}
+    for item in (text or "").split(","):
+        if "=" not in item:
+            continue
+        code, rate = item.split("=", 1)
+        rates[int(code.strip())] = float(rate)
+    return rates
+
+
+def _api_error(code, message):
+    body = {"error": {"code": code, "message": message, "status": ERROR_STATUS.get(code, "UNKNOWN")}}
+    if code >= 500:
+        return errors.ServerError(code, body)
+    return errors.ClientError(code, body)
+
+
+def _image_tokens(width, height):
+    if width <= 384 and height <= 384:
+        return TOKENS_PER_TILE
+    return math.ceil(width / 768) * math.ceil(height / 768) * TOKENS_PER_TILE
+
+
+class FakeConfig:
+    """フェイククライアントの設定"""
+
+    def __init__(self, latency="lognormal", latency_ms=1500.0, spread=0.4, error_rates=None,
+                 missing_models=(), stream_chunk_chars=24, stream_chunk_ms=40.0, seed=None):
+        if latency not in LATENCY_DISTRIBUTIONS:
+            raise ValueError(f"latency must be one of {LATENCY_DISTRIBUTIONS}: {latency}")
+        self.latency = latency
+        self.latency_ms = latency_ms
+        self.spread = spread
+        self.error_rates = error_rates or {}
+        self.missing_models = set(missing_models)
+        self.stream_chunk_chars = max(1, stream_chunk_chars)
+        self.stream_chunk_ms = stream_chunk_ms
+        self.seed = seed
+
+    @classmethod
+    def from_env(cls):
+        """環境変数から設定を読み込む"""
+        seed = os.environ.get("FAKE_GEMINI_SEED")
+        missing = os.environ.get("FAKE_GEMINI_MISSING_MODELS", "")
+        return cls(
+            latency=os.environ.get("FAKE_GEMINI_LATENCY", "lognormal"),
+            latency_ms=float(os.environ.get("FAKE_GEMINI_LATENCY_MS", "1500")),
+            spread=float(os.environ.get("FAKE_GEMINI_LATENCY_SPREAD", "0.4")),
+            error_rates=_parse_rates(os.environ.get("FAKE_GEMINI_ERROR_RATES", "")),
+            missing_models=[m.strip() for m in missing.split(",") if m.strip()],
+            stream_chunk_chars=int(os.environ.get("FAKE_GEMINI_STREAM_CHUNK_CHARS", "24")),
+            stream_chunk_ms=float(os.environ.get("FAKE_GEMINI_STREAM_CHUNK_MS", "40")),
+            seed=int(seed) if seed else None,
+        )
+
+
+class _Backend:
+    """同期・非同期の両方のクライアントが共有する状態（乱数・キャッシュ）と応答の生成"""
+
+    def __init__(self, config):
+        self.config = config
+        self._lock = threading.Lock()
+        self._random = random.Random(config.seed)
+        self._caches = {}
+        self._cache_ids = itertools.count(1)
+        self.calls = 0
+
+    # --- レイテンシとエラー ---
+
+    def _sample_latency(self, model, config):
+        with self._lock:
+            self.calls += 1
+            if self.config.latency == "fixed":
+                value = self.config.latency_ms
+            elif self.config.latency == "uniform":
+                width = self.config.latency_ms * self.config.spread
+                value = self._random.uniform(self.config.latency_ms - width, self.config.latency_ms + width)
+            else:
+                value = self._random.lognormvariate(math.log(self.config.latency_ms), self.config.spread)
+            roll = self._random.random()
+
+        scale = next((s for prefix, s in MODEL_LATENCY_SCALE if model.startswith(prefix)), 1.0)
+        thinking = getattr(config, "thinking_config", None) if config else None
+        if thinking is not None:
+            level = getattr(thinking, "thinking_level", None)
+            budget = getattr(thinking, "thinking_budget", None)
+            if level is not None:
+                scale *= THINKING_LEVEL_SCALE.get(getattr(level, "value", str(level)), 1.0)
+            elif budget is not None:
+                scale *= THINKING_LEVEL_SCALE["HIGH"] if budget < 0 else 0.6 + min(budget, 8192) / 4096
+        if config is not None and getattr(config, "cached_content", None):
+            scale *= CACHED_CONTENT_SCALE
+        return max(0.0, value * scale) / 1000, roll
+
+    def _pick_error(self, model, config, roll):
+        """注入するエラー（なければ None）"""
+        if model in self.config.missing_models:
+            return _api_error(404, f"models/{model} is not found for API version v1beta.")
+        cached = getattr(config, "cached_content", None) if config else None
+        if cached:
+            with self._lock:
+                if cached not in self._caches:
+                    return _api_error(404, f"CachedContent not found (or permission denied): {cached}")
+        threshold = 0.0
+        for code, rate in sorted(self.config.error_rates.items()):
+            threshold += rate
+            if roll < threshold:
+                return _api_error(code, f"Injected error {code} for {model}.")
+        return None
+
+    # --- 応答の生成 ---
+
+    @staticmethod
+    def _split_contents(contents):
+        """contents からテキストと画像のトークン数を取り出す"""
+        texts = []
+        image_tokens = 0
+        items = contents if isinstance(contents, list) else [contents]
+        for item in items:
+            parts = item.parts if isinstance(item, types.Content) else [item]
+            for part in parts or []:
+                if isinstance(part, str):
+                    texts.append(part)
+                elif isinstance(part, Image.Image):
+                    image_tokens += _image_tokens(*part.size)
+                elif isinstance(part, types.Part) and part.text:
+                    texts.append(part.text)
+                elif isinstance(part, types.Part) and part.inline_data is not None:
+                    try:
+                        with Image.open(io.BytesIO(part.inline_data.data)) as img:
+                            image_tokens += _image_tokens(*img.size)
+                    except Exception:
+                        image_tokens += TOKENS_PER_TILE
+        return "\n".join(texts), image_tokens
+
+    @staticmethod
+    def _box(seed_text, index):
+        """質問から決まる固定のボックス（0-1000スケール）"""
+        digest = hashlib.sha256(f"{seed_text}:{index}".encode("utf-8")).digest()
+        y_min = 50 + digest[0] * 3
+        x_min = 50 + digest[1] * 3
+        return [y_min, x_min, y_min + 40 + digest[2] % 80, x_min + 80 + digest[3] % 160]
+
+    def _answer(self, question, model):
+        return f"（テスト応答 {model}）「{question.strip()[:40]}」については、画面のハイライトされた箇所を確認してください。"
+
+    def _item(self, question, model, index=None):
+        item = {
+            "answer": self._answer(question, model),
+            "targets": [{"label": "対象", "image_index": 0, "box_2d": self._box(question, 0)}],
+            "continue_navigation": False,
+        }
+        if index is not None:
+            item["index"] = index
+        return item
+
+    def _build_text(self, model, prompt, config):
+        schema = getattr(config, "response_schema", None) if config else None
+        if schema is not None and "answers" in (getattr(schema, "properties", None) or {}):
+            # 一括回答（番号付きの質問）
+            questions = _NUMBERED_PATTERN.findall(prompt)
+            answers = [self._item(q, model, int(i)) for i, q in questions]
+            return json.dumps({"answers": answers}, ensure_ascii=False)
+        match = _QUESTION_PATTERN.search(prompt)
+        question = match.group(1).split("\n")[0] if match else prompt[-200:]
+        if schema is not None:
+            return json.dumps(self._item(question, model), ensure_ascii=False)
+        box = self._box(question, 0)
+        return f"{self._answer(question, model)}\n[TARGET_BOX: {', '.join(str(v) for v in box)}]"
+
+    def _response(self, text, prompt_tokens, cached_tokens, thoughts_tokens=0):
+        return types.GenerateContentResponse(
+            candidates=[types.Candidate(
+                content=types.Content(role="model", parts=[types.Part(text=text)]),
+                finish_reason=types.FinishReason.STOP,
+            )],
+            usage_metadata=types.GenerateContentResponseUsageMetadata(
+                prompt_token_count=prompt_tokens,
+                cached_content_token_count=cached_tokens or None,
+                candidates_token_count=estimate_tokens(text),
+                thoughts_token_count=thoughts_tokens or None,
+                total_token_count=prompt_tokens + estimate_tokens(text) + thoughts_tokens,
+            ),
+        )
+
+    def prepare(self, model, contents, config):
+        """
+        1回の呼び出しを準備する
+
+        Returns:
+            tuple: (待ち時間（秒）, 注入するエラーまたは None, 応答テキスト, usage 用の値)
+        """
+        latency, roll = self._sample_latency(model, config)
+        error = self._pick_error(model, config, roll)
+        if error is not None:
+            # エラーは生成が始まる前に返るので速い
+            return latency * 0.1, error, None, None
+
+        prompt, image_tokens = self._split_contents(contents)
+        cached_tokens = 0
+        cached = getattr(config, "cached_content", None) if config else None
+        if cached:
+            with self._lock:
+                cached_tokens = self._caches[cached]["tokens"]
+        system = getattr(config, "system_instruction", None) if config else None
+        prompt_tokens = estimate_tokens(prompt) + image_tokens + estimate_tokens(system or "") + cached_tokens
+        thinking = getattr(config, "thinking_config", None) if config else None
+        thoughts_tokens = int(latency * 200) if thinking is not None else 0
+        text = self._build_text(model, prompt, config)
+        return latency, None, text, (prompt_tokens, cached_tokens, thoughts_tokens)
+
+    def chunks(self, text):
+        size = self.config.stream_chunk_chars
+        return [text[i:i + size] for i in range(0, len(text), size)] or [""]
+
+    # --- コンテキストキャッシュ ---
+
+    def create_cache(self, model, config):
+        if model in self.config.missing_models:
+            raise _api_error(404, f"models/{model} is not found for API version v1beta.")
+        _, image_tokens = self._split_contents(list(getattr(config, "contents", None) or []))
+        tokens = image_tokens + estimate_tokens(getattr(config, "system_instruction", None) or "")
+        with self._lock:
+            name = f"cachedContents/fake-{next(self._cache_ids)}"
+            self._caches[name] = {"model": model, "tokens": tokens}
+        return types.CachedContent(name=name, model=model, display_name=getattr(config, "display_name", None))
+
+    def delete_cache(self, name):
+        with self._lock:
+            if self._caches.pop(name, None) is None:
+                raise _api_error(404, f"CachedContent not found (or permission denied): {name}")
+
+
+class _Models:
+    def __init__(self, backend):
+        self._backend = backend
+
+    def generate_content(self, model, contents, config=None):
+        latency, error, text, usage = self._backend.prepare(model, contents, config)
+        time.sleep(latency)
+        if error is not None:
+            raise error
+        return self._backend._response(text, *usage)
+
+    def generate_content_stream(self, model, contents, config=None):
+        latency, error, text, usage = self._backend.prepare(model, contents, config)
+        # 最初のチャンクまでに全体の待ち時間の大半がかかり、その後は一定間隔で届く
+        time.sleep(latency)
+        if error is not None:
+            raise error
+        prompt_tokens, cached_tokens, thoughts_tokens = usage
+        for i, chunk in enumerate(self._backend.chunks(text)):
+            if i:
+                time.sleep(self._backend.config.stream_chunk_ms / 1000)
+            yield self._backend._response(chunk, prompt_tokens, cached_tokens, thoughts_tokens)
+
+
+class _AsyncModels:
+    def __init__(self, backend):
+        self._backend = backend
+
+    async def generate_content(self, model, contents, config=None):
+        latency, error, text, usage = self._backend.prepare(model, contents, config)
+        # asyncio.sleep なのでタスクを取り消せば呼び出しも打ち切られる
+        await asyncio.sleep(latency)
+        if error is not None:
+            raise error
+        return self._backend._response(text, *usage)
+
+    async def generate_content_stream(self, model, contents, config=None):
+        latency, error, text, usage = self._backend.prepare(model, contents, config)
+
+        async def stream():
+            await asyncio.sleep(latency)
+            if error is not None:
+                raise error
+            prompt_tokens, cached_tokens, thoughts_tokens = usage
+            for i, chunk in enumerate(self._backend.chunks(text)):
+                if i:
+                    await asyncio.sleep(self._backend.config.stream_chunk_ms / 1000)
+                yield self._backend._response(chunk, prompt_tokens, cached_tokens, thoughts_tokens)
+
+        return stream()
+
+
+class _Caches:
+    def __init__(self, backend):
+        self._backend = backend
+
+    def create(self, model, config=None):
+        return self._backend.create_cache(model, config)
+
+    def delete(self, name, config=None):
+        self._backend.delete_cache(name)
+
+
+class _Aio:
+    def __init__(self, backend):
+        self.models = _AsyncModels(backend)
+
+
+class Client:
+    """
+    genai.Client の代わりに使うフェイククライアント（AIModule が使う範囲のみ実装）
+    """
+
+    def __init__(self, config=None, **kwargs):
+        """
+        Args:
+            config: FakeConfig（None なら環境変数から読み込む）
+            kwargs: genai.Client と同じ引数（api_key など、無視する）
+        """
+        self.config = config or FakeConfig.from_env()
+        self._backend = _Backend(self.config)
+        self.models = _Models(self._backend)
+        self.aio = _Aio(self._backend)
+        self.caches = _Caches(self._backend)
+
+    @property
+    def calls(self):
+        """これまでの generate_content の呼び出し回数"""
+        return self._backend.calls
@@ -0,0 +1,422 @@
+"""
+負荷試験
+
+/analyze に現実的なトラフィック（1枚の画面・3枚のスクロールキャプチャ・セッション内の追加質問・連打）を
+同時ユーザー数を指定して流し、スループット・レイテンシのパーセンタイル・エラー率・サーバーのメモリ使用量を計測する。
+トラフィックはシードから決まるので、同じシードなら同じ順序・同じ画像・同じ質問で再現できる。
+結果はJSONで保存し、--compare でコミット間の差分を表示する。
+
+使い方:
+    # フェイク Gemini でサーバーを起動してから負荷をかける
+    SENP_AI_FAKE_GEMINI=1 gunicorn --bind :8080 --workers 1 --threads 32 main:app
+    python loadtest.py --url http://localhost:8080 --users 16 --duration 60
+
+    # サーバーを起動せず、同じプロセス内の Flask アプリに負荷をかける（既定でフェイク Gemini）
+    python loadtest.py --in-process --users 8 --duration 30
+
+    # トラフィックの構成を変える
+    python loadtest.py --in-process --mix single=0.4,scroll3=0.3,followup=0.2,burst=0.1
+
+    # 2つの結果を比較
+    python loadtest.py --compare loadtest_results/a.json loadtest_results/b.json
+"""
+
+import argparse
+import glob
+import io
+import json
+import os
+import random
+import re
+import statistics
+import subprocess
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+SCENARIOS = ("single", "scroll3", "followup", "burst")
+DEFAULT_MIX = "single=0.5,scroll3=0.2,followup=0.2,burst=0.1"
+
+QUESTIONS = [
+    "この画面の内容を要約してください。",
+    "ログインボタンはどこですか？",
+    "次に何をすればいいですか？",
+    "この設定を変更するにはどこを押せばいいですか？",
+    "このページでできることを教えてください。",
+    "エラーの原因は何ですか？",
+    "保存するにはどうすればいいですか？",
+    "検索欄はどこにありますか？",
+]
+FOLLOWUP_QUESTIONS = [
+    "もう少し詳しく教えてください。",
+    "その次の手順は？",
+    "それはどこにありますか？",
+]
+
+# 連打（burst）で同時に送るリクエスト数
+BURST_SIZE = 5
+# メモリ使用量を取得する間隔（秒）
+MEMORY_POLL_INTERVAL = 2.0
+
+_RSS_PATTERN = re.compile(r"^process_resident_memory_bytes\s+(\S+)", re.MULTILINE)
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(pct / 100.0 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def parse_mix(text):
+    mix = {}
+    for item in text.split(","):
+        name, weight = item.split("=", 1)
+        name = name.strip()
+        if name not in SCENARIOS:
+            raise ValueError(f"unknown scenario: {name} (choose from {SCENARIOS})")
+        mix[name] = float(weight)
+    return mix
+
+
+def load_corpus(directory, limit):
+    """スクリーンショットを読み込む（送信するのはファイルのバイト列のまま）"""
+    paths = sorted(glob.glob(os.path.join(directory, "*.png")))[:limit or None]
+    corpus = []
+    for path in paths:
+        with open(path, "rb") as f:
+            corpus.append((os.path.basename(path), f.read()))
+    return corpus
+
+
+class HttpTransport:
+    """稼働中のサーバーに HTTP で送信"""
+
+    def __init__(self, url, timeout):
+        import requests
+        self.url = url.rstrip("/")
+        self.timeout = timeout
+        self.session = requests.Session()
+
+    def request(self, method, path, data=None, images=None):
+        files = [("images", (name, blob, "image/png")) for name, blob in images or []]
+        response = self.session.request(method, self.url + path, data=data, files=files or None,
+                                        timeout=self.timeout)
+        return response.status_code, response.content
+
+    def metrics_text(self):
+        status, body = self.request("GET", "/metrics")
+        return body.decode("utf-8") if status == 200 else ""
+
+
+class InProcessTransport:
+    """同じプロセス内の Flask アプリに送信（サーバーを起動しない）"""
+
+    def __init__(self, app):
+        self.client = app.test_client()
+
+    def request(self, method, path, data=None, images=None):
+        form = dict(data or {})
+        if images:
+            form["images"] = [(io.BytesIO(blob), name) for name, blob in images]
+        response = self.client.open(path, method=method, data=form,
+                                    content_type="multipart/form-data" if form else None)
+        return response.status_code, response.get_data()
+
+    def metrics_text(self):
+        status, body = self.request("GET", "/metrics")
+        return body.decode("utf-8") if status == 200 else ""
+
+
+class Recorder:
+    """リクエストごとの結果を集める（スレッドセーフ）"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.samples = []
+
+    def add(self, scenario, kind, status, ok, latency_ms):
+        with self._lock:
+            self.samples.append({"scenario": scenario, "kind": kind, "status": status, "ok": ok,
+                                 "latency_ms": latency_ms, "t": time.monotonic()})
+
+
+def _timed(recorder, transport, scenario, kind, method, path, data=None, images=None):
+    start = time.perf_counter()
+    try:
+        status, body = transport.request(method, path, data, images)
+    except Exception as e:
+        print(f"Request error ({scenario}/{kind}): {e}")
+        status, body = 0, b""
+    latency_ms = (time.perf_counter() - start) * 1000
+    ok = 200 <= status < 300
+    if ok and kind == "analyze":
+        # Gemini のエラーは 200 と success: false で返る
+        try:
+            ok = json.loads(body).get("success", False)
+        except ValueError:
+            ok = False
+    recorder.add(scenario, kind, status, ok, latency_ms)
+    return status, body
+
+
+class VirtualUser:
+    """シードから決まる順序でシナリオを繰り返す1人のユーザー"""
+
+    def __init__(self, index, args, corpus, mix, make_transport, recorder):
+        self.random = random.Random(f"{args.seed}:{index}")
+        self.args = args
+        self.corpus = corpus
+        self.scenarios = list(mix)
+        self.weights = [mix[name] for name in self.scenarios]
+        self.make_transport = make_transport
+        self.transport = make_transport()
+        self.recorder = recorder
+
+    def _question(self):
+        question = self.random.choice(QUESTIONS)
+        # 一部は同じ画像・同じ質問を繰り返させて結果キャッシュも通す
+        if self.random.random() >= self.args.repeat_ratio:
+            question += f"（{self.random.randrange(1_000_000)}）"
+        return question
+
+    def _frames(self, count):
+        start = self.random.randrange(len(self.corpus))
+        return [self.corpus[(start + i) % len(self.corpus)] for i in range(count)]
+
+    def _analyze(self, scenario, images, extra=None):
+        data = {"question": self._question(), **(extra or {})}
+        return _timed(self.recorder, self.transport, scenario, "analyze", "POST", "/analyze", data, images)
+
+    def run_single(self):
+        self._analyze("single", self._frames(1), self.args.form)
+
+    def run_scroll3(self):
+        self._analyze("scroll3", self._frames(3), self.args.form)
+
+    def run_followup(self):
+        status, body = _timed(self.recorder, self.transport, "followup", "create_session", "POST", "/sessions",
+                              images=self._frames(1))
+        if status != 200:
+            return
+        session_id = json.loads(body)["session_id"]
+        for _ in range(self.random.randint(2, 3)):
+            data = {"question": self.random.choice(FOLLOWUP_QUESTIONS) + f"（{self.random.randrange(1_000_000)}）",
+                    "session_id": session_id, **self.args.form}
+            _timed(self.recorder, self.transport, "followup", "analyze", "POST", "/analyze", data)
+            self._think()
+        _timed(self.recorder, self.transport, "followup", "delete_session", "DELETE", f"/sessions/{session_id}")
+
+    def run_burst(self):
+        # 同じユーザーが短時間に同じ画面で何度も送る（連打・自動ナビゲーション）
+        images = self._frames(1)
+        questions = [self._question() for _ in range(BURST_SIZE)]
+
+        def send(question):
+            transport = self.make_transport()
+            _timed(self.recorder, transport, "burst", "analyze", "POST", "/analyze",
+                   {"question": question, **self.args.form}, images)
+
+        with ThreadPoolExecutor(max_workers=BURST_SIZE) as executor:
+            list(executor.map(send, questions))
+
+    def _think(self):
+        if self.args.think_ms:
+            time.sleep(self.random.expovariate(1000.0 / self.args.think_ms))
+
+    def run(self, stop_at):
+        while time.monotonic() < stop_at:
+            scenario = self.random.choices(self.scenarios, self.weights)[0]
+            getattr(self, f"run_{scenario}")()
+            self._think()
+
+
+class MemorySampler(threading.Thread):
+    """/metrics からサーバーの常駐メモリを定期的に取得"""
+
+    def __init__(self, transport):
+        super().__init__(daemon=True)
+        self.transport = transport
+        self.values = []
+        self.stop_event = threading.Event()
+
+    def sample(self):
+        try:
+            match = _RSS_PATTERN.search(self.transport.metrics_text())
+            if match:
+                self.values.append(float(match.group(1)))
+        except Exception as e:
+            print(f"WARNING: Failed to read /metrics: {e}")
+
+    def run(self):
+        while not self.stop_event.wait(MEMORY_POLL_INTERVAL):
+            self.sample()
+
+
+def _latency_summary(samples):
+    latencies = [s["latency_ms"] for s in samples]
+    errors = sum(1 for s in samples if not s["ok"])
+    return {
+        "requests": len(samples),
+        "errors": errors,
+        "error_rate": round(errors / len(samples), 4) if samples else 0.0,
+        "p50_ms": round(percentile(latencies, 50), 1),
+        "p95_ms": round(percentile(latencies, 95), 1),
+        "p99_ms": round(percentile(latencies, 99), 1),
+        "mean_ms": round(statistics.mean(latencies), 1) if latencies else 0.0,
+    }
+
+
+def summarize(recorder, elapsed, memory):
+    samples = recorder.samples
+    analyze = [s for s in samples if s["kind"] == "analyze"]
+    status_counts = {}
+    for s in samples:
+        status_counts[str(s["status"])] = status_counts.get(str(s["status"]), 0) + 1
+    summary = {
+        "duration_s": round(elapsed, 1),
+        "throughput_rps": round(len(analyze) / elapsed, 2) if elapsed else 0.0,
+        "analyze": _latency_summary(analyze),
+        "scenarios": {name: _latency_summary([s for s in analyze if s["scenario"] == name])
+                      for name in SCENARIOS if any(s["scenario"] == name for s in analyze)},
+        "status_counts": status_counts,
+    }
+    if memory:
+        summary["memory_rss_mb"] = {
+            "start": round(memory[0] / 1e6, 1),
+            "end": round(memory[-1] / 1e6, 1),
+            "max": round(max(memory) / 1e6, 1),
+        }
+    return summary
+
+
+def _git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_summary(summary):
+    a = summary["analyze"]
+    print(f"\nthroughput: {summary['throughput_rps']} req/s over {summary['duration_s']}s "
+          f"({a['requests']} analyze requests, error rate {a['error_rate'] * 100:.1f}%)")
+    print(f"{'scenario':10s} {'reqs':>6s} {'err%':>6s} {'p50':>9s} {'p95':>9s} {'p99':>9s}")
+    for name, row in [("all", a), *summary["scenarios"].items()]:
+        print(f"{name:10s} {row['requests']:6d} {row['error_rate'] * 100:6.1f} "
+              f"{row['p50_ms']:8.1f}ms {row['p95_ms']:8.1f}ms {row['p99_ms']:8.1f}ms")
+    print(f"status: {summary['status_counts']}")
+    if "memory_rss_mb" in summary:
+        m = summary["memory_rss_mb"]
+        print(f"server RSS: start={m['start']}MB end={m['end']}MB max={m['max']}MB")
+
+
+def _flatten(summary):
+    rows = {"throughput_rps": summary["throughput_rps"]}
+    for name, row in [("all", summary["analyze"]), *summary["scenarios"].items()]:
+        for key in ("p50_ms", "p95_ms", "p99_ms", "error_rate"):
+            rows[f"{name}.{key}"] = row[key]
+    for key, value in summary.get("memory_rss_mb", {}).items():
+        rows[f"memory_rss_mb.{key}"] = value
+    return rows
+
+
+def compare(path_a, path_b):
+    """2つの結果の主要な指標を並べて差分を表示"""
+    with open(path_a, encoding="utf-8") as f:
+        a = json.load(f)
+    with open(path_b, encoding="utf-8") as f:
+        b = json.load(f)
+    print(f"A: {path_a} (commit {a.get('commit')}, {a.get('label') or ''})")
+    print(f"B: {path_b} (commit {b.get('commit')}, {b.get('label') or ''})")
+    if a.get("config") != b.get("config"):
+        print("WARNING: configs differ; the comparison may not be meaningful.")
+    rows_a, rows_b = _flatten(a["summary"]), _flatten(b["summary"])
+    print(f"{'metric':28s} {'A':>10s} {'B':>10s} {'delta':>9s}")
+    for key in rows_a:
+        if key not in rows_b:
+            continue
+        va, vb = rows_a[key], rows_b[key]
+        delta = f"{(vb - va) / va * 100:+.1f}%" if va else "-"
+        print(f"{key:28s} {va:10} {vb:10} {delta:>9s}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="SENP_AI backend load test")
+    parser.add_argument("--url", default="http://localhost:8080")
+    parser.add_argument("--in-process", action="store_true", help="サーバーを起動せず同じプロセス内のアプリに送る")
+    parser.add_argument("--users", type=int, default=8, help="同時ユーザー数")
+    parser.add_argument("--duration", type=float, default=30.0, help="計測時間（秒）")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help="シナリオの比率（single / scroll3 / followup / burst）")
+    parser.add_argument("--think-ms", type=float, default=500.0, help="ユーザーの操作間隔の平均（ミリ秒）")
+    parser.add_argument("--repeat-ratio", type=float, default=0.2, help="同じ画像・質問を繰り返す割合")
+    parser.add_argument("--images", default=os.path.join(os.path.dirname(__file__), "..", "screenshots"))
+    parser.add_argument("--limit", type=int, default=50, help="使用するスクリーンショットの枚数")
+    parser.add_argument("--model", default=None)
+    parser.add_argument("--mode", default=None, choices=["instant", "balanced", "thorough"])
+    parser.add_argument("--timeout", type=float, default=120.0)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--label", default="", help="結果に付けるラベル")
+    parser.add_argument("--output-dir", default="loadtest_results")
+    parser.add_argument("--compare", nargs=2, metavar=("A", "B"), help="2つの結果JSONを比較")
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(*args.compare)
+        return
+
+    args.form = {key: value for key, value in (("model", args.model), ("mode", args.mode)) if value}
+    mix = parse_mix(args.mix)
+    corpus = load_corpus(args.images, args.limit)
+    if not corpus:
+        print(f"No images found in {args.images}")
+        return
+
+    if args.in_process:
+        os.environ.setdefault("SENP_AI_FAKE_GEMINI", "1")
+        from main import app
+        make_transport = lambda: InProcessTransport(app)
+    else:
+        make_transport = lambda: HttpTransport(args.url, args.timeout)
+
+    print(f"Load test: {args.users} users, {args.duration}s, mix={mix}, {len(corpus)} images, seed={args.seed}")
+    recorder = Recorder()
+    sampler = MemorySampler(make_transport())
+    sampler.sample()
+    sampler.start()
+
+    users = [VirtualUser(i, args, corpus, mix, make_transport, recorder) for i in range(args.users)]
+    start = time.monotonic()
+    stop_at = start + args.duration
+    with ThreadPoolExecutor(max_workers=args.users) as executor:
+        futures = [executor.submit(user.run, stop_at) for user in users]
+        for future in futures:
+            future.result()
+    elapsed = time.monotonic() - start
+    sampler.stop_event.set()
+    sampler.sample()
+
+    summary = summarize(recorder, elapsed, sampler.values)
+    print_summary(summary)
+
+    config = {key: value for key, value in vars(args).items() if key not in ("compare", "output_dir", "label")}
+    result = {
+        "label": args.label,
+        "commit": _git_commit(),
+        "started_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "fake_gemini": os.environ.get("SENP_AI_FAKE_GEMINI", "0") not in ("", "0") if args.in_process else None,
+        "config": config,
+        "summary": summary,
+    }
+    os.makedirs(args.output_dir, exist_ok=True)
+    suffix = f"_{args.label}" if args.label else ""
+    path = os.path.join(args.output_dir, f"{time.strftime('%Y%m%d_%H%M%S')}_{result['commit'] or 'nogit'}{suffix}.json")
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(result, f, ensure_ascii=False, indent=2)
+    print(f"Saved results to {path}")
+
+
+if __name__ == "__main__":
+    main()
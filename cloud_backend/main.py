@@ -1,14 +1,80 @@
 
+import json
 import os
-from flask import Flask, request, jsonify
-from PIL import Image
-from ai_logic import AIModule
+import time
+from concurrent.futures import ThreadPoolExecutor
+from flask import Flask, Response, g, request, jsonify
+import metrics
+from admission import PRIORITIES, AdmissionController, AdmissionRejected, client_disconnected
+from ai_logic import LATENCY_MODES, AIModule
+from preprocess import PreprocessConfig, prepare_uploads
+from result_cache import AnalysisCache, make_cache_key
+from routing import ModelRouter, SearchRouter
+from sessions import SessionStore, SessionTooLarge
 
 app = Flask(__name__)
 
 # Initialize AI Module lazy, or global if API key is present
 ai_module = None
 
+# Geminiに送る前の画像前処理の設定
+preprocess_config = PreprocessConfig.from_env()
+
+# 同一リクエストの結果キャッシュ（single-flight付き）
+analysis_cache = AnalysisCache()
+
+# 同時実行数の制限と優先度付きの待ち行列（interactive > navigation > batch）
+admission = AdmissionController()
+
+# /analyze/batch の設定
+BATCH_STRATEGIES = ("auto", "single", "parallel")
+BATCH_MAX_QUESTIONS = int(os.environ.get("BATCH_MAX_QUESTIONS", "8"))
+BATCH_MAX_PARALLEL = int(os.environ.get("BATCH_MAX_PARALLEL", "4"))
+
+# 会話セッション（画像と会話ターンをサーバー側で保持）
+session_store = SessionStore()
+
+# Google検索グラウンディングを付けるかの判定
+search_router = SearchRouter()
+
+# model="auto" / レイテンシ予算が指定された場合のモデル選択
+model_router = ModelRouter()
+
+def _release_context_cache(session):
+    # セッション破棄時にGemini側のコンテキストキャッシュも削除する
+    if ai_module is not None and ai_module.context_cache is not None:
+        ai_module.context_cache.release(session.session_id)
+
+session_store.add_evict_callback(_release_context_cache)
+
+def _queue_depth():
+    return [((priority,), depth) for priority, depth in admission.stats()["queue_depth"].items()]
+
+metrics.REGISTRY.register(metrics.GaugeFunc(
+    "senpai_result_cache_hit_ratio", "Result cache hit ratio (hits + coalesced over lookups)",
+    lambda: analysis_cache.stats()["hit_rate"]))
+metrics.REGISTRY.register(metrics.GaugeFunc(
+    "senpai_context_cache_entries", "Live Gemini context caches",
+    lambda: ai_module.context_cache.stats()["entries"] if ai_module is not None and ai_module.context_cache else None))
+metrics.REGISTRY.register(metrics.GaugeFunc(
+    "senpai_sessions", "Live conversation sessions", lambda: session_store.stats()["sessions"]))
+metrics.REGISTRY.register(metrics.GaugeFunc(
+    "senpai_admission_queue_depth", "Requests waiting for an admission slot", _queue_depth, ["priority"]))
+metrics.REGISTRY.register(metrics.GaugeFunc(
+    "senpai_admission_in_flight", "Requests currently calling Gemini", lambda: admission.stats()["in_flight"]))
+
+@app.before_request
+def _start_timer():
+    g.start_time = time.perf_counter()
+
+@app.after_request
+def _record_request_metrics(response):
+    endpoint = request.endpoint or "unknown"
+    if endpoint != "metrics_endpoint":
+        metrics.REQUESTS.inc(endpoint, response.status_code, g.get("metrics_model", ""), g.get("metrics_outcome", ""))
+        metrics.REQUEST_DURATION.observe(time.perf_counter() - g.start_time, endpoint)
+    return response
+
 def get_ai_module():
     global ai_module
     if ai_module is None:
@@ -23,45 +89,445 @@ def get_ai_module():
 def health_check():
     return jsonify({"status": "healthy", "service": "SENP_AI_Backend"}), 200
 
+@app.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    return Response(metrics.REGISTRY.render(), content_type=metrics.CONTENT_TYPE)
+
+@app.route('/stats', methods=['GET'])
+def stats():
+    result = {"cache": analysis_cache.stats(), "sessions": session_store.stats(), "search": search_router.stats(),
+              "models": model_router.stats(), "admission": admission.stats()}
+    if ai_module is not None and ai_module.context_cache is not None:
+        result["context_cache"] = ai_module.context_cache.stats()
+    return jsonify(result), 200
+
+def _read_uploaded_images():
+    """リクエストに含まれる画像ファイルをバイト列のリストとして読み込む"""
+    # Handle multiple images (e.g. for scrolling captures)
+    if 'images' in request.files:
+        files = request.files.getlist('images')
+    # Handle single image
+    elif 'image' in request.files:
+        files = [request.files['image']]
+    else:
+        files = []
+    return [file.read() for file in files]
+
+def _read_local_turns():
+    """
+    クライアントがモデルを呼ばずに答えた会話ターン（turns フィールドの JSON 配列）を読み込む
+    形式が正しくなければ ValueError
+    """
+    raw = request.form.get('turns')
+    if not raw:
+        return []
+    turns = json.loads(raw)
+    if not isinstance(turns, list) or not all(
+            isinstance(turn, dict) and turn.get("role") in ("user", "assistant") and isinstance(turn.get("text"), str)
+            for turn in turns):
+        raise ValueError("turns must be a list of {role, text}")
+    return turns
+
+def _session_not_found(session_id):
+    return jsonify({"error": f"Session not found or expired: {session_id}", "session_expired": True}), 404
+
+def _session_too_large(error):
+    return jsonify({"error": str(error), "max_bytes": error.max_bytes}), 413
+
+@app.route('/sessions', methods=['POST'])
+def create_session():
+    try:
+        session = session_store.create(_read_uploaded_images())
+    except SessionTooLarge as e:
+        return _session_too_large(e)
+    return jsonify({
+        "session_id": session.session_id,
+        "ttl_seconds": session_store.ttl_seconds,
+        "image_count": len(session.image_blobs),
+    }), 200
+
+@app.route('/sessions/<session_id>/images', methods=['PUT'])
+def update_session_images(session_id):
+    session = session_store.get(session_id)
+    if session is None:
+        return _session_not_found(session_id)
+    image_blobs = _read_uploaded_images()
+    if not image_blobs:
+        return jsonify({"error": "No image provided"}), 400
+    with session.lock:
+        try:
+            session_store.update_images(session, image_blobs)
+        except SessionTooLarge as e:
+            return _session_too_large(e)
+    return jsonify({"session_id": session_id, "image_count": len(image_blobs)}), 200
+
+@app.route('/sessions/<session_id>', methods=['DELETE'])
+def delete_session(session_id):
+    if not session_store.delete(session_id):
+        return _session_not_found(session_id)
+    return jsonify({"session_id": session_id, "deleted": True}), 200
+
+def _log_request(result, cache_status, elapsed, session=None, search_decision=None, model_decision=None):
+    """リクエストログを1行のJSONで出力（Cloud Loggingで構造化ログとして扱われる）"""
+    usage = result.get("usage") or {}
+    print(json.dumps({
+        "severity": "INFO" if result.get("success") else "ERROR",
+        "message": "analyze",
+        "model": result.get("model"),
+        "model_reason": (model_decision or {}).get("reason"),
+        "success": bool(result.get("success")),
+        "session": session is not None,
+        "result_cache": cache_status,
+        "context_cache": bool(result.get("context_cache")),
+        "search": bool(result.get("search")),
+        "search_reason": (search_decision or {}).get("reason"),
+        "search_escalated": bool(result.get("search_escalated")),
+        "latency_ms": round(elapsed * 1000, 1),
+        "prompt_tokens": usage.get("prompt_tokens", 0),
+        "cached_tokens": usage.get("cached_tokens", 0),
+        "uncached_tokens": usage.get("uncached_tokens", 0),
+        "output_tokens": usage.get("output_tokens", 0),
+        "thoughts_tokens": usage.get("thoughts_tokens", 0),
+        "mode": result.get("mode"),
+    }, ensure_ascii=False))
+
+def _request_deadline():
+    """
+    リクエストの期限を time.monotonic() 基準で返す（指定がなければ None）
+    X-Request-Timeout-Ms（相対, ミリ秒）と X-Request-Deadline（UNIX時刻, 秒）のうち早い方を使う
+    """
+    now = time.monotonic()
+    deadlines = []
+    if request.headers.get('X-Request-Timeout-Ms'):
+        deadlines.append(now + float(request.headers['X-Request-Timeout-Ms']) / 1000)
+    if request.headers.get('X-Request-Deadline'):
+        deadlines.append(now + float(request.headers['X-Request-Deadline']) - time.time())
+    return min(deadlines) if deadlines else None
+
+def _make_cancel_check(deadline, environ):
+    """期限切れ・クライアント切断の場合に理由を返す関数を作る"""
+    def cancel_check():
+        if deadline is not None and time.monotonic() > deadline:
+            return "deadline exceeded"
+        if client_disconnected(environ):
+            return "client disconnected"
+        return None
+    return cancel_check
+
+def _run_cached_analysis(module, image_blobs, user_question, requested_model, search_decision, session=None,
+                         mode=None, priority="interactive", deadline=None, images=None, environ=None, timing=None):
+    """
+    キャッシュ（single-flight付き）を通して画像解析を実行
+    images を渡した場合は前処理済みの画像として使う（同じ画像に複数の質問をする場合に共有する）
+    environ はリクエストのコンテキスト外（別スレッド）から呼ぶ場合に渡す
+    timing に辞書を渡すと、Gemini を呼び出した場合はその所要時間（受付の待ち時間を除く）を "gemini_seconds" に入れる
+    """
+    history = list(session.turns) if session is not None else None
+    environ = environ if environ is not None else request.environ
+    cancel_check = _make_cancel_check(deadline, environ)
+
+    def run_analysis():
+        # Gemini を呼び出すリクエストだけが実行枠を使う（キャッシュヒット・合流は待たない）
+        admission.acquire(priority, deadline, should_cancel=lambda: client_disconnected(environ))
+        start = time.monotonic()
+        try:
+            # 圧縮済みで上限内の画像はデコードせずにそのまま渡し、それ以外はデコードして前処理する
+            prepared = images
+            if prepared is None:
+                prepared = prepare_uploads(image_blobs, preprocess_config, on_prepared=metrics.observe_image)
+            gemini_start = time.perf_counter()
+            # Pass model_override to analyze_images
+            result = module.analyze_images(
+                prepared, user_question, model_override=requested_model, history=history,
+                context_cache_key=session.session_id if session is not None else None,
+                images_fingerprint=session.images_digest if session is not None else None,
+                use_search=search_decision["use_search"],
+                allow_escalation=search_decision["allow_escalation"],
+                mode=mode,
+                cancel_check=cancel_check)
+            gemini_seconds = time.perf_counter() - gemini_start
+            metrics.STAGE_DURATION.observe(gemini_seconds, "gemini")
+            if timing is not None:
+                timing["gemini_seconds"] = gemini_seconds
+            metrics.observe_usage(result.get("model"), result.get("usage") or {})
+        finally:
+            admission.release(time.monotonic() - start)
+        if result.get("cancelled") and "disconnected" in result.get("error", ""):
+            admission.record_cancelled()
+        return result
+
+    context = AIModule.format_history(history) if history else ""
+    # 検索の有無で回答が変わるため、判定結果もキャッシュキーに含める
+    context += f"\nsearch={search_decision['use_search']},escalation={search_decision['allow_escalation']}"
+    context += f"\nmode={mode or module.latency_mode}"
+    cache_key = make_cache_key(image_blobs, user_question, requested_model or module.model, context)
+    # 期限切れ・切断による取り消しと受付拒否はこのリクエスト固有なので、合流したリクエストには共有しない
+    return analysis_cache.get_or_compute(cache_key, run_analysis, private_errors=(AdmissionRejected,))
+
 @app.route('/analyze', methods=['POST'])
 def analyze():
-    # Get requested model from form data
+    # Get requested model from form data ("auto" ならバックエンドが選択する)
     requested_model = request.form.get('model')
+    try:
+        latency_budget_ms = int(request.form['latency_budget_ms']) if request.form.get('latency_budget_ms') else None
+    except ValueError:
+        return jsonify({"error": "latency_budget_ms must be an integer"}), 400
+    # レイテンシモード（instant / balanced / thorough、省略時はサーバーの既定値）
+    mode = request.form.get('mode') or None
+    if mode is not None and mode not in LATENCY_MODES:
+        return jsonify({"error": f"mode must be one of {list(LATENCY_MODES)}"}), 400
+    # 優先度（interactive / navigation / batch）と期限
+    priority = request.headers.get('X-Request-Priority', 'interactive')
+    if priority not in PRIORITIES:
+        return jsonify({"error": f"X-Request-Priority must be one of {list(PRIORITIES)}"}), 400
+    try:
+        deadline = _request_deadline()
+    except ValueError:
+        return jsonify({"error": "Invalid deadline header"}), 400
     
     try:
         module = get_ai_module()
     except Exception as e:
         return jsonify({"error": f"Failed to initialize AI: {str(e)}"}), 500
 
-    if 'image' not in request.files and 'images' not in request.files:
-         return jsonify({"error": "No image provided"}), 400
-    
     user_question = request.form.get('question', '')
     if not user_question:
         return jsonify({"error": "No question provided"}), 400
 
-    images = []
     try:
-        # Handle multiple images (e.g. for scrolling captures)
-        if 'images' in request.files:
-            files = request.files.getlist('images')
-            for file in files:
-                img = Image.open(file.stream)
-                images.append(img)
-        # Handle single image
-        elif 'image' in request.files:
-            file = request.files['image']
-            img = Image.open(file.stream)
-            images.append(img)
-            
-        # Pass model_override to analyze_images
-        result = module.analyze_images(images, user_question, model_override=requested_model)
-        return jsonify(result)
+        local_turns = _read_local_turns()
+    except ValueError:
+        return jsonify({"error": "turns must be a JSON list of {role, text}"}), 400
+
+    session = None
+    session_id = request.form.get('session_id')
+    if session_id:
+        session = session_store.get(session_id)
+        if session is None:
+            return _session_not_found(session_id)
+
+    # 検索ツールを付けるか（クライアントのヒント "search" = auto/on/off を優先）
+    search_decision = search_router.decide(user_question, request.form.get('search'))
+
+    start_time = time.perf_counter()
+    # セッションに記録したローカルのターン数（クライアントはこの数を見て送ったターンを消す）
+    turns_recorded = 0
+    timing = {}
+    try:
+        image_blobs = _read_uploaded_images()
+        if session is not None:
+            # セッション内の解析は順番に処理し、会話ターンの順序を保つ
+            with session.lock:
+                if image_blobs:
+                    try:
+                        session_store.update_images(session, image_blobs)
+                    except SessionTooLarge as e:
+                        return _session_too_large(e)
+                elif not session.image_blobs:
+                    return jsonify({"error": "No image provided"}), 400
+                # 前回の解析以降にクライアントがローカルで答えたやり取りを、この質問より前のターンとして記録する
+                for turn in local_turns:
+                    session.add_turn(turn["role"], turn["text"])
+                turns_recorded = len(local_turns)
+                model_decision = model_router.route(
+                    user_question, len(session.image_blobs), requested_model, latency_budget_ms)
+                result, cache_status = _run_cached_analysis(
+                    module, session.image_blobs, user_question, model_decision["model"], search_decision,
+                    session=session, mode=mode, priority=priority, deadline=deadline, timing=timing)
+                if result.get("success"):
+                    session.add_turn("user", user_question)
+                    session.add_turn("assistant", result.get("answer", ""))
+        else:
+            if not image_blobs:
+                return jsonify({"error": "No image provided"}), 400
+            model_decision = model_router.route(user_question, len(image_blobs), requested_model, latency_budget_ms)
+            result, cache_status = _run_cached_analysis(
+                module, image_blobs, user_question, model_decision["model"], search_decision, mode=mode,
+                priority=priority, deadline=deadline, timing=timing)
+
+        elapsed = time.perf_counter() - start_time
+        metrics.RESULT_CACHE.inc(cache_status)
+        g.metrics_model = result.get("model") or ""
+        g.metrics_outcome = "cancelled" if result.get("cancelled") else ("success" if result.get("success") else "error")
+        if cache_status == "miss" and not result.get("cancelled") and "gemini_seconds" in timing:
+            # ルーターにはモデル自体の速さを記録する（受付の待ち行列が混んでいてもモデルが遅いとはみなさない）
+            gemini_seconds = timing["gemini_seconds"]
+            model_router.record(result.get("model"), gemini_seconds, result.get("success"))
+            if result.get("success"):
+                search_router.record(result.get("search"), gemini_seconds, escalated=result.get("search_escalated"))
+        _log_request(result, cache_status, elapsed, session, search_decision, model_decision)
+        # 選択されたモデルと理由を返す（キャッシュ上の結果は共有されるのでコピーに追加する）
+        result = dict(result, routing={
+            "requested_model": requested_model,
+            "reason": model_decision["reason"],
+            "estimated_latency_ms": model_decision["estimated_latency_ms"],
+        }, turns_recorded=turns_recorded)
+        response = jsonify(result)
+        response.headers['X-Cache'] = cache_status.upper()
+        if result.get("cancelled"):
+            # 期限切れは 504、クライアント切断は 499（レスポンスは読まれない）
+            response.status_code = 504 if "deadline" in result.get("error", "") else 499
+        return response
         
+    except AdmissionRejected as e:
+        g.metrics_outcome = "rejected"
+        # 待ち行列が満杯・期限に間に合わない・切断: 上流を呼ばずに断る
+        print(json.dumps({"severity": "WARNING", "message": "admission rejected", "reason": e.reason,
+                          "priority": priority}, ensure_ascii=False))
+        response = jsonify({"success": False, "error": f"Request rejected: {e.reason}", "rejected": True,
+                            "turns_recorded": turns_recorded})
+        response.status_code = e.status
+        if e.retry_after is not None:
+            response.headers['Retry-After'] = str(e.retry_after)
+        return response
+    except Exception as e:
+        g.metrics_outcome = "error"
+        import traceback
+        traceback.print_exc()
+        return jsonify({"error": f"Analysis failed: {str(e)}", "turns_recorded": turns_recorded}), 500
+
+def _parse_batch_questions():
+    """質問のリストを取り出す（questions フィールドの複数指定、または JSON 配列1つ）"""
+    questions = request.form.getlist('questions')
+    if len(questions) == 1 and questions[0].lstrip().startswith('['):
+        questions = json.loads(questions[0])
+    if not isinstance(questions, list) or not all(isinstance(q, str) for q in questions):
+        raise ValueError("questions must be a list of strings")
+    return [q.strip() for q in questions if q.strip()]
+
+@app.route('/analyze/batch', methods=['POST'])
+def analyze_batch():
+    """
+    1組の画像に対する複数の質問にまとめて回答する
+    strategy: "single"（1回の構造化出力の呼び出し）/ "parallel"（前処理済みの画像を共有した並列呼び出し）/ "auto"
+    """
+    requested_model = request.form.get('model')
+    mode = request.form.get('mode') or None
+    if mode is not None and mode not in LATENCY_MODES:
+        return jsonify({"error": f"mode must be one of {list(LATENCY_MODES)}"}), 400
+    strategy = request.form.get('strategy', 'auto')
+    if strategy not in BATCH_STRATEGIES:
+        return jsonify({"error": f"strategy must be one of {list(BATCH_STRATEGIES)}"}), 400
+    priority = request.headers.get('X-Request-Priority', 'interactive')
+    if priority not in PRIORITIES:
+        return jsonify({"error": f"X-Request-Priority must be one of {list(PRIORITIES)}"}), 400
+    try:
+        deadline = _request_deadline()
+        questions = _parse_batch_questions()
+    except ValueError as e:
+        return jsonify({"error": f"Invalid request: {e}"}), 400
+    if not questions:
+        return jsonify({"error": "No question provided"}), 400
+    if len(questions) > BATCH_MAX_QUESTIONS:
+        return jsonify({"error": f"Too many questions (max {BATCH_MAX_QUESTIONS})"}), 400
+
+    try:
+        module = get_ai_module()
+    except Exception as e:
+        return jsonify({"error": f"Failed to initialize AI: {str(e)}"}), 500
+
+    image_blobs = _read_uploaded_images()
+    if not image_blobs:
+        return jsonify({"error": "No image provided"}), 400
+
+    start_time = time.perf_counter()
+    environ = request.environ
+    try:
+        # 画像のデコード・前処理は1回だけ行い、すべての質問で共有する
+        images = prepare_uploads(image_blobs, preprocess_config, on_prepared=metrics.observe_image)
+        # エンコードも1回だけにする（並列呼び出しで同じ PIL 画像を各スレッドがエンコードしないように）
+        images = [AIModule._image_part(img) for img in images]
+        preprocess_ms = (time.perf_counter() - start_time) * 1000
+
+        model_decision = model_router.route("\n".join(questions), len(image_blobs), requested_model)
+        use_model = model_decision["model"]
+        decisions = [search_router.decide(q, request.form.get('search')) for q in questions]
+        use_search = any(d["use_search"] for d in decisions)
+
+        if strategy == "auto":
+            strategy = "single" if len(questions) > 1 and module.supports_batch_call(use_model, use_search) else "parallel"
+        elif strategy == "single" and not module.supports_batch_call(use_model, use_search):
+            # 構造化出力が使えない組み合わせ（検索付きの Gemini 3 以外）は並列呼び出しにする
+            strategy = "parallel"
+
+        results = [None] * len(questions)
+        timings = [None] * len(questions)
+        if strategy == "single":
+            admission.acquire(priority, deadline, should_cancel=lambda: client_disconnected(environ))
+            call_start = time.perf_counter()
+            try:
+                batch = module.analyze_batch(
+                    images, questions, model_override=use_model, use_search=use_search, mode=mode,
+                    cancel_check=_make_cancel_check(deadline, environ))
+            finally:
+                admission.release(time.perf_counter() - call_start)
+            call_ms = (time.perf_counter() - call_start) * 1000
+            metrics.STAGE_DURATION.observe(call_ms / 1000, "gemini")
+            metrics.observe_usage(batch.get("model"), batch.get("usage") or {})
+            g.metrics_model = batch.get("model") or ""
+            if batch.get("cancelled"):
+                g.metrics_outcome = "cancelled"
+                return jsonify(batch), 504 if "deadline" in batch.get("error", "") else 499
+            if batch.get("success"):
+                for i, item in enumerate(batch["results"]):
+                    if item is not None:
+                        results[i] = item
+                        timings[i] = {"latency_ms": round(call_ms, 1), "result_cache": "none"}
+
+        # 並列呼び出し（single で回答が欠けた質問もここで個別に回答する）
+        pending = [i for i, result in enumerate(results) if result is None]
+
+        def answer(i):
+            question_start = time.perf_counter()
+            result, cache_status = _run_cached_analysis(
+                module, image_blobs, questions[i], use_model, decisions[i], mode=mode, priority=priority,
+                deadline=deadline, images=images, environ=environ)
+            metrics.RESULT_CACHE.inc(cache_status)
+            return i, result, {"latency_ms": round((time.perf_counter() - question_start) * 1000, 1),
+                               "result_cache": cache_status}
+
+        if pending:
+            with ThreadPoolExecutor(max_workers=min(len(pending), BATCH_MAX_PARALLEL)) as executor:
+                for i, result, timing in executor.map(answer, pending):
+                    results[i] = result
+                    timings[i] = timing
+
+        total_ms = (time.perf_counter() - start_time) * 1000
+        items = [dict(result, question=question, timing=timing)
+                 for question, result, timing in zip(questions, results, timings)]
+        succeeded = sum(1 for result in results if result.get("success"))
+        g.metrics_model = g.get("metrics_model") or next((r.get("model") for r in results if r.get("model")), "")
+        g.metrics_outcome = "success" if succeeded == len(questions) else "error"
+        print(json.dumps({
+            "severity": "INFO" if succeeded == len(questions) else "ERROR",
+            "message": "analyze_batch",
+            "model": g.metrics_model,
+            "strategy": strategy,
+            "questions": len(questions),
+            "succeeded": succeeded,
+            "preprocess_ms": round(preprocess_ms, 1),
+            "latency_ms": round(total_ms, 1),
+        }, ensure_ascii=False))
+        return jsonify({
+            "success": succeeded == len(questions),
+            "strategy": strategy,
+            "model": g.metrics_model,
+            "results": items,
+            "timings": {"preprocess_ms": round(preprocess_ms, 1), "total_ms": round(total_ms, 1)},
+        })
+
+    except AdmissionRejected as e:
+        g.metrics_outcome = "rejected"
+        response = jsonify({"success": False, "error": f"Request rejected: {e.reason}", "rejected": True})
+        response.status_code = e.status
+        if e.retry_after is not None:
+            response.headers['Retry-After'] = str(e.retry_after)
+        return response
     except Exception as e:
+        g.metrics_outcome = "error"
         import traceback
         traceback.print_exc()
-        return jsonify({"error": f"Analysis failed: {str(e)}"}), 500
+        return jsonify({"error": f"Batch analysis failed: {str(e)}"}), 500
 
 if __name__ == "__main__":
     # Cloud Run expects the app to listen on PORT environment variable
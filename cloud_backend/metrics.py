@@ -0,0 +1,204 @@
+"""
+Metrics
+Prometheus のテキスト形式（0.0.4）で公開するメトリクス
+
+外部ライブラリに依存しない最小実装。記録はロック1回と辞書の更新だけなので、本番で常時有効にしておける。
+"""
+
+import bisect
+import os
+import resource
+import threading
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# レイテンシ（秒）のバケット
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 20.0, 40.0, 80.0)
+# 画像サイズ（バイト）のバケット
+BYTES_BUCKETS = (16e3, 64e3, 256e3, 512e3, 1e6, 2e6, 4e6, 8e6, 16e6)
+# 画素数のバケット（720p, 1080p, 1440p, 4K 付近）
+PIXEL_BUCKETS = (0.25e6, 0.5e6, 0.92e6, 1.3e6, 2.07e6, 3.69e6, 5.0e6, 8.3e6, 16.6e6)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names, values, extra=None):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class Counter:
+    """単調増加するカウンター"""
+
+    type_name = "counter"
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def inc(self, *labelvalues, amount=1.0):
+        key = tuple(str(v) for v in labelvalues)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def samples(self):
+        with self._lock:
+            items = list(self._values.items())
+        for key, value in sorted(items):
+            yield f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+
+
+class Histogram:
+    """累積バケットのヒストグラム"""
+
+    type_name = "histogram"
+
+    def __init__(self, name, documentation, buckets, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.buckets = tuple(sorted(buckets))
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        # key -> [バケットごとの件数..., 合計, 件数]
+        self._values = {}
+
+    def observe(self, value, *labelvalues):
+        key = tuple(str(v) for v in labelvalues)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [0] * (len(self.buckets) + 1) + [0.0, 0]
+            state[index] += 1
+            state[-2] += value
+            state[-1] += 1
+
+    def samples(self):
+        with self._lock:
+            items = [(key, list(state)) for key, state in self._values.items()]
+        for key, state in sorted(items):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), state):
+                cumulative += count
+                le = f'le="{_format_value(bound)}"'
+                yield f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {cumulative}"
+            labels = _format_labels(self.labelnames, key)
+            yield f"{self.name}_sum{labels} {_format_value(state[-2])}"
+            yield f"{self.name}_count{labels} {state[-1]}"
+
+
+class GaugeFunc:
+    """
+    収集時にコールバックで値を取得するゲージ（キャッシュのヒット率・待ち行列の長さなど）
+    callback は数値、または [(ラベル値のタプル, 数値), ...] を返す
+    """
+
+    type_name = "gauge"
+
+    def __init__(self, name, documentation, callback, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.callback = callback
+        self.labelnames = tuple(labelnames)
+
+    def samples(self):
+        try:
+            values = self.callback()
+        except Exception as e:
+            print(f"WARNING: Failed to collect metric {self.name}: {e}")
+            return
+        if values is None:
+            return
+        if not isinstance(values, list):
+            values = [((), values)]
+        for key, value in values:
+            yield f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+
+
+class Registry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._metrics = []
+
+    def register(self, metric):
+        with self._lock:
+            self._metrics.append(metric)
+        return metric
+
+    def render(self):
+        """全メトリクスをテキスト形式で出力"""
+        with self._lock:
+            metrics = list(self._metrics)
+        lines = []
+        for metric in metrics:
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.type_name}")
+            lines.extend(metric.samples())
+        return "\n".join(lines) + "\n"
+
+
+def process_resident_memory_bytes():
+    """プロセスの常駐メモリ（Linux では /proc から、それ以外は最大常駐サイズ）"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+REGISTRY = Registry()
+
+REQUESTS = REGISTRY.register(Counter(
+    "senpai_requests_total", "HTTP requests by endpoint, status code, model and outcome",
+    ["endpoint", "status", "model", "outcome"]))
+REQUEST_DURATION = REGISTRY.register(Histogram(
+    "senpai_request_duration_seconds", "Total request handling time", LATENCY_BUCKETS, ["endpoint"]))
+STAGE_DURATION = REGISTRY.register(Histogram(
+    "senpai_stage_duration_seconds", "Time spent per stage (decode, preprocess, gemini)", LATENCY_BUCKETS, ["stage"]))
+IMAGE_BYTES = REGISTRY.register(Histogram(
+    "senpai_image_bytes", "Size of uploaded images", BYTES_BUCKETS))
+IMAGE_PIXELS = REGISTRY.register(Histogram(
+    "senpai_image_pixels", "Pixel count of uploaded images", PIXEL_BUCKETS))
+IMAGES = REGISTRY.register(Counter(
+    "senpai_images_total", "Uploaded images by handling (passthrough or preprocessed)", ["handling"]))
+RESULT_CACHE = REGISTRY.register(Counter(
+    "senpai_result_cache_requests_total", "Result cache lookups by status (hit, miss, coalesced)", ["status"]))
+GEMINI_TOKENS = REGISTRY.register(Counter(
+    "senpai_gemini_tokens_total", "Gemini tokens by kind (prompt, cached, output, thoughts)", ["model", "kind"]))
+REGISTRY.register(GaugeFunc(
+    "process_resident_memory_bytes", "Resident memory size in bytes", process_resident_memory_bytes))
+
+
+def observe_image(size_bytes, pixels, decode_seconds, preprocess_seconds):
+    """preprocess.prepare_uploads のコールバック（1枚ごとに呼ばれる）"""
+    IMAGE_BYTES.observe(size_bytes)
+    IMAGE_PIXELS.observe(pixels)
+    STAGE_DURATION.observe(decode_seconds, "decode")
+    if preprocess_seconds is None:
+        IMAGES.inc("passthrough")
+    else:
+        IMAGES.inc("preprocessed")
+        STAGE_DURATION.observe(preprocess_seconds, "preprocess")
+
+
+def observe_usage(model, usage):
+    """Gemini のトークン使用量を記録"""
+    for kind in ("prompt", "cached", "output", "thoughts"):
+        value = usage.get(f"{kind}_tokens", 0)
+        if value:
+            GEMINI_TOKENS.inc(model or "", kind, amount=value)
@@ -0,0 +1,234 @@
+"""
+Image Preprocessing
+Gemini に送る前の画像前処理
+
+- 最大ピクセル数の上限（超えた分は縮小）
+- モデルのタイルグリッド（768px）をわずかに超える画像はタイル境界まで縮小
+- アルファチャンネルの除去（白背景に合成）
+- テキスト中心のページ向けのグレースケール化（任意）
+
+既に圧縮済み（JPEG/WebP）で上限内の画像はデコードせず、そのまま inline data として渡す。
+設定は環境変数から読み込む（PreprocessConfig.from_env）。
+"""
+
+import io
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from google.genai import types
+from PIL import Image
+
+# Gemini は大きな画像を 768x768 のタイルに分割してトークン化する
+GEMINI_TILE_SIZE = 768
+
+GRAYSCALE_MODES = ("off", "on", "auto")
+
+# 再エンコードせずにそのまま Gemini に渡せる形式
+PASSTHROUGH_FORMATS = {
+    "JPEG": "image/jpeg",
+    "WEBP": "image/webp",
+}
+
+
+class PreprocessConfig:
+    """前処理の設定"""
+
+    def __init__(self, max_pixels=0, tile_size=GEMINI_TILE_SIZE, tile_snap_tolerance=0.0,
+                 drop_alpha=True, grayscale="off", saturation_threshold=24):
+        """
+        Args:
+            max_pixels: 1枚あたりの最大ピクセル数（0 で無制限）
+            tile_size: タイルの一辺のピクセル数
+            tile_snap_tolerance: タイル境界をこの割合以内で超えている場合は境界まで縮小（0 で無効）
+            drop_alpha: アルファチャンネルを除去して RGB にする
+            grayscale: "off" / "on" / "auto"（auto は彩度の低い画像のみグレースケール化）
+            saturation_threshold: auto 判定に使う平均彩度のしきい値（0-255）
+        """
+        if grayscale not in GRAYSCALE_MODES:
+            raise ValueError(f"grayscale must be one of {GRAYSCALE_MODES}: {grayscale}")
+        self.max_pixels = max_pixels
+        self.tile_size = tile_size
+        self.tile_snap_tolerance = tile_snap_tolerance
+        self.drop_alpha = drop_alpha
+        self.grayscale = grayscale
+        self.saturation_threshold = saturation_threshold
+
+    @classmethod
+    def from_env(cls):
+        """環境変数から設定を読み込む"""
+        return cls(
+            max_pixels=int(os.environ.get("IMAGE_MAX_PIXELS", str(2560 * 1440))),
+            tile_size=int(os.environ.get("IMAGE_TILE_SIZE", str(GEMINI_TILE_SIZE))),
+            tile_snap_tolerance=float(os.environ.get("IMAGE_TILE_SNAP_TOLERANCE", "0.1")),
+            drop_alpha=os.environ.get("IMAGE_DROP_ALPHA", "1") != "0",
+            grayscale=os.environ.get("IMAGE_GRAYSCALE", "off"),
+        )
+
+    def to_dict(self):
+        return {
+            "max_pixels": self.max_pixels,
+            "tile_size": self.tile_size,
+            "tile_snap_tolerance": self.tile_snap_tolerance,
+            "drop_alpha": self.drop_alpha,
+            "grayscale": self.grayscale,
+        }
+
+
+def target_size(width, height, config):
+    """前処理後の画像サイズを計算（拡大はしない）"""
+    scale = 1.0
+
+    # 最大ピクセル数の上限
+    if config.max_pixels and width * height > config.max_pixels:
+        scale = (config.max_pixels / float(width * height)) ** 0.5
+
+    # タイル境界をわずかに超えているだけなら、境界まで縮小してタイル数を1段減らす
+    if config.tile_size and config.tile_snap_tolerance > 0:
+        for length in (width * scale, height * scale):
+            lower = (int(length) // config.tile_size) * config.tile_size
+            if lower and length > lower and length <= lower * (1 + config.tile_snap_tolerance):
+                scale = min(scale, scale * lower / length)
+
+    if scale >= 1.0:
+        return width, height
+    return max(1, round(width * scale)), max(1, round(height * scale))
+
+
+def _is_low_saturation(img, threshold):
+    """彩度の低い（テキスト中心の）画像かどうかを縮小画像で判定"""
+    thumb = img.convert("RGB")
+    thumb.thumbnail((256, 256))
+    saturation = thumb.convert("HSV").getchannel("S")
+    histogram = saturation.histogram()
+    total = sum(histogram)
+    mean = sum(value * count for value, count in enumerate(histogram)) / total if total else 0
+    return mean < threshold
+
+
+def _drop_alpha(img):
+    """アルファチャンネルを白背景に合成して RGB に変換"""
+    if img.mode == "P" and "transparency" in img.info:
+        img = img.convert("RGBA")
+    if img.mode in ("RGBA", "LA"):
+        background = Image.new("RGB", img.size, (255, 255, 255))
+        background.paste(img, mask=img.getchannel("A"))
+        return background
+    if img.mode not in ("RGB", "L"):
+        return img.convert("RGB")
+    return img
+
+
+def preprocess_image(img, config):
+    """
+    1枚の画像を前処理する
+
+    Args:
+        img: PIL.Image
+        config: PreprocessConfig
+
+    Returns:
+        PIL.Image: 前処理後の画像（変更がなければ元の画像）
+    """
+    if config.drop_alpha:
+        img = _drop_alpha(img)
+
+    new_size = target_size(img.width, img.height, config)
+    if new_size != img.size:
+        # 文字の潰れを抑えるため、縮小は reduce + LANCZOS で行う
+        img = img.resize(new_size, Image.LANCZOS, reducing_gap=2.0)
+
+    if config.grayscale == "on" or (
+            config.grayscale == "auto" and _is_low_saturation(img, config.saturation_threshold)):
+        img = img.convert("L")
+
+    return img
+
+
+def can_pass_through(img, config):
+    """
+    ヘッダー情報（形式・サイズ・モード）だけで、デコードなしに送信できるか判定
+
+    Args:
+        img: Image.open() 直後の（まだデコードしていない）PIL.Image
+        config: PreprocessConfig
+    """
+    if img.format not in PASSTHROUGH_FORMATS:
+        return False
+    if config.drop_alpha and img.mode in ("RGBA", "LA", "PA"):
+        return False
+    # auto のグレースケール判定は画素が必要なため、デコードした画像にのみ適用する
+    if config.grayscale == "on" and img.mode != "L":
+        return False
+    return target_size(img.width, img.height, config) == img.size
+
+
+def prepare_upload(blob, config, on_prepared=None):
+    """
+    アップロードされた画像のバイト列を Gemini に渡せる形にする
+
+    Args:
+        blob: 画像のバイト列
+        config: PreprocessConfig
+        on_prepared: 計測用コールバック on_prepared(バイト数, 画素数, デコード秒, 前処理秒)
+                     （そのまま送信した場合の前処理秒は None）
+
+    Returns:
+        types.Part: そのまま送信できる場合（デコード・再エンコードなし）
+        PIL.Image: 前処理が必要だった場合（デコード・縮小済み）
+    """
+    # Image.open はヘッダーのみを読み込み、画素のデコードは load() まで遅延される
+    start = time.perf_counter()
+    img = Image.open(io.BytesIO(blob))
+    if can_pass_through(img, config):
+        if on_prepared is not None:
+            on_prepared(len(blob), img.width * img.height, time.perf_counter() - start, None)
+        return types.Part.from_bytes(data=blob, mime_type=PASSTHROUGH_FORMATS[img.format])
+    img.load()
+    decoded = time.perf_counter()
+    result = preprocess_image(img, config)
+    if on_prepared is not None:
+        on_prepared(len(blob), img.width * img.height, decoded - start, time.perf_counter() - decoded)
+    return result
+
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            workers = int(os.environ.get("IMAGE_PREPROCESS_WORKERS", str(min(4, os.cpu_count() or 1))))
+            _executor = ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="preprocess")
+        return _executor
+
+
+def preprocess_images(images, config):
+    """
+    複数の画像を並列に前処理する（PIL の縮小処理は GIL を解放するためスレッドで並列化できる）
+
+    Args:
+        images: PIL.Image のリスト
+        config: PreprocessConfig
+
+    Returns:
+        list: 前処理後の PIL.Image のリスト（入力と同じ順序）
+    """
+    if len(images) <= 1:
+        return [preprocess_image(img, config) for img in images]
+    return list(_get_executor().map(lambda img: preprocess_image(img, config), images))
+
+
+def prepare_uploads(image_blobs, config, on_prepared=None):
+    """
+    複数のアップロード画像を並列に prepare_upload する
+
+    Returns:
+        list: types.Part または PIL.Image のリスト（入力と同じ順序）
+    """
+    if len(image_blobs) <= 1:
+        return [prepare_upload(blob, config, on_prepared) for blob in image_blobs]
+    return list(_get_executor().map(lambda blob: prepare_upload(blob, config, on_prepared), image_blobs))
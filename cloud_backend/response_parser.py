@@ -0,0 +1,208 @@
+"""
+Response Parser
+Gemini の回答から回答テキスト・ターゲット領域（複数）・フラグを取り出す
+
+構造化出力（JSON, response_schema）を厳密にパースし、
+失敗した場合は従来の [TARGET_BOX: ...] タグ形式にフォールバックする。
+"""
+
+import json
+import re
+
+from google.genai import types
+
+# 構造化出力のスキーマ
+RESPONSE_SCHEMA = types.Schema(
+    type=types.Type.OBJECT,
+    properties={
+        "answer": types.Schema(
+            type=types.Type.STRING,
+            description="ユーザーへの回答（プレーンテキスト）",
+        ),
+        "targets": types.Schema(
+            type=types.Type.ARRAY,
+            description="ユーザーが見るべき・操作すべき画面上の要素（なければ空配列）",
+            items=types.Schema(
+                type=types.Type.OBJECT,
+                properties={
+                    "label": types.Schema(type=types.Type.STRING, description="要素の短い名前"),
+                    "image_index": types.Schema(type=types.Type.INTEGER, description="要素が写っている画像の番号（0始まり）"),
+                    "box_2d": types.Schema(
+                        type=types.Type.ARRAY,
+                        description="[y_min, x_min, y_max, x_max]（0-1000スケール）",
+                        items=types.Schema(type=types.Type.INTEGER),
+                        min_items=4,
+                        max_items=4,
+                    ),
+                },
+                required=["box_2d"],
+            ),
+        ),
+        "continue_navigation": types.Schema(
+            type=types.Type.BOOLEAN,
+            description="ユーザーの操作後に続けて案内が必要な場合は true",
+        ),
+    },
+    required=["answer", "targets"],
+)
+
+# 1回の呼び出しで複数の質問に答えさせる場合のスキーマ（質問ごとに RESPONSE_SCHEMA と同じ項目 + 質問番号）
+BATCH_RESPONSE_SCHEMA = types.Schema(
+    type=types.Type.OBJECT,
+    properties={
+        "answers": types.Schema(
+            type=types.Type.ARRAY,
+            description="質問ごとの回答（質問と同じ順序）",
+            items=types.Schema(
+                type=types.Type.OBJECT,
+                properties={
+                    "index": types.Schema(type=types.Type.INTEGER, description="質問の番号（0始まり）"),
+                    **RESPONSE_SCHEMA.properties,
+                },
+                required=["index", *RESPONSE_SCHEMA.required],
+            ),
+        ),
+    },
+    required=["answers"],
+)
+
+# 全角の括弧・コロン・カンマや小数の座標も許容する（\d は全角数字にもマッチする）
+_NUMBER = r"\s*(-?\d+(?:\.\d+)?)\s*"
+_SEP = r"[,，、]"
+TARGET_BOX_PATTERN = re.compile(
+    r"[\[［]TARGET_BOX[:：]" + _NUMBER + _SEP + _NUMBER + _SEP + _NUMBER + _SEP + _NUMBER + r"[\]］]"
+)
+_CODE_FENCE_PATTERN = re.compile(r"^```(?:json)?\s*(.*?)\s*```$", re.DOTALL)
+
+
+def normalize_box(values):
+    """
+    [y_min, x_min, y_max, x_max] を 0-1000 の整数に正規化する
+
+    Returns:
+        list or None: 正規化したボックス（幅・高さが 0 の場合は None）
+    """
+    if not isinstance(values, (list, tuple)) or len(values) != 4:
+        return None
+    try:
+        y1, x1, y2, x2 = [min(1000, max(0, int(round(float(v))))) for v in values]
+    except (TypeError, ValueError):
+        return None
+    y_min, y_max = min(y1, y2), max(y1, y2)
+    x_min, x_max = min(x1, x2), max(x1, x2)
+    if y_max == y_min or x_max == x_min:
+        return None
+    return [y_min, x_min, y_max, x_max]
+
+
+def _result(answer, targets, continue_navigation=False, response_format="text"):
+    return {
+        "answer": answer.strip(),
+        "target_boxes": targets,
+        "continue_navigation": continue_navigation,
+        "response_format": response_format,
+    }
+
+
+def _load_json(text):
+    """コードフェンスを取り除いて JSON として読み込む（失敗したら None）"""
+    if not text:
+        return None
+    body = text.strip()
+    fence = _CODE_FENCE_PATTERN.match(body)
+    if fence:
+        body = fence.group(1)
+    try:
+        return json.loads(body)
+    except ValueError:
+        return None
+
+
+def parse_structured_response(text):
+    """
+    構造化出力（JSON）を厳密にパースする
+
+    Returns:
+        dict or None: スキーマに合わない場合は None
+    """
+    return _parse_structured_item(_load_json(text))
+
+
+def _parse_structured_item(data):
+    """1問分の構造化出力（answer / targets / continue_navigation）を検証して結果に変換"""
+    if not isinstance(data, dict) or not isinstance(data.get("answer"), str):
+        return None
+
+    raw_targets = data.get("targets", [])
+    if not isinstance(raw_targets, list):
+        return None
+
+    targets = []
+    for item in raw_targets:
+        if not isinstance(item, dict):
+            return None
+        box = normalize_box(item.get("box_2d"))
+        if box is None:
+            # 1要素の座標だけが壊れている場合は、その要素だけを捨てる
+            print(f"WARNING: Invalid box_2d in structured response: {item.get('box_2d')}")
+            continue
+        image_index = item.get("image_index", 0)
+        targets.append({
+            "box": box,
+            "label": str(item.get("label") or ""),
+            "image_index": image_index if isinstance(image_index, int) and image_index >= 0 else 0,
+        })
+
+    return _result(
+        data["answer"],
+        targets,
+        continue_navigation=data.get("continue_navigation") is True,
+        response_format="json",
+    )
+
+
+def parse_batch_response(text, count):
+    """
+    複数質問の構造化出力をパースする
+
+    Returns:
+        list or None: 質問の順に結果を並べたリスト（回答が欠けた・壊れた質問は None）
+                      全体が JSON として読めない場合は None
+    """
+    data = _load_json(text)
+    if not isinstance(data, dict) or not isinstance(data.get("answers"), list):
+        return None
+    results = [None] * count
+    for item in data["answers"]:
+        if not isinstance(item, dict):
+            continue
+        index = item.get("index")
+        if not isinstance(index, int) or not 0 <= index < count or results[index] is not None:
+            continue
+        results[index] = _parse_structured_item(item)
+    return results
+
+
+def parse_legacy_response(text):
+    """従来の [TARGET_BOX: ...] / [CONTINUE] / [SHOW_ARROW] タグ形式をパースする（複数ボックス対応）"""
+    answer = text or ""
+
+    targets = []
+    for match in TARGET_BOX_PATTERN.finditer(answer):
+        box = normalize_box(match.groups())
+        if box is not None:
+            targets.append({"box": box, "label": "", "image_index": 0})
+    answer = TARGET_BOX_PATTERN.sub("", answer)
+
+    # 継続フラグ抽出
+    continue_navigation = "[CONTINUE]" in answer
+    answer = answer.replace("[CONTINUE]", "").replace("[SHOW_ARROW]", "")
+    return _result(answer, targets, continue_navigation=continue_navigation)
+
+
+def parse_response(text):
+    """構造化出力としてパースし、失敗したら従来形式にフォールバックする"""
+    parsed = parse_structured_response(text)
+    if parsed is not None:
+        return parsed
+    return parse_legacy_response(text)
@@ -0,0 +1,197 @@
+"""
+Analysis Result Cache
+/analyze の結果を保持するLRUキャッシュ（TTL付き）
+
+同一内容のリクエスト（クライアントのリトライやダブルクリックなど）が
+同時に届いた場合は、1回のGemini呼び出しの結果を共有する（single-flight）。
+ただし先行リクエスト自身の事情による結果（期限切れ・切断による取り消し、受付拒否）は共有せず、
+待っていたリクエストのうち1つが代わりに実行する。
+"""
+
+import hashlib
+import os
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+
+
+def normalize_question(question):
+    """キャッシュキー用に質問文を正規化（全角/半角・大文字小文字・空白の揺れを吸収）"""
+    text = unicodedata.normalize("NFKC", question or "")
+    return " ".join(text.lower().split())
+
+
+def make_cache_key(image_blobs, question, model, context=""):
+    """
+    画像バイト列・正規化済みの質問・モデル名からキャッシュキーを生成
+
+    Args:
+        image_blobs: 画像ファイルのバイト列のリスト（送信順）
+        question: ユーザーの質問
+        model: 使用するモデル名
+        context: 回答に影響するその他の入力（セッションの会話履歴など）
+    """
+    digest = hashlib.sha256()
+    for blob in image_blobs:
+        digest.update(hashlib.sha256(blob).digest())
+    digest.update(b"\x00q:" + normalize_question(question).encode("utf-8"))
+    digest.update(b"\x00m:" + (model or "").encode("utf-8"))
+    digest.update(b"\x00c:" + (context or "").encode("utf-8"))
+    return digest.hexdigest()
+
+
+class _Flight:
+    """実行中の上流呼び出し（同一キーの後続リクエストはこれを待つ）"""
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+        # 先行リクエストに固有の結果で、後続に共有できない（後続は改めて実行する）
+        self.private = False
+
+
+class AnalysisCache:
+    """
+    成功した解析結果をキャッシュし、同一キーの同時リクエストを合流させる
+    """
+
+    def __init__(self, max_entries=None, ttl_seconds=None):
+        """
+        Args:
+            max_entries: 保持する最大エントリ数（LRUで追い出し）
+            ttl_seconds: エントリの有効期限（秒）
+        """
+        if max_entries is None:
+            max_entries = int(os.environ.get("ANALYSIS_CACHE_MAX_ENTRIES", "256"))
+        if ttl_seconds is None:
+            ttl_seconds = float(os.environ.get("ANALYSIS_CACHE_TTL", "300"))
+
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+
+        self._lock = threading.Lock()
+        # key -> (expires_at, result, compute_seconds)
+        self._entries = OrderedDict()
+        self._inflight = {}
+
+        # 統計
+        self._hits = 0
+        self._misses = 0
+        self._coalesced = 0
+        self._evictions = 0
+        self._saved_seconds = 0.0
+
+    def get_or_compute(self, key, compute, private_errors=()):
+        """
+        キャッシュから結果を返すか、compute() を実行して結果をキャッシュする
+
+        Args:
+            key: make_cache_key() で生成したキー
+            compute: 結果(dict)を返す呼び出し可能オブジェクト（呼び出し元ごとの期限・優先度で実行する）
+            private_errors: 後続のリクエストに共有しない例外の型（受付拒否など、実行したリクエスト固有のもの）
+                取り消された結果（"cancelled"）も共有しない
+
+        Returns:
+            tuple: (result, status) status は "hit" / "coalesced" / "miss"
+        """
+        if self.max_entries <= 0:
+            return compute(), "miss"
+
+        while True:
+            outcome = self._lookup_or_join(key, compute, private_errors)
+            if outcome is not None:
+                return outcome
+
+    def _lookup_or_join(self, key, compute, private_errors):
+        """
+        get_or_compute の1回分（先行リクエストの結果が共有できず、やり直す場合は None）
+        """
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                expires_at, result, compute_seconds = entry
+                if expires_at > now:
+                    self._entries.move_to_end(key)
+                    self._hits += 1
+                    self._saved_seconds += compute_seconds
+                    return result, "hit"
+                del self._entries[key]
+
+            flight = self._inflight.get(key)
+            if flight is None:
+                flight = _Flight()
+                self._inflight[key] = flight
+                leader = True
+                self._misses += 1
+            else:
+                leader = False
+                self._coalesced += 1
+
+        if not leader:
+            wait_start = time.monotonic()
+            flight.event.wait()
+            if flight.private:
+                # 先行リクエストが取り消された・断られただけなので、このリクエストの条件で実行し直す
+                return None
+            if flight.error is not None:
+                raise flight.error
+            with self._lock:
+                # 待機中に上流呼び出しが節約できた時間（先行リクエストの残り時間ではなく1回分を計上）
+                entry = self._entries.get(key)
+                if entry is not None:
+                    self._saved_seconds += max(0.0, entry[2] - (time.monotonic() - wait_start))
+            return flight.result, "coalesced"
+
+        start = time.monotonic()
+        try:
+            result = compute()
+        except Exception as e:
+            flight.error = e
+            flight.private = isinstance(e, private_errors)
+            raise
+        else:
+            flight.result = result
+            flight.private = isinstance(result, dict) and bool(result.get("cancelled"))
+            elapsed = time.monotonic() - start
+            # 失敗結果はキャッシュしない（次のリクエストで再試行させる）
+            if isinstance(result, dict) and result.get("success"):
+                with self._lock:
+                    self._entries[key] = (time.monotonic() + self.ttl_seconds, result, elapsed)
+                    self._entries.move_to_end(key)
+                    while len(self._entries) > self.max_entries:
+                        self._entries.popitem(last=False)
+                        self._evictions += 1
+            return result, "miss"
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+            flight.event.set()
+
+    def purge_expired(self):
+        """期限切れエントリを削除"""
+        now = time.monotonic()
+        with self._lock:
+            expired = [k for k, (expires_at, _, _) in self._entries.items() if expires_at <= now]
+            for k in expired:
+                del self._entries[k]
+        return len(expired)
+
+    def stats(self):
+        """ヒット率や節約できたレイテンシなどの統計を返す"""
+        with self._lock:
+            lookups = self._hits + self._misses + self._coalesced
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "ttl_seconds": self.ttl_seconds,
+                "inflight": len(self._inflight),
+                "hits": self._hits,
+                "misses": self._misses,
+                "coalesced": self._coalesced,
+                "evictions": self._evictions,
+                "hit_rate": (self._hits + self._coalesced) / lookups if lookups else 0.0,
+                "saved_latency_seconds": round(self._saved_seconds, 3),
+            }
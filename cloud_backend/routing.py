@@ -0,0 +1,308 @@
+"""
+Request Routing
+リクエストごとの実行方法（Google検索グラウンディングの有無・使用モデル）を決める
+
+- SearchRouter: 質問内容・クライアントのヒントから検索ツールを付けるかを判定
+- ModelRouter: 質問の複雑さ・画像枚数・レイテンシ予算・モデルごとの実測値からモデルを選択
+"""
+
+import os
+import re
+import threading
+import time
+import unicodedata
+from collections import deque
+
+SEARCH_MODES = ("auto", "on", "off")
+
+# 画面を見れば答えられる質問（位置・操作・画面内容）の手がかり
+SCREEN_KEYWORDS = [
+    "どこ", "ボタン", "クリック", "押", "タップ", "この画面", "画面", "表示", "メニュー", "アイコン",
+    "タブ", "開き", "閉じ", "選択", "入力", "欄", "リンク", "スクロール", "要約", "内容", "書いて",
+    "読んで", "ここ", "これ",
+]
+
+# 画面外の最新情報・一般知識が必要そうな質問の手がかり
+KNOWLEDGE_KEYWORDS = [
+    "最新", "ニュース", "意味", "とは", "なぜ", "理由", "原因", "調べ", "検索", "価格", "値段", "料金",
+    "天気", "いつ", "比較", "おすすめ", "評判", "公式", "バージョン", "リリース", "対処", "エラー",
+    "違い", "歴史",
+]
+
+_YEAR_PATTERN = re.compile(r"(19|20)\d{2}\s*年?")
+
+
+def _keyword_score(text, keywords):
+    return sum(1 for k in keywords if k in text)
+
+
+class SearchRouter:
+    """
+    検索ツールを付けるかをリクエストごとに判定し、付けた場合/付けなかった場合のレイテンシを集計する
+
+    モード:
+        on: 常に検索を付ける（従来の動作）
+        off: 検索を付けない
+        auto: 質問の分類器で判定し、付けない場合でもモデルが必要と判断したら検索付きで再実行する
+    """
+
+    def __init__(self, default_mode=None):
+        if default_mode is None:
+            default_mode = os.environ.get("GEMINI_SEARCH_MODE", "auto")
+        if default_mode not in SEARCH_MODES:
+            raise ValueError(f"GEMINI_SEARCH_MODE must be one of {SEARCH_MODES}: {default_mode}")
+        self.default_mode = default_mode
+
+        self._lock = threading.Lock()
+        self._stats = {
+            True: {"requests": 0, "latency_seconds": 0.0},
+            False: {"requests": 0, "latency_seconds": 0.0},
+        }
+        self._escalations = 0
+
+    def classify(self, question):
+        """
+        質問が検索を必要としそうか分類する
+
+        Returns:
+            tuple: (検索を付けるか, 理由)
+        """
+        text = unicodedata.normalize("NFKC", question or "").lower()
+        knowledge = _keyword_score(text, KNOWLEDGE_KEYWORDS)
+        if _YEAR_PATTERN.search(text):
+            knowledge += 1
+        screen = _keyword_score(text, SCREEN_KEYWORDS)
+        if knowledge > 0 and knowledge >= screen:
+            return True, f"classifier(knowledge={knowledge},screen={screen})"
+        return False, f"classifier(knowledge={knowledge},screen={screen})"
+
+    def decide(self, question, hint=None):
+        """
+        検索を付けるかを決める
+
+        Args:
+            question: ユーザーの質問
+            hint: クライアントからのヒント（"auto" / "on" / "off"、None ならサーバーの既定値）
+
+        Returns:
+            dict: {"use_search", "allow_escalation", "reason"}
+        """
+        mode = hint if hint in SEARCH_MODES else self.default_mode
+        if mode == "on":
+            return {"use_search": True, "allow_escalation": False, "reason": "mode=on"}
+        if mode == "off":
+            return {"use_search": False, "allow_escalation": False, "reason": "mode=off"}
+        use_search, reason = self.classify(question)
+        # 検索なしで答えさせた場合は、モデルが必要と判断したときだけ検索付きで再実行する
+        return {"use_search": use_search, "allow_escalation": not use_search, "reason": reason}
+
+    def record(self, search_attached, latency_seconds, escalated=False):
+        """リクエストの結果を集計（検索あり/なしで別々に集計する）"""
+        with self._lock:
+            bucket = self._stats[bool(search_attached)]
+            bucket["requests"] += 1
+            bucket["latency_seconds"] += latency_seconds
+            if escalated:
+                self._escalations += 1
+
+    def stats(self):
+        with self._lock:
+            with_search = self._stats[True]
+            without_search = self._stats[False]
+            total = with_search["requests"] + without_search["requests"]
+
+            def mean_ms(bucket):
+                if not bucket["requests"]:
+                    return 0.0
+                return round(bucket["latency_seconds"] / bucket["requests"] * 1000, 1)
+
+            return {
+                "default_mode": self.default_mode,
+                "requests": total,
+                "search_attached_rate": with_search["requests"] / total if total else 0.0,
+                "escalations": self._escalations,
+                "with_search": {"requests": with_search["requests"], "mean_latency_ms": mean_ms(with_search)},
+                "without_search": {"requests": without_search["requests"], "mean_latency_ms": mean_ms(without_search)},
+            }
+
+
+AUTO_MODEL = "auto"
+
+# 自動選択の候補モデル（quality: 回答品質の序列、prior_latency_ms: 実測値が揃うまでの想定レイテンシ）
+MODEL_PROFILES = {
+    "gemini-2.0-flash": {"quality": 1, "prior_latency_ms": 2500},
+    "gemini-2.5-flash": {"quality": 2, "prior_latency_ms": 4000},
+    "gemini-3-flash-preview": {"quality": 3, "prior_latency_ms": 5000},
+    "gemini-3-pro-preview": {"quality": 4, "prior_latency_ms": 12000},
+}
+
+# 画面上の位置を聞くだけの軽い質問の手がかり
+SIMPLE_KEYWORDS = ["どこ", "ボタン", "押", "クリック", "アイコン", "メニュー", "場所", "開き"]
+
+# 読解・推論が必要な重い質問の手がかり
+COMPLEX_KEYWORDS = [
+    "要約", "まとめ", "比較", "なぜ", "理由", "原因", "手順", "詳しく", "説明", "分析", "コード", "エラー",
+    "解説", "違い", "翻訳", "全体",
+]
+
+
+class ModelRouter:
+    """
+    質問の特徴・画像枚数・モデルごとの直近のレイテンシ/エラー率からモデルを選ぶ
+
+    - model="auto": 質問の複雑さに見合う最も軽いモデルを選ぶ（レイテンシ予算内で）
+    - モデル指定 + レイテンシ予算: 指定モデルが予算を超えそうな場合のみ、予算内のモデルに切り替える
+    """
+
+    def __init__(self, window=None, min_samples=5, max_error_rate=0.5, error_cooldown_seconds=60.0,
+                 default_budget_ms=None):
+        """
+        Args:
+            window: モデルごとに保持する直近の実行結果の数
+            min_samples: 実測値を使い始めるサンプル数（それまでは prior_latency_ms を使う）
+            max_error_rate: これを超えたモデルは自動選択の候補から外す
+            error_cooldown_seconds: エラー率の判定に使う期間（これより古い失敗は候補からの除外に使わない）
+            default_budget_ms: リクエストで予算が指定されない場合の既定のレイテンシ予算
+        """
+        if window is None:
+            window = int(os.environ.get("MODEL_ROUTER_WINDOW", "50"))
+        if default_budget_ms is None:
+            default_budget_ms = int(os.environ.get("MODEL_ROUTER_DEFAULT_BUDGET_MS", "0"))
+        self.window = window
+        self.min_samples = min_samples
+        self.max_error_rate = max_error_rate
+        self.error_cooldown_seconds = error_cooldown_seconds
+        self.default_budget_ms = default_budget_ms or None
+
+        self._lock = threading.Lock()
+        # model -> deque[(記録時刻, latency_seconds, success)]
+        self._history = {model: deque(maxlen=window) for model in MODEL_PROFILES}
+        self._routed = {}
+
+    def complexity(self, question, image_count):
+        """
+        質問の複雑さを 1（位置を聞くだけ）〜 4（長文の読解・推論）で推定する
+
+        Returns:
+            tuple: (必要な品質の序列, 特徴量)
+        """
+        text = unicodedata.normalize("NFKC", question or "").lower()
+        simple = _keyword_score(text, SIMPLE_KEYWORDS)
+        complex_ = _keyword_score(text, COMPLEX_KEYWORDS)
+        features = {"simple": simple, "complex": complex_, "length": len(text), "images": image_count}
+
+        level = 2
+        if simple > 0 and complex_ == 0 and len(text) <= 40:
+            level = 1
+        if complex_ > 0:
+            level = 3
+        # スクロールキャプチャ（複数枚）の要約・長い質問は読解量が多い
+        if complex_ > 0 and (image_count > 1 or len(text) > 120):
+            level = 4
+        return level, features
+
+    def _model_stats_locked(self, model, since=None):
+        samples = [s for s in self._history[model] if since is None or s[0] >= since]
+        if not samples:
+            return None, 0.0, 0
+        latencies = sorted(latency for _, latency, success in samples if success)
+        errors = sum(1 for _, _, success in samples if not success)
+        p75 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.75))] if latencies else None
+        return p75, errors / len(samples), len(samples)
+
+    def estimate_latency_ms(self, model, image_count=1):
+        """直近の実測（p75）または想定値から、画像枚数を考慮したレイテンシを見積もる"""
+        with self._lock:
+            p75, _, count = self._model_stats_locked(model)
+        if p75 is not None and count >= self.min_samples:
+            base = p75 * 1000
+        else:
+            base = MODEL_PROFILES[model]["prior_latency_ms"]
+        return base * (1 + 0.25 * max(0, image_count - 1))
+
+    def _healthy(self, model):
+        # 一定時間が経てば失敗の記録は判定から外れ、候補に戻る
+        since = time.monotonic() - self.error_cooldown_seconds
+        with self._lock:
+            _, error_rate, count = self._model_stats_locked(model, since)
+        return count < self.min_samples or error_rate <= self.max_error_rate
+
+    def route(self, question, image_count, requested_model=None, latency_budget_ms=None):
+        """
+        使用するモデルを決める
+
+        Args:
+            question: ユーザーの質問
+            image_count: 画像の枚数
+            requested_model: クライアントが指定したモデル（None / "auto" なら自動選択）
+            latency_budget_ms: レイテンシ予算（ミリ秒）
+
+        Returns:
+            dict: {"model", "reason", "complexity", "estimated_latency_ms"}
+                  model が None の場合はサーバーの既定モデルを使う
+        """
+        budget = latency_budget_ms or self.default_budget_ms
+        auto = requested_model in (None, "", AUTO_MODEL)
+
+        if not auto and (budget is None or requested_model not in MODEL_PROFILES):
+            return {"model": requested_model, "reason": "requested", "complexity": None, "estimated_latency_ms": None}
+        if requested_model in (None, "") and budget is None:
+            # モデルも予算も指定がなければ従来どおり既定モデルを使う
+            return {"model": None, "reason": "default", "complexity": None, "estimated_latency_ms": None}
+
+        level, features = self.complexity(question, image_count)
+        estimates = {model: self.estimate_latency_ms(model, image_count) for model in MODEL_PROFILES}
+
+        if not auto:
+            if estimates[requested_model] <= budget:
+                return self._decision(requested_model, "requested", features, estimates)
+            # 指定モデルでは予算に収まらない: 同等以下の品質で予算内のモデルに切り替える
+            level = MODEL_PROFILES[requested_model]["quality"]
+
+        candidates = [m for m in MODEL_PROFILES if self._healthy(m)] or list(MODEL_PROFILES)
+        within_budget = [m for m in candidates if budget is None or estimates[m] <= budget]
+
+        sufficient = [m for m in within_budget if MODEL_PROFILES[m]["quality"] >= level]
+        if sufficient:
+            # 複雑さに見合う最も軽いモデル
+            model = min(sufficient, key=lambda m: MODEL_PROFILES[m]["quality"])
+            reason = f"complexity={level}"
+        elif within_budget:
+            # 予算内では品質が足りない: 予算内で最も品質の高いモデル
+            model = max(within_budget, key=lambda m: MODEL_PROFILES[m]["quality"])
+            reason = f"complexity={level},budget_limited"
+        else:
+            # どのモデルも予算に収まらない: 最速のモデル
+            model = min(candidates, key=lambda m: estimates[m])
+            reason = f"complexity={level},over_budget"
+        return self._decision(model, reason, features, estimates, level)
+
+    def _decision(self, model, reason, features, estimates, level=None):
+        with self._lock:
+            self._routed[model] = self._routed.get(model, 0) + 1
+        return {
+            "model": model,
+            "reason": reason,
+            "complexity": {"level": level, **features},
+            "estimated_latency_ms": round(estimates[model]),
+        }
+
+    def record(self, model, latency_seconds, success):
+        """Gemini 呼び出しの結果（レイテンシ・成否）を記録"""
+        if model not in self._history:
+            return
+        with self._lock:
+            self._history[model].append((time.monotonic(), latency_seconds, bool(success)))
+
+    def stats(self):
+        result = {}
+        with self._lock:
+            for model in MODEL_PROFILES:
+                p75, error_rate, count = self._model_stats_locked(model)
+                result[model] = {
+                    "samples": count,
+                    "p75_latency_ms": round(p75 * 1000, 1) if p75 is not None else None,
+                    "error_rate": round(error_rate, 3),
+                    "routed": self._routed.get(model, 0),
+                }
+        return {"default_budget_ms": self.default_budget_ms, "models": result}
@@ -0,0 +1,220 @@
+"""
+Session Store
+会話セッション（アップロード済み画像と会話ターン）をサーバー側で保持する
+
+フォローアップの質問ではクライアントが画像や履歴を再送しなくて済むようにする。
+メモリ使用量はセッション数・合計バイト数の上限とTTLで制限する（LRUで追い出し）。
+期限切れのセッションは、作成・取得のついでに一定間隔でまとめて破棄する。
+"""
+
+import hashlib
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+# 期限切れのセッションをまとめて破棄する最短間隔（秒）
+PURGE_INTERVAL_SECONDS = 60
+
+
+class SessionTooLarge(Exception):
+    """1セッションの画像が全体のバイト数の上限を超えている"""
+
+    def __init__(self, size, max_bytes):
+        super().__init__(f"Session images too large: {size} bytes (max {max_bytes})")
+        self.size = size
+        self.max_bytes = max_bytes
+
+
+class Session:
+    """1ユーザー分の会話セッション"""
+
+    def __init__(self, session_id, max_turns):
+        self.session_id = session_id
+        self.max_turns = max_turns
+        self.created_at = time.time()
+        self.last_access = time.monotonic()
+        self.image_blobs = []
+        self.images_digest = None
+        self.turns = []
+        # 同一セッション内の解析は順番に処理する（ターンの順序を保つため）
+        self.lock = threading.Lock()
+
+    @property
+    def image_bytes(self):
+        return sum(len(blob) for blob in self.image_blobs)
+
+    def set_images(self, image_blobs):
+        """画像を差し替える（画面が変わった場合など）"""
+        self.image_blobs = list(image_blobs)
+        digest = hashlib.sha256()
+        for blob in self.image_blobs:
+            digest.update(hashlib.sha256(blob).digest())
+        self.images_digest = digest.hexdigest()
+
+    def add_turn(self, role, text):
+        """会話ターンを追加（古いターンは上限を超えた分だけ捨てる）"""
+        self.turns.append({"role": role, "text": text})
+        if len(self.turns) > self.max_turns:
+            del self.turns[:len(self.turns) - self.max_turns]
+
+
+class SessionStore:
+    """
+    セッションの作成・取得・期限切れ管理を行うスレッドセーフなストア
+    """
+
+    def __init__(self, max_sessions=None, ttl_seconds=None, max_bytes=None, max_turns=None):
+        """
+        Args:
+            max_sessions: 同時に保持する最大セッション数
+            ttl_seconds: 最終アクセスからの有効期限（秒）
+            max_bytes: 全セッションの画像合計バイト数の上限
+            max_turns: 1セッションで保持する会話ターン数の上限
+        """
+        if max_sessions is None:
+            max_sessions = int(os.environ.get("SESSION_MAX_SESSIONS", "200"))
+        if ttl_seconds is None:
+            ttl_seconds = float(os.environ.get("SESSION_TTL", "1800"))
+        if max_bytes is None:
+            max_bytes = int(os.environ.get("SESSION_MAX_BYTES", str(256 * 1024 * 1024)))
+        if max_turns is None:
+            max_turns = int(os.environ.get("SESSION_MAX_TURNS", "20"))
+
+        self.max_sessions = max_sessions
+        self.ttl_seconds = ttl_seconds
+        self.max_bytes = max_bytes
+        self.max_turns = max_turns
+
+        self._lock = threading.Lock()
+        self._sessions = OrderedDict()
+        self._evict_callbacks = []
+        self._created = 0
+        self._expired = 0
+        self._evicted = 0
+        self._last_purge = time.monotonic()
+
+    def add_evict_callback(self, callback):
+        """セッション破棄時に呼ばれるコールバックを登録（callback(session)）"""
+        self._evict_callbacks.append(callback)
+
+    def create(self, image_blobs=None):
+        """
+        新しいセッションを作成して返す
+
+        Raises:
+            SessionTooLarge: 画像だけで全体の上限を超える場合（他のセッションを追い出す前に断る）
+        """
+        self._check_size(image_blobs)
+        self._maybe_purge()
+        session = Session(uuid.uuid4().hex, self.max_turns)
+        if image_blobs:
+            session.set_images(image_blobs)
+        with self._lock:
+            self._sessions[session.session_id] = session
+            self._created += 1
+            removed = self._enforce_limits_locked(keep=session.session_id)
+        self._notify_removed(removed)
+        return session
+
+    def get(self, session_id):
+        """セッションを取得（期限切れ・存在しない場合は None）"""
+        self._maybe_purge()
+        removed = []
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if session is not None:
+                if time.monotonic() - session.last_access > self.ttl_seconds:
+                    del self._sessions[session_id]
+                    self._expired += 1
+                    removed.append(session)
+                    session = None
+                else:
+                    session.last_access = time.monotonic()
+                    self._sessions.move_to_end(session_id)
+        self._notify_removed(removed)
+        return session
+
+    def update_images(self, session, image_blobs):
+        """
+        セッションの画像を差し替え、メモリ上限を再確認する
+
+        Raises:
+            SessionTooLarge: 画像だけで全体の上限を超える場合（画像は差し替えない）
+        """
+        self._check_size(image_blobs)
+        session.set_images(image_blobs)
+        with self._lock:
+            removed = self._enforce_limits_locked(keep=session.session_id)
+        self._notify_removed(removed)
+
+    def delete(self, session_id):
+        """セッションを明示的に削除"""
+        with self._lock:
+            session = self._sessions.pop(session_id, None)
+        if session is not None:
+            self._notify_removed([session])
+        return session is not None
+
+    def _check_size(self, image_blobs):
+        size = sum(len(blob) for blob in image_blobs or [])
+        if size > self.max_bytes:
+            raise SessionTooLarge(size, self.max_bytes)
+
+    def _maybe_purge(self):
+        """前回から PURGE_INTERVAL_SECONDS 以上経っていれば期限切れセッションを破棄する"""
+        with self._lock:
+            if time.monotonic() - self._last_purge < PURGE_INTERVAL_SECONDS:
+                return
+        self.purge_expired()
+
+    def purge_expired(self):
+        """期限切れセッションを削除"""
+        now = time.monotonic()
+        with self._lock:
+            self._last_purge = now
+            expired = [s for s in self._sessions.values() if now - s.last_access > self.ttl_seconds]
+            for s in expired:
+                del self._sessions[s.session_id]
+            self._expired += len(expired)
+        self._notify_removed(expired)
+        return len(expired)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "sessions": len(self._sessions),
+                "max_sessions": self.max_sessions,
+                "image_bytes": sum(s.image_bytes for s in self._sessions.values()),
+                "max_bytes": self.max_bytes,
+                "created": self._created,
+                "expired": self._expired,
+                "evicted": self._evicted,
+            }
+
+    def _enforce_limits_locked(self, keep=None):
+        """セッション数・合計バイト数の上限を超えた分をLRU順に追い出す（ロック保持中に呼ぶ）"""
+        removed = []
+        total_bytes = sum(s.image_bytes for s in self._sessions.values())
+        while self._sessions and (len(self._sessions) > self.max_sessions or total_bytes > self.max_bytes):
+            oldest_id = next(iter(self._sessions))
+            if oldest_id == keep:
+                # 更新中のセッション自体は追い出さない
+                if len(self._sessions) == 1:
+                    break
+                self._sessions.move_to_end(oldest_id)
+                continue
+            session = self._sessions.pop(oldest_id)
+            total_bytes -= session.image_bytes
+            self._evicted += 1
+            removed.append(session)
+        return removed
+
+    def _notify_removed(self, sessions):
+        for session in sessions:
+            for callback in self._evict_callbacks:
+                try:
+                    callback(session)
+                except Exception as e:
+                    print(f"Session evict callback error: {e}")
@@ -0,0 +1,38 @@
+"""
+AIModule の回答の検査のテスト
+
+出力トークンの上限で打ち切られた回答や空の回答を、成功として返さないこと
+"""
+
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+types = pytest.importorskip("google.genai.types")
+
+from ai_logic import IncompleteResponse, check_complete  # noqa: E402
+
+
+def _response(text, finish_reason):
+    parts = [types.Part(text=text)] if text is not None else []
+    return types.GenerateContentResponse(candidates=[types.Candidate(
+        content=types.Content(role="model", parts=parts),
+        finish_reason=finish_reason,
+    )])
+
+
+def test_complete_response_passes():
+    check_complete(_response('{"answer": "abc"}', types.FinishReason.STOP))
+
+
+def test_truncated_response_is_rejected():
+    with pytest.raises(IncompleteResponse):
+        check_complete(_response('{"answer": "abc', types.FinishReason.MAX_TOKENS))
+
+
+def test_empty_response_is_rejected():
+    with pytest.raises(IncompleteResponse):
+        check_complete(_response(None, types.FinishReason.STOP))
@@ -0,0 +1,139 @@
+"""
+AnalysisCache の single-flight の回帰テスト
+
+先行リクエストが取り消された・断られた場合に、その結果が合流した後続リクエストに共有されないこと
+"""
+
+import io
+import os
+import sys
+import threading
+import time
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from result_cache import AnalysisCache  # noqa: E402
+
+
+class Rejected(Exception):
+    pass
+
+
+def _run_concurrently(leader, follower, delay=0.05):
+    """leader を開始し、合流するように少し遅れて follower を開始する"""
+    outcomes = {}
+
+    def run(name, func):
+        try:
+            outcomes[name] = func()
+        except Exception as e:
+            outcomes[name] = e
+
+    threads = [threading.Thread(target=run, args=("leader", leader))]
+    threads[0].start()
+    time.sleep(delay)
+    threads.append(threading.Thread(target=run, args=("follower", follower)))
+    threads[1].start()
+    for thread in threads:
+        thread.join(5)
+    return outcomes
+
+
+def test_follower_recomputes_when_leader_cancelled():
+    cache = AnalysisCache(max_entries=8, ttl_seconds=60)
+
+    def cancelled_leader():
+        time.sleep(0.2)
+        return {"success": False, "cancelled": True, "error": "Cancelled: deadline exceeded"}
+
+    outcomes = _run_concurrently(
+        lambda: cache.get_or_compute("k", cancelled_leader),
+        lambda: cache.get_or_compute("k", lambda: {"success": True, "answer": "ok"}))
+
+    assert outcomes["leader"][0]["cancelled"]
+    result, status = outcomes["follower"]
+    assert result == {"success": True, "answer": "ok"}
+    assert status == "miss"
+
+
+def test_follower_recomputes_when_leader_rejected():
+    cache = AnalysisCache(max_entries=8, ttl_seconds=60)
+
+    def rejected_leader():
+        time.sleep(0.2)
+        raise Rejected("queue full")
+
+    outcomes = _run_concurrently(
+        lambda: cache.get_or_compute("k", rejected_leader, private_errors=(Rejected,)),
+        lambda: cache.get_or_compute("k", lambda: {"success": True, "answer": "ok"}, private_errors=(Rejected,)))
+
+    assert isinstance(outcomes["leader"], Rejected)
+    assert outcomes["follower"] == ({"success": True, "answer": "ok"}, "miss")
+
+
+def test_follower_shares_leader_failure():
+    """上流のエラーなど、リクエストに依らない結果はこれまで通り共有する"""
+    cache = AnalysisCache(max_entries=8, ttl_seconds=60)
+    calls = []
+
+    def failing():
+        calls.append(1)
+        time.sleep(0.2)
+        raise RuntimeError("upstream 500")
+
+    outcomes = _run_concurrently(
+        lambda: cache.get_or_compute("k", failing, private_errors=(Rejected,)),
+        lambda: cache.get_or_compute("k", failing, private_errors=(Rejected,)))
+
+    assert isinstance(outcomes["leader"], RuntimeError)
+    assert isinstance(outcomes["follower"], RuntimeError)
+    assert len(calls) == 1
+
+
+@pytest.fixture
+def app(monkeypatch):
+    pytest.importorskip("flask")
+    pytest.importorskip("google.genai")
+    monkeypatch.setenv("SENP_AI_FAKE_GEMINI", "1")
+    monkeypatch.setenv("FAKE_GEMINI_LATENCY", "fixed")
+    monkeypatch.setenv("FAKE_GEMINI_LATENCY_MS", "2500")
+    monkeypatch.setenv("FAKE_GEMINI_ERROR_RATES", "")
+    # 受付制御の見積もりで期限付きの先行リクエストが断られないようにする（取り消しの経路を通す）
+    monkeypatch.setenv("ADMISSION_INITIAL_SERVICE_SECONDS", "0.1")
+    import main
+    return main.app
+
+
+def _png():
+    from PIL import Image
+    buffer = io.BytesIO()
+    Image.new("RGB", (64, 48), (200, 30, 30)).save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+def test_analyze_follower_without_deadline_is_not_cancelled_with_leader(app):
+    """期限付きの先行リクエストが 504 になっても、期限なしで合流したリクエストは回答を受け取る"""
+    image = _png()
+
+    def post(headers):
+        client = app.test_client()
+        response = client.post("/analyze", headers=headers, content_type="multipart/form-data", data={
+            "question": "設定ボタンはどこですか？（合流テスト）",
+            "model": "gemini-2.5-flash",
+            "images": [(io.BytesIO(image), "screen.png")],
+        })
+        return response.status_code, response.headers.get("X-Cache"), response.get_json()
+
+    outcomes = _run_concurrently(
+        lambda: post({"X-Request-Timeout-Ms": "600"}),
+        lambda: post({}),
+        delay=0.1)
+
+    leader_status, _, _ = outcomes["leader"]
+    follower_status, follower_cache, follower_body = outcomes["follower"]
+    assert leader_status == 504
+    assert follower_status == 200
+    assert follower_body["success"]
+    assert follower_cache != "COALESCED"
@@ -0,0 +1,78 @@
+"""
+会話セッションのテスト
+
+クライアントがローカルで答えたやり取り（turns）が、次の質問より前のターンとしてセッションに記録されること
+"""
+
+import io
+import json
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture
+def main_module(monkeypatch):
+    pytest.importorskip("flask")
+    pytest.importorskip("google.genai")
+    monkeypatch.setenv("SENP_AI_FAKE_GEMINI", "1")
+    monkeypatch.setenv("FAKE_GEMINI_LATENCY", "fixed")
+    monkeypatch.setenv("FAKE_GEMINI_LATENCY_MS", "50")
+    monkeypatch.setenv("FAKE_GEMINI_ERROR_RATES", "")
+    import main
+    return main
+
+
+def _png():
+    from PIL import Image
+    buffer = io.BytesIO()
+    Image.new("RGB", (64, 48), (30, 30, 200)).save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+def _create_session(client):
+    response = client.post("/sessions", content_type="multipart/form-data", data={
+        "images": [(io.BytesIO(_png()), "screen.png")],
+    })
+    assert response.status_code == 200
+    return response.get_json()["session_id"]
+
+
+def test_local_turns_are_recorded_before_question(main_module):
+    client = main_module.app.test_client()
+    session_id = _create_session(client)
+    local_turns = [
+        {"role": "user", "text": "「保存」はどこ？"},
+        {"role": "assistant", "text": "「保存」は画面上の赤い枠で囲んだ位置にあります。"},
+    ]
+
+    response = client.post("/analyze", content_type="multipart/form-data", data={
+        "question": "それを押すとどうなりますか？",
+        "model": "gemini-2.5-flash",
+        "session_id": session_id,
+        "turns": json.dumps(local_turns, ensure_ascii=False),
+    })
+
+    assert response.status_code == 200
+    assert response.get_json()["turns_recorded"] == 2
+    turns = main_module.session_store.get(session_id).turns
+    assert turns[:2] == local_turns
+    assert turns[2] == {"role": "user", "text": "それを押すとどうなりますか？"}
+    assert turns[3]["role"] == "assistant"
+
+
+def test_invalid_local_turns_are_rejected(main_module):
+    client = main_module.app.test_client()
+    session_id = _create_session(client)
+
+    response = client.post("/analyze", content_type="multipart/form-data", data={
+        "question": "設定はどこ？",
+        "session_id": session_id,
+        "turns": json.dumps([{"role": "system", "text": "x"}]),
+    })
+
+    assert response.status_code == 400
+    assert main_module.session_store.get(session_id).turns == []
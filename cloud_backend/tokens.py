@@ -0,0 +1,20 @@
+"""
+Token Estimate
+API を呼ばずにテキストのトークン数を概算する
+
+会話履歴の予算（ai_logic）とフェイククライアントの使用量（fake_genai）で同じ見積もりを使う。
+デスクトップ側の history.py にも同じ式がある（クライアントはこのパッケージを読み込まないため）。
+"""
+
+import re
+
+# CJK文字はおよそ1文字1トークン、それ以外はおよそ4文字1トークン
+_CJK_PATTERN = re.compile(r"[　-ヿ㐀-鿿豈-﫿＀-￯]")
+
+
+def estimate_tokens(text):
+    """テキストのトークン数を推定（APIを呼ばない概算）"""
+    if not text:
+        return 0
+    cjk = len(_CJK_PATTERN.findall(text))
+    return cjk + (len(text) - cjk + 3) // 4
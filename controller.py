@@ -10,12 +10,24 @@ from ui import SENPAI_UI
 from ai_client import RemoteAIModule # Cloud Run support
 from speech import SpeechModule
 from tts import TTSModule
-from PIL import ImageGrab
+from history import ConversationHistory
+from target_tracker import TargetTracker
+from box_refine import refine_box
+from ocr_index import OCRIndexCache, extract_location_target, screen_fingerprint
+from PIL import Image, ImageGrab
+
+# 要素の輪郭に合わせた補正を採用する確からしさの下限（下回る場合はモデルの矩形に余白を付けて使う）
+REFINE_MIN_CONFIDENCE = 0.5
+# OCR の索引だけで場所の質問に答える一致度の下限と、一度に強調表示する候補数の上限（超えたら特定できないとみなす）
+LOCAL_MATCH_MIN_SCORE = 0.8
+LOCAL_MATCH_MAX_RESULTS = 3
+# 撮影時に作り始めた OCR 索引ができあがるのを、場所の質問で待つ最長の秒数（超えたらモデルに任せる）
+LOCAL_INDEX_WAIT_SECONDS = 1.5
 
 class SENPAI_Controller:
     def __init__(self):
         """コントローラーの初期化"""
-        self.chat_history = [] # 会話履歴を保持
+        self.chat_history = ConversationHistory() # 会話履歴を保持（トークン予算内でプロンプトに載せる）
         
         # AIモジュール初期化 (Cloud Run版をデフォルトで使用)
         backend_url = os.environ.get("SENP_AI_BACKEND_URL")
@@ -26,6 +38,10 @@ class SENPAI_Controller:
         
         self.ai_module = RemoteAIModule(backend_url)
         
+        # バックエンドの会話セッション（フォローアップで画像・履歴を再送しない）
+        self.use_backend_session = True
+        self.session_screen_signature = None # セッションにアップロード済みの画面
+        
         # 音声認識モジュールの初期化（コールバックを指定）
         self.speech_module = SpeechModule(callback=self.on_speech_recognized)
         self.tts_module = TTSModule()
@@ -36,12 +52,20 @@ class SENPAI_Controller:
             on_question_callback=self.process_question,
             on_voice_input_callback=self.handle_voice_input,
             on_tts_toggle_callback=self.toggle_tts,
-            on_model_change_callback=self.change_model
+            on_model_change_callback=self.change_model,
+            available_latency_modes=RemoteAIModule.get_available_latency_modes(),
+            on_latency_mode_change_callback=self.change_latency_mode
         )
         
         self.current_screenshot = None
         self.tts_enabled = False
         
+        # 強調表示した対象の追跡（スクロールやウィンドウの移動にガイドを追従させる）
+        self.target_tracker = None
+        
+        # 画面ごとの OCR 索引（場所を尋ねるだけの質問にモデルを呼ばずに答える）
+        self.ocr_cache = OCRIndexCache()
+        
         # ナビゲーション（追従モード）用変数
         self.is_navigating = False
         self.last_screen_array = None
@@ -56,8 +80,11 @@ class SENPAI_Controller:
         """現在時刻のタイムスタンプを取得"""
         return datetime.now().strftime("%H:%M:%S")
     
-    def take_screenshot(self, return_path=False):
-        """スクリーンショットを撮影"""
+    def take_screenshot(self, return_path=False, index=False):
+        """
+        スクリーンショットを撮影
+        index=True なら OCR 索引をすぐに作り始める（場所の質問で索引を引く、今の画面の撮影だけに使う）
+        """
         try:
             # スクリーンショット撮影
             screenshot = ImageGrab.grab()
@@ -72,6 +99,10 @@ class SENPAI_Controller:
             
             self.screen_size = screenshot.size # (width, height)
             
+            if index:
+                # 場所の質問に、同じ画面への最初の質問から答えられるように
+                self._index_screen(screenshot)
+            
             if return_path:
                 return screenshot_path
 
@@ -85,14 +116,20 @@ class SENPAI_Controller:
             if return_path:
                 return None
 
-    def process_question(self, question):
-        """質問を処理してAI回答を取得（自動スクロール判定含む）"""
+    def process_question(self, question, priority="interactive"):
+        """
+        質問を処理してAI回答を取得（自動スクロール判定含む）
+        priority: バックエンドでの処理優先度（ユーザーの質問は "interactive"、自動ナビゲーションは "navigation"）
+        """
         try:
+            # 新しい質問では画面が変わるので、前の回答のガイドの追跡は止める
+            self._stop_tracking()
+            
             # ユーザーメッセージを表示
             self.ui.add_message("user", question, self._get_timestamp())
             
             # 履歴に追加
-            self.chat_history.append({"role": "user", "text": question})
+            self.chat_history.append("user", question)
             
             # UIを一時的に非表示にしてスクリーンショットを撮影
             self.ui.hide_window()
@@ -134,7 +171,8 @@ class SENPAI_Controller:
                     self.current_screenshot = screenshots # 履歴用
                     
                 else:
-                    self.take_screenshot()
+                    # 索引を引くのはユーザーの質問の今の画面だけ（スクロールの2・3枚目やナビゲーションは OCR しない）
+                    self.take_screenshot(index=priority == "interactive")
                     screenshot_data = self.current_screenshot
                     
             finally:
@@ -145,7 +183,13 @@ class SENPAI_Controller:
                 self.ui.set_status("スクリーンショット撮影失敗", "red")
                 return
 
-            self._analyze_with_ai(question, screenshot_data)
+            # 「X はどこ？」のような質問は、画面の OCR 索引で見つかればモデルを呼ばずに答える
+            first_screenshot = screenshot_data[0] if isinstance(screenshot_data, list) else screenshot_data
+            allow_local = priority == "interactive" and not should_scroll
+            if self._answer_location_locally(question, first_screenshot, allow_local):
+                return
+
+            self._analyze_with_ai(question, screenshot_data, priority)
         
         except Exception as e:
             error_msg = f"処理エラー: {str(e)}"
@@ -153,42 +197,41 @@ class SENPAI_Controller:
             self.ui.add_message("assistant", error_msg, self._get_timestamp())
             self.ui.set_status(error_msg, "red")
 
-    def _analyze_with_ai(self, question, screenshot_data):
+    def _analyze_with_ai(self, question, screenshot_data, priority="interactive"):
         """AI分析の共通処理"""
         # AI分析
         self.ui.set_status(f"AI分析中... (モデル: {self.ai_module.get_model()})", "blue")
         
-        # 履歴を含むプロンプトの構築
-        context_prompt = ""
-        # 履歴が存在する場合、直近の履歴を追加する（今回の質問はすでに履歴に入っているが、プロンプトには含めず最後の質問として扱う）
-        # chat_history[-1] は今回の質問なので、除外して過去分だけコンテキストにする
-        if len(self.chat_history) > 1:
-            recent_history = self.chat_history[-6:-1] # 今回の質問を除いた直近5件
-            history_text = ""
-            for msg in recent_history:
-                role_name = "User" if msg['role'] == "user" else "AI"
-                history_text += f"{role_name}: {msg['text']}\n"
-            
-            if history_text:
-                context_prompt = f"これまでの会話履歴:\n{history_text}\n\n"
-        
         # 質問が空の場合はデフォルトのプロンプトを設定
         actual_question = question if question else "画面全体の内容を要約して、何ができるページか教えてください。"
         
-        final_prompt = f"{context_prompt}{actual_question}"
+        result = None
+        if self.use_backend_session:
+            # 会話履歴はバックエンドのセッションが保持するので、質問だけを送る
+            result = self._analyze_in_session(actual_question, screenshot_data, priority)
+        
+        if result is None:
+            # セッションが使えない場合は従来通り、履歴をプロンプトに含めて毎回画像を送信する
+            # 今回の質問はすでに履歴に入っているので除外し、過去分を予算内で（古い分は要約して）コンテキストにする
+            context_prompt = self.chat_history.build_context(skip_last=1)
+            
+            final_prompt = f"{context_prompt}{actual_question}"
 
-        result = self.ai_module.analyze_screen(
-            screenshot_path=screenshot_data,
-            user_question=final_prompt
-        )
+            result = self.ai_module.analyze_screen(
+                screenshot_path=screenshot_data,
+                user_question=final_prompt,
+                priority=priority
+            )
         
         if result["success"]:
+            # 回答を受け取った時刻（ここからガイドが表示されるまでの時間を UI が記録する）
+            answer_at = time.perf_counter()
             answer = result["answer"]
-            # ユーザーが選択しているモデル名を優先表示する（バックエンドの内部名は無視）
-            model_used = self.ai_module.get_model() 
+            # 実際に回答したモデルを表示する（自動選択・フォールバックで選択中のモデルと異なる場合がある）
+            model_used = result.get("model") or self.ai_module.get_model()
             
             # 履歴に追加
-            self.chat_history.append({"role": "assistant", "text": answer})
+            self.chat_history.append("assistant", answer)
             
             self.ui.add_message("assistant", answer, self._get_timestamp(), model=model_used)
             
@@ -196,46 +239,28 @@ class SENPAI_Controller:
             if self.tts_enabled:
                 self.tts_module.speak(answer)
             
-            if result.get("target_box"):
-                # ターゲットボックスがある場合、座標計算して強調表示
-                # box: [y_min, x_min, y_max, x_max] (0-1000 scale)
-                box = result["target_box"]
-                y_min, x_min, y_max, x_max = box
-                
-                # Tkinter screen size (論理ピクセル = overlay座標系)
-                tk_w = self.ui.root.winfo_screenwidth()
-                tk_h = self.ui.root.winfo_screenheight()
-                
-                # キャプチャサイズ(物理)と画面サイズ(論理)の比率を確認
-                cap_w, cap_h = self.screen_size if hasattr(self, 'screen_size') else (tk_w, tk_h)
-                print(f"DEBUG: Capture Size=({cap_w}x{cap_h}), Screen Size=({tk_w}x{tk_h})")
-                
-                # 0-1000スケールから直接Tkinterの論理ピクセルに変換
-                # 数学的に: (val/1000)*img_size*(tk_size/img_size) = (val/1000)*tk_size
-                final_left = int((x_min / 1000.0) * tk_w)
-                final_top = int((y_min / 1000.0) * tk_h)
-                final_right = int((x_max / 1000.0) * tk_w)
-                final_bottom = int((y_max / 1000.0) * tk_h)
-                
-                final_width = max(final_right - final_left, 30)  # 最小幅30px
-                final_height = max(final_bottom - final_top, 30)  # 最小高30px
-                
-                # AIの座標精度誤差を吸収するため、少し余白を追加
-                margin = 5
-                final_left = max(0, final_left - margin)
-                final_top = max(0, final_top - margin)
-                final_width = final_width + margin * 2
-                final_height = final_height + margin * 2
-                
-                print(f"DEBUG: Box(0-1000)={box}, Screen(Tk)=({tk_w}x{tk_h})")
-                print(f"DEBUG: Marker -> Left={final_left}, Top={final_top}, W={final_width}, H={final_height}")
+            # 現在の画面（1枚目の画像）上のターゲットを強調表示
+            # 旧バックエンドは target_box（1つ）のみを返すので、その場合はそれを使う
+            targets = [t for t in result.get("target_boxes") or [] if t.get("image_index", 0) == 0]
+            if not targets and result.get("target_box"):
+                targets = [{"box": result["target_box"], "label": ""}]
+            
+            if targets:
+                # ターゲットボックスがある場合、分析した画面（1枚目）上で実際の要素の輪郭に合わせてから強調表示
+                frame_path = screenshot_data[0] if isinstance(screenshot_data, list) else screenshot_data
+                frame = self._load_gray(frame_path)
+                regions = [self._box_to_screen_region(t["box"], t.get("label", ""), frame) for t in targets]
                 
                 # 囲み表示（ハイライト）を実行
-                self.ui.show_target_highlight(final_left, final_top, final_width, final_height) 
+                guide_id = self.ui.new_guide_id()
+                self.ui.show_target_highlights(regions, requested_at=answer_at, guide_id=guide_id)
+                
+                # 分析した画面から対象を切り出して追跡する
+                self._start_tracking(guide_id, frame_path, regions)
 
             elif result.get("show_arrow", False):
                 # 汎用的な矢印（以前の互換性用）
-                self.ui.show_global_arrow(400, 300) # デフォルト位置
+                self.ui.show_global_arrow(400, 300, requested_at=answer_at) # デフォルト位置
 
             # ナビゲーションモード（追従）の判定
             # if result.get("continue_navigation"):
@@ -256,6 +281,242 @@ class SENPAI_Controller:
             self.ui.set_status(error_msg, "red")
             self.is_navigating = False # エラー時は解除
 
+    def _box_to_screen_region(self, box, label="", frame=None):
+        """
+        0-1000スケールのボックスを画面上の強調表示領域に変換
+        
+        Args:
+            box: [y_min, x_min, y_max, x_max] (0-1000 scale)
+            label: 要素のラベル（強調表示に添える）
+            frame: 分析に使ったキャプチャ（グレースケールの numpy 配列）。指定すると要素の輪郭に合わせて補正する
+            
+        Returns:
+            dict: {"x", "y", "width", "height", "label", "confidence"}（Tkinterの論理ピクセル）
+                  confidence は補正の確からしさ（補正しなかった場合は 0.0）
+        """
+        y_min, x_min, y_max, x_max = box
+        
+        # Tkinter screen size (論理ピクセル = overlay座標系、ワーカースレッドから呼ばれるのでUIが保持する値を使う)
+        tk_w = self.ui.screen_width
+        tk_h = self.ui.screen_height
+        
+        # キャプチャサイズ(物理)と画面サイズ(論理)の比率を確認
+        cap_w, cap_h = self.screen_size if hasattr(self, 'screen_size') else (tk_w, tk_h)
+        print(f"DEBUG: Capture Size=({cap_w}x{cap_h}), Screen Size=({tk_w}x{tk_h})")
+        
+        # キャプチャ上で、モデルの矩形の近くにある実際の UI 要素の輪郭を探す
+        confidence = 0.0
+        if frame is not None:
+            frame_h, frame_w = frame.shape[:2]
+            coarse = (x_min / 1000.0 * frame_w, y_min / 1000.0 * frame_h,
+                      x_max / 1000.0 * frame_w, y_max / 1000.0 * frame_h)
+            refined, confidence = refine_box(frame, coarse)
+            print(f"DEBUG: Refined box (capture px) {tuple(int(v) for v in coarse)} -> {refined}, confidence={confidence}")
+        
+        if confidence >= REFINE_MIN_CONFIDENCE:
+            # 補正後の矩形は要素の輪郭そのものなので、余白は枠線がかぶらない程度にする
+            scale_x = tk_w / float(frame_w)
+            scale_y = tk_h / float(frame_h)
+            final_left = int(refined[0] * scale_x)
+            final_top = int(refined[1] * scale_y)
+            final_width = int((refined[2] - refined[0]) * scale_x)
+            final_height = int((refined[3] - refined[1]) * scale_y)
+            margin = 2
+        else:
+            # 0-1000スケールから直接Tkinterの論理ピクセルに変換
+            # 数学的に: (val/1000)*img_size*(tk_size/img_size) = (val/1000)*tk_size
+            final_left = int((x_min / 1000.0) * tk_w)
+            final_top = int((y_min / 1000.0) * tk_h)
+            final_right = int((x_max / 1000.0) * tk_w)
+            final_bottom = int((y_max / 1000.0) * tk_h)
+            
+            final_width = max(final_right - final_left, 30)  # 最小幅30px
+            final_height = max(final_bottom - final_top, 30)  # 最小高30px
+            
+            # AIの座標精度誤差を吸収するため、少し余白を追加
+            margin = 5
+        
+        final_left = max(0, final_left - margin)
+        final_top = max(0, final_top - margin)
+        final_width = final_width + margin * 2
+        final_height = final_height + margin * 2
+        
+        print(f"DEBUG: Box(0-1000)={box}, Screen(Tk)=({tk_w}x{tk_h})")
+        print(f"DEBUG: Marker -> Left={final_left}, Top={final_top}, W={final_width}, H={final_height}")
+        
+        return {"x": final_left, "y": final_top, "width": final_width, "height": final_height,
+                "label": label, "confidence": confidence}
+
+    def _load_gray(self, path):
+        """キャプチャをグレースケールの配列として読み込む（失敗したら None）"""
+        try:
+            with Image.open(path) as img:
+                return np.array(img.convert('L'))
+        except Exception as e:
+            print(f"Capture load error: {e}")
+            return None
+
+    def _index_screen(self, screenshot):
+        """撮影した画面の OCR 索引をバックグラウンドで作り始める（同じ画面の索引があれば何もしない）"""
+        if not self.ocr_cache.available():
+            return
+        try:
+            gray = screenshot.convert('L')
+            self.ocr_cache.build_async(gray, screen_fingerprint(gray))
+        except Exception as e:
+            print(f"OCR index start error: {e}")
+
+    def _answer_location_locally(self, question, screenshot_path, allow_answer=True):
+        """
+        場所を尋ねるだけの質問に、画面の OCR 索引を引いて答える
+        索引は撮影時に作り始めているので、LOCAL_INDEX_WAIT_SECONDS までできあがるのを待つ
+        （変わっていないタイルは OCR 結果を再利用するので、見たことのある画面ならすぐにできる）。
+        間に合わなければ今回はモデルに任せ、索引は同じ画面への次の質問から使う
+        
+        Returns:
+            bool: ローカルで答えたか
+        """
+        if not allow_answer or not self.ocr_cache.available():
+            return False
+        targets = extract_location_target(question)
+        if not targets:
+            return False
+        try:
+            with Image.open(screenshot_path) as img:
+                image = img.convert('L')
+        except Exception as e:
+            print(f"OCR capture load error: {e}")
+            return False
+        
+        fingerprint = screen_fingerprint(image)
+        index = self.ocr_cache.get(fingerprint, timeout=LOCAL_INDEX_WAIT_SECONDS)
+        if index is None:
+            # 撮影時の作成に失敗した場合などに備えて、次の質問のために作り始めておく
+            self.ocr_cache.build_async(image, fingerprint)
+            return False
+        
+        matches = []
+        for target in targets:
+            matches = [(score, entry) for score, entry in index.lookup(target) if score >= LOCAL_MATCH_MIN_SCORE]
+            if matches:
+                break
+        if not matches or len(matches) > LOCAL_MATCH_MAX_RESULTS:
+            # 見つからない・候補が多すぎて特定できない場合はモデルに任せる
+            return False
+        if not self.ocr_cache.is_current(image, [entry for _, entry in matches]):
+            # 近い画面の索引だが、単語のあたりが変わっている（メニューが開いた・文字を編集したなど）:
+            # 古い位置を指さないようにモデルに任せ、今の画面の索引を作り直す
+            print("Local OCR answer skipped: matched tiles changed since the index was built")
+            self.ocr_cache.discard(index)
+            self.ocr_cache.build_async(image, fingerprint)
+            return False
+        
+        answer_at = time.perf_counter()
+        print(f"Local OCR answer: {[(round(score, 2), entry['text']) for score, entry in matches]}")
+        
+        # OCR の単語の位置（キャプチャのピクセル）を 0-1000 スケールにして、モデルの回答と同じ経路で強調表示する
+        width, height = image.size
+        frame = np.array(image)
+        regions = []
+        for score, entry in matches:
+            left, top, right, bottom = entry["box"]
+            box = [top * 1000.0 / height, left * 1000.0 / width, bottom * 1000.0 / height, right * 1000.0 / width]
+            regions.append(self._box_to_screen_region(box, "", frame))
+        
+        text = matches[0][1]["text"]
+        if len(matches) > 1:
+            answer = f"「{text}」は画面上に{len(matches)}か所あります。赤い枠で囲んだ位置です。"
+        else:
+            answer = f"「{text}」は画面上の赤い枠で囲んだ位置にあります。"
+        
+        self.chat_history.append("assistant", answer)
+        if self.use_backend_session:
+            # バックエンドのセッションの会話履歴にも、次の質問を送るときに記録させる
+            self.ai_module.record_local_turn(question, answer)
+        self.ui.add_message("assistant", answer, self._get_timestamp(), model="local-ocr")
+        if self.tts_enabled:
+            self.tts_module.speak(answer)
+        
+        guide_id = self.ui.new_guide_id()
+        self.ui.show_target_highlights(regions, requested_at=answer_at, guide_id=guide_id)
+        self._start_tracking(guide_id, screenshot_path, regions)
+        
+        self.is_navigating = False
+        self.ui.set_status("準備完了", "green")
+        return True
+
+    def _start_tracking(self, guide_id, frame_path, regions):
+        """強調表示した対象をテンプレートマッチングで追跡し、動いたらガイドを移動する"""
+        self._stop_tracking()
+        tracker = TargetTracker(
+            on_move=lambda dx, dy: self.ui.move_guide(guide_id, dx, dy),
+            on_lost=lambda: self._on_target_lost(guide_id),
+            is_alive=lambda: self.ui.has_guide(guide_id)
+        )
+        if tracker.start(frame_path, regions, (self.ui.screen_width, self.ui.screen_height)):
+            self.target_tracker = tracker
+
+    def _stop_tracking(self):
+        if self.target_tracker:
+            self.target_tracker.stop()
+            self.target_tracker = None
+
+    def _on_target_lost(self, guide_id):
+        """対象が画面から消えたら、別の場所を指したままにならないようにガイドを消す"""
+        self.ui.hide_visual_guide(guide_id=guide_id)
+        self.ui.set_status("強調表示していた対象が見えなくなりました", "gray")
+
+    def _analyze_in_session(self, question, screenshot_data, priority="interactive"):
+        """
+        バックエンドのセッションを使って分析
+        画面が前回アップロード時から変わっていなければ画像を送らず、質問だけを送信する
+        
+        Returns:
+            dict: 結果（セッションが使えない場合は None）
+        """
+        paths = screenshot_data if isinstance(screenshot_data, list) else [screenshot_data]
+        signature = self._screen_signature(paths)
+        same_screen = self._is_same_screen(signature, self.session_screen_signature)
+        
+        result = self.ai_module.analyze_in_session(question, None if same_screen else screenshot_data, priority)
+        if result.get("session_expired"):
+            # セッション切れ: 新しいセッションで画像を送り直す
+            print("Backend session expired. Re-uploading screenshots.")
+            same_screen = False
+            result = self.ai_module.analyze_in_session(question, screenshot_data, priority)
+        
+        if result.get("session_unavailable"):
+            self.session_screen_signature = None
+            return None
+        
+        if not same_screen:
+            self.session_screen_signature = signature if result.get("success") else None
+        return result
+
+    def _screen_signature(self, paths):
+        """画面比較用に、各スクリーンショットを縮小グレースケール化した配列のリストを返す"""
+        try:
+            signature = []
+            for path in paths:
+                with Image.open(path) as img:
+                    signature.append(np.array(img.resize((320, 240)).convert('L')))
+            return signature
+        except Exception as e:
+            print(f"Screen signature error: {e}")
+            return None
+
+    def _is_same_screen(self, signature, other):
+        """2つの画面シグネチャがほぼ同じ画面を表しているか判定"""
+        if signature is None or other is None or len(signature) != len(other):
+            return False
+        # 時計の変化やカーソルの点滅程度の差は同じ画面とみなす
+        SAME_SCREEN_THRESHOLD = 2.0
+        for a, b in zip(signature, other):
+            diff = np.mean(np.abs(a.astype(int) - b.astype(int)))
+            if diff > SAME_SCREEN_THRESHOLD:
+                return False
+        return True
+
     def _update_last_screen(self):
         """現在の画面をナビゲーション基準として保存"""
         try:
@@ -306,20 +567,13 @@ class SENPAI_Controller:
                     # 「画面が変化しました。次は何をすればいいですか？」
                     next_question = "画面が変化しました。次の手順を教えてください。"
                     
-                    # UIスレッドを経由せずに直接Controllerメソッドを呼ぶ
-                    # ただし、UIへのアクセスがあるので注意。tkスレッドではないスレッドからのアクセス。
-                    # ui_1120_01.py のメソッドは一部 tkinter のスレッドセーフティに依存するが、
-                    # 基本的に after などを介さないと危険。
-                    # しかし今回は簡易実装として直接呼び出す（多くのTkinter操作は許容される場合が多いが、add_messageなどは微妙）
-                    # 本来は self.ui.root.after(...) を使うべき。
-                    
-                    # ひとひとまず非同期で実行
                     # フラグを一時的に落として連打防止
                     self.is_navigating = False 
                     
                     # NOTE: メインスレッド(root.after)で実行するとAPI待ち時間にUIが固まるため、
-                    # 新しいスレッドで実行する。process_questionは元々スレッドセーフ（UI操作含む）に作られている前提。
-                    threading.Thread(target=self.process_question, args=(next_question,), daemon=True).start()
+                    # 新しいスレッドで実行する。UIのメソッドはワーカースレッドから呼ばれると
+                    # UIDispatcher 経由で Tk のスレッドに回されるので、直接呼び出してよい。
+                    threading.Thread(target=self.process_question, args=(next_question, "navigation"), daemon=True).start()
                     
             except Exception as e:
                 print(f"Navigation Loop Error: {e}")
@@ -379,6 +633,12 @@ class SENPAI_Controller:
         self.ui.set_status(f"モデル変更: {model_id}", "green")
         print(f"AI Model changed to: {model_id}")
     
+    def change_latency_mode(self, mode):
+        """回答モード（速さ優先 / 標準 / じっくり）を変更"""
+        self.ai_module.set_latency_mode(mode)
+        self.ui.set_status(f"回答モード変更: {mode}", "green")
+        print(f"Latency mode changed to: {mode}")
+    
     def run(self):
         """アプリケーションを起動"""
         try:
@@ -391,6 +651,9 @@ class SENPAI_Controller:
     def cleanup(self):
         """リソースのクリーンアップ"""
         print("クリーンアップ中...")
+        self._stop_tracking()
+        self.ocr_cache.ocr.shutdown()
+        self.ai_module.end_session()
         self.tts_module.cleanup()
         print("完了")
 
@@ -0,0 +1,269 @@
+"""
+Conversation History Module
+会話履歴をトークン数の予算内でプロンプトに載せるための履歴管理モジュール
+
+- 新しいターンから順に、予算（推定トークン数）に収まるだけ原文のまま載せる
+- 予算から溢れた古いターンはバックグラウンドで要約（抽出型のローリング要約）に畳み込む
+- メモリ上に保持するターン数には上限があり、要約済みの古いターンはディスクに書き出す
+- UI の履歴ペインから溢れたメッセージも同様にディスクに書き出し、検索・ページ単位で読み戻せる（MessageArchive）
+"""
+
+import json
+import os
+import re
+import threading
+import time
+from collections import deque
+
+# CJK文字（ひらがな・カタカナ・漢字・全角記号）はおよそ1文字1トークン、それ以外はおよそ4文字1トークン
+_CJK_PATTERN = re.compile(r"[　-ヿ㐀-鿿豈-﫿＀-￯]")
+_SENTENCE_END = re.compile(r"(?<=[。！？!?\n])")
+
+
+def estimate_tokens(text):
+    """テキストのトークン数を推定（APIを呼ばない概算）"""
+    if not text:
+        return 0
+    cjk = len(_CJK_PATTERN.findall(text))
+    return cjk + (len(text) - cjk + 3) // 4
+
+
+def _truncate_to_tokens(text, max_tokens):
+    """推定トークン数が max_tokens に収まるように先頭から切り詰める"""
+    if estimate_tokens(text) <= max_tokens:
+        return text
+    low, high = 0, len(text)
+    while low < high:
+        mid = (low + high + 1) // 2
+        if estimate_tokens(text[:mid]) + 1 <= max_tokens:
+            low = mid
+        else:
+            high = mid - 1
+    return text[:low] + "…"
+
+
+class ConversationHistory:
+    """
+    会話履歴の管理（スレッドセーフ）
+    """
+
+    def __init__(self, budget_tokens=None, max_in_memory=None, summary_tokens=None, archive_dir="history"):
+        """
+        Args:
+            budget_tokens: プロンプトに載せる履歴（要約を含む）の推定トークン数の上限
+            max_in_memory: メモリ上に保持するターン数の上限（要約済みのターンから順にディスクへ書き出す）
+            summary_tokens: ローリング要約の推定トークン数の上限
+            archive_dir: 書き出したターンを保存するディレクトリ
+        """
+        if budget_tokens is None:
+            budget_tokens = int(os.environ.get("SENP_AI_HISTORY_TOKEN_BUDGET", "1500"))
+        if max_in_memory is None:
+            max_in_memory = int(os.environ.get("SENP_AI_HISTORY_MAX_TURNS", "40"))
+        if summary_tokens is None:
+            summary_tokens = max(100, budget_tokens // 4)
+
+        self.budget_tokens = budget_tokens
+        self.max_in_memory = max_in_memory
+        self.summary_tokens = summary_tokens
+        self.archive_path = os.path.join(archive_dir, f"history_{time.strftime('%Y%m%d_%H%M%S')}.jsonl")
+
+        self._lock = threading.Lock()
+        # {"seq", "role", "text", "tokens"}
+        self._turns = deque()
+        self._next_seq = 0
+        self._summary_lines = deque()
+        self._summary_tokens_used = 0
+        # この番号までのターンは要約に畳み込み済み
+        self._summarized_seq = -1
+        self._spilled = 0
+
+        self._compact_event = threading.Event()
+        self._compact_thread = threading.Thread(target=self._compact_loop, daemon=True)
+        self._compact_thread.start()
+
+    def __len__(self):
+        with self._lock:
+            return self._spilled + len(self._turns)
+
+    def append(self, role, text):
+        """ターンを追加（要約とディスクへの書き出しはバックグラウンドで行う）"""
+        with self._lock:
+            self._turns.append({"seq": self._next_seq, "role": role, "text": text, "tokens": estimate_tokens(text)})
+            self._next_seq += 1
+        self._compact_event.set()
+
+    def recent(self, count):
+        """メモリ上の直近 count 件のターンを返す"""
+        with self._lock:
+            return [{"role": t["role"], "text": t["text"]} for t in list(self._turns)[-count:]]
+
+    def build_context(self, skip_last=0, budget_tokens=None):
+        """
+        プロンプトに載せる履歴テキストを作成
+
+        Args:
+            skip_last: 末尾から除外するターン数（今回の質問がすでに追加されている場合は 1）
+            budget_tokens: 予算（None ならコンストラクタの値）
+
+        Returns:
+            str: 要約と直近の会話（履歴がなければ空文字列）
+        """
+        budget = self.budget_tokens if budget_tokens is None else budget_tokens
+        with self._lock:
+            summary = "\n".join(self._summary_lines)
+            turns = list(self._turns)
+            summarized_seq = self._summarized_seq
+        if skip_last:
+            turns = turns[:-skip_last]
+
+        summary_block = f"これまでの会話の要約:\n{summary}\n\n" if summary else ""
+        remaining = budget - estimate_tokens(summary_block) - estimate_tokens("これまでの会話履歴:\n")
+        lines = []
+        # 新しいターンから順に、予算に収まるだけ載せる（要約済みのターンは載せない）
+        for turn in reversed(turns):
+            if turn["seq"] <= summarized_seq or remaining <= 0:
+                break
+            role_name = "User" if turn["role"] == "user" else "AI"
+            prefix = f"{role_name}: "
+            text = turn["text"]
+            if turn["tokens"] + estimate_tokens(prefix) > remaining:
+                # 予算を超える長い回答は、先頭だけを載せる
+                text = _truncate_to_tokens(text, remaining - estimate_tokens(prefix))
+            lines.append(prefix + text)
+            remaining -= estimate_tokens(lines[-1])
+
+        context = summary_block
+        if lines:
+            context += "これまでの会話履歴:\n" + "\n".join(reversed(lines)) + "\n\n"
+        return context
+
+    def clear(self):
+        """履歴をすべて消去（ディスク上の記録は残す）"""
+        with self._lock:
+            self._turns.clear()
+            self._summary_lines.clear()
+            self._summary_tokens_used = 0
+            self._summarized_seq = self._next_seq - 1
+
+    def _summarize_turn(self, turn):
+        """1ターンを1行に要約（最初の文だけを残す抽出型）"""
+        first_sentence = _SENTENCE_END.split(turn["text"].strip(), maxsplit=1)[0].strip()
+        role_name = "User" if turn["role"] == "user" else "AI"
+        return f"- {role_name}: {_truncate_to_tokens(first_sentence, 60)}"
+
+    def _compact_loop(self):
+        while True:
+            self._compact_event.wait()
+            self._compact_event.clear()
+            try:
+                self._compact()
+            except Exception as e:
+                print(f"History compaction error: {e}")
+
+    def _compact(self):
+        """予算から溢れたターンを要約に畳み込み、メモリの上限を超えたターンをディスクに書き出す"""
+        with self._lock:
+            turns = list(self._turns)
+            summarized_seq = self._summarized_seq
+
+        # 直近の会話は原文で載せたいので、予算の3/4に収まる範囲は要約しない
+        verbatim_budget = (self.budget_tokens - self.summary_tokens) * 3 // 4
+        used = 0
+        boundary = len(turns)
+        for i in range(len(turns) - 1, -1, -1):
+            used += turns[i]["tokens"]
+            if used > verbatim_budget and i < len(turns) - 1:
+                break
+            boundary = i
+        to_summarize = [t for t in turns[:boundary] if t["seq"] > summarized_seq]
+        summary_lines = [self._summarize_turn(t) for t in to_summarize]
+
+        spill = []
+        with self._lock:
+            for line in summary_lines:
+                self._summary_lines.append(line)
+                self._summary_tokens_used += estimate_tokens(line)
+            # 要約も上限を超えたら古い行から捨てる
+            while self._summary_tokens_used > self.summary_tokens and len(self._summary_lines) > 1:
+                self._summary_tokens_used -= estimate_tokens(self._summary_lines.popleft())
+            if to_summarize:
+                self._summarized_seq = max(self._summarized_seq, to_summarize[-1]["seq"])
+            # 要約済みのターンだけをメモリから追い出す（未要約のターンは失わない）
+            while len(self._turns) > self.max_in_memory and self._turns[0]["seq"] <= self._summarized_seq:
+                spill.append(self._turns.popleft())
+            self._spilled += len(spill)
+
+        if spill:
+            self._archive(spill)
+
+    def _archive(self, turns):
+        """メモリから追い出したターンをJSONLで追記"""
+        try:
+            os.makedirs(os.path.dirname(self.archive_path), exist_ok=True)
+            with open(self.archive_path, "a", encoding="utf-8") as f:
+                for turn in turns:
+                    f.write(json.dumps({"role": turn["role"], "text": turn["text"]}, ensure_ascii=False) + "\n")
+        except Exception as e:
+            print(f"History archive error: {e}")
+
+
+class MessageArchive:
+    """
+    UI の履歴ペインから溢れたメッセージのディスク上のアーカイブ（スレッドセーフ）
+    メッセージは1行1件のJSONLに追記し、行の開始位置を覚えておいてページ単位で読み戻す
+    """
+
+    def __init__(self, archive_dir="history"):
+        self.path = os.path.join(archive_dir, f"messages_{time.strftime('%Y%m%d_%H%M%S')}.jsonl")
+        self._lock = threading.Lock()
+        self._offsets = []
+
+    def __len__(self):
+        with self._lock:
+            return len(self._offsets)
+
+    def append(self, record):
+        """メッセージ（{"role", "message", "timestamp", "model"}）を追記"""
+        line = (json.dumps(record, ensure_ascii=False) + "\n").encode("utf-8")
+        with self._lock:
+            try:
+                os.makedirs(os.path.dirname(self.path), exist_ok=True)
+                with open(self.path, "ab") as f:
+                    offset = f.tell()
+                    f.write(line)
+                self._offsets.append(offset)
+            except Exception as e:
+                print(f"Message archive error: {e}")
+
+    def page(self, start, end):
+        """start 番目から end 番目の手前までのメッセージを古い順に返す"""
+        with self._lock:
+            offsets = self._offsets[start:end]
+        if not offsets:
+            return []
+        records = []
+        with open(self.path, "rb") as f:
+            f.seek(offsets[0])
+            for _ in offsets:
+                records.append(json.loads(f.readline().decode("utf-8")))
+        return records
+
+    def search(self, query, before=None):
+        """
+        before 番目より前で query を含む最も新しいメッセージの番号を返す（大文字小文字は区別しない）
+
+        Returns:
+            int or None
+        """
+        with self._lock:
+            count = len(self._offsets) if before is None else min(before, len(self._offsets))
+        if count == 0:
+            return None
+        query = query.lower()
+        found = None
+        with open(self.path, "rb") as f:
+            for index in range(count):
+                record = json.loads(f.readline().decode("utf-8"))
+                if query in (record.get("message") or "").lower():
+                    found = index
+        return found
@@ -0,0 +1,510 @@
+"""
+OCR Index Module
+画面ごとの OCR 結果（単語とその位置）を検索用の索引にして保持する
+
+- OCR は画面のフィンガープリント（縮小画像の差分ハッシュ）ごとに1回だけ、バックグラウンドで実行する
+- フィンガープリントはハミング距離で比べ、時計やカーソルの変化程度の差は同じ画面とみなす
+  （近い画面の索引で答える前に、見つけた単語を読んだタイルが今の画面でも同じ内容かを確かめる）
+- 索引は正規化したテキスト（NFKC・小文字・空白と記号を除去）の完全一致と、文字 bigram の転置索引を持つ
+- 同じ行で続く単語をつなげたフレーズも登録する（日本語は1文字ずつに分かれて認識されることが多いため）
+- 「「保存」ボタンはどこ？」のような場所の質問は、索引を引くだけでモデルを呼ばずに答えられる
+- OCR は画面をタイルに分けてプロセスプールで並列に行い、タイルの内容のハッシュごとに結果を再利用する
+  （画面の一部だけが変わった場合は、変わったタイルだけを読み直す）
+
+pytesseract（と Tesseract 本体）はオプション。インストールされていなければ索引は作られず、常にモデルで答える
+"""
+
+import hashlib
+import os
+import re
+import threading
+import time
+import unicodedata
+from collections import OrderedDict, defaultdict
+from concurrent.futures import ProcessPoolExecutor
+
+from PIL import Image
+
+try:
+    import pytesseract
+except ImportError:
+    pytesseract = None
+
+# OCR の信頼度（0-100）がこれ未満の単語は索引に入れない
+MIN_WORD_CONFIDENCE = 30
+# 1つのフレーズとしてつなげる単語数の上限
+MAX_PHRASE_WORDS = 6
+# 索引を保持する画面数
+MAX_SCREENS = 8
+# フィンガープリントの1辺の大きさ（FINGERPRINT_SIZE² ビット）と、同じ画面とみなすハミング距離の上限
+FINGERPRINT_SIZE = 16
+MAX_FINGERPRINT_DISTANCE = 4
+
+# OCR のタイルの大きさと、境界をまたぐ単語を読むために隣のタイルと重ねる幅（ピクセル）
+TILE_WIDTH = 960
+TILE_HEIGHT = 240
+TILE_OVERLAP = 40
+# 結果を保持するタイル数
+MAX_CACHED_TILES = 2048
+# 明るさの幅がこれ未満のタイルは文字がないとみなして OCR しない
+BLANK_TILE_RANGE = 16
+
+# 正規化で取り除く文字（空白・括弧・句読点など）
+_STRIP_PATTERN = re.compile(r"[\s\"'`「」『』()（）\[\]【】<>＜＞:：.,。、・!！?？]+")
+
+# 場所を尋ねる質問の判定
+_LOCATION_PATTERN = re.compile(r"どこ|場所|位置|where", re.IGNORECASE)
+_QUOTED_PATTERN = re.compile(r"[「『\"“](.+?)[」』\"”]")
+_TARGET_PATTERNS = [
+    re.compile(r"^(.+?)\s*(?:は|って|の場所は|の位置は|が)\s*(?:どこ|どこに)"),
+    re.compile(r"^(?:where\s+is|where's)\s+(?:the\s+)?(.+?)\s*\??$", re.IGNORECASE),
+]
+# 質問の対象から外す UI 要素の種類（「保存ボタン」→「保存」）
+_ELEMENT_SUFFIXES = ("ボタン", "メニュー", "リンク", "タブ", "アイコン", "項目", "欄",
+                     " button", " menu", " link", " tab", " icon")
+
+
+def normalize_text(text):
+    """表記ゆれを吸収した比較用のテキスト（全角半角・大文字小文字・空白・記号）"""
+    return _STRIP_PATTERN.sub("", unicodedata.normalize("NFKC", text).lower())
+
+
+def _ngrams(text):
+    """文字 bigram の集合（1文字のテキストはその文字だけ）"""
+    if len(text) < 2:
+        return {text} if text else set()
+    return {text[i:i + 2] for i in range(len(text) - 1)}
+
+
+def _join_words(texts):
+    """表示用に単語をつなげる（英数字どうしの間だけ空白を入れる）"""
+    joined = texts[0]
+    for text in texts[1:]:
+        if joined[-1].isascii() and joined[-1].isalnum() and text[0].isascii() and text[0].isalnum():
+            joined += " "
+        joined += text
+    return joined
+
+
+def extract_location_target(question):
+    """
+    「X はどこ？」のような単純な場所の質問から、探す対象のテキストを取り出す
+
+    Returns:
+        list: 探すテキストの候補（先に試すものから順）。場所の質問でなければ空のリスト
+    """
+    if not question or not _LOCATION_PATTERN.search(question) or len(question) > 40:
+        return []
+
+    quoted = _QUOTED_PATTERN.search(question)
+    if quoted:
+        target = quoted.group(1)
+    else:
+        target = None
+        for pattern in _TARGET_PATTERNS:
+            match = pattern.search(question.strip())
+            if match:
+                target = match.group(1)
+                break
+        if not target:
+            return []
+
+    candidates = [target.strip()]
+    for suffix in _ELEMENT_SUFFIXES:
+        if candidates[0].lower().endswith(suffix) and len(candidates[0]) > len(suffix):
+            candidates.append(candidates[0][:-len(suffix)].strip())
+            break
+    return [c for c in candidates if normalize_text(c)]
+
+
+def screen_fingerprint(image):
+    """
+    画面のフィンガープリント（差分ハッシュ）
+
+    縮小したグレースケール画像で、横に隣り合う画素の明暗の大小を並べた整数。
+    画面の一部だけが変わっても変わるビットは少ないので、fingerprint_distance で近さを比べる
+    """
+    size = FINGERPRINT_SIZE
+    pixels = image.convert("L").resize((size + 1, size), Image.BOX).tobytes()
+    value = 0
+    for y in range(size):
+        row = pixels[y * (size + 1):(y + 1) * (size + 1)]
+        for x in range(size):
+            value = (value << 1) | (row[x] < row[x + 1])
+    return value
+
+
+def fingerprint_distance(a, b):
+    """2つのフィンガープリントのハミング距離（異なるビット数）"""
+    return bin(a ^ b).count("1")
+
+
+class OCRIndex:
+    """
+    1画面分の OCR 結果の索引
+    """
+
+    def __init__(self, words):
+        """
+        Args:
+            words: {"text", "box": (left, top, right, bottom), "confidence", "line"} のリスト（OCR の出現順）
+                   （TiledOCR の結果は、単語を読んだタイル "tile": (切り出し範囲, 内容のキー) も持つ）
+        """
+        self.entries = []
+        self._exact = defaultdict(list)
+        self._postings = defaultdict(set)
+
+        lines = OrderedDict()
+        for word in words:
+            lines.setdefault(word["line"], []).append(word)
+        for line_words in lines.values():
+            for start in range(len(line_words)):
+                for end in range(start + 1, min(len(line_words), start + MAX_PHRASE_WORDS) + 1):
+                    self._add(line_words[start:end])
+
+    def __len__(self):
+        return len(self.entries)
+
+    def _add(self, words):
+        norm = normalize_text("".join(w["text"] for w in words))
+        if not norm:
+            return
+        # 単語を読んだタイル (切り出し範囲, 内容のキー)。TiledOCR 以外の結果なら確かめられないので空にする
+        tiles = [w.get("tile") for w in words]
+        entry = {
+            "text": _join_words([w["text"] for w in words]),
+            "norm": norm,
+            "box": (
+                min(w["box"][0] for w in words),
+                min(w["box"][1] for w in words),
+                max(w["box"][2] for w in words),
+                max(w["box"][3] for w in words),
+            ),
+            "confidence": min(w["confidence"] for w in words),
+            "grams": _ngrams(norm),
+            "tiles": tuple(set(tiles)) if all(tiles) else (),
+        }
+        entry_id = len(self.entries)
+        self.entries.append(entry)
+        self._exact[norm].append(entry_id)
+        for gram in entry["grams"]:
+            self._postings[gram].add(entry_id)
+
+    def lookup(self, query, limit=5):
+        """
+        テキストに当てはまる単語・フレーズを探す
+
+        Returns:
+            list: (score, entry) の一致度の高い順のリスト（score は 0-1、完全一致は 1.0）
+        """
+        norm = normalize_text(query)
+        if not norm:
+            return []
+        if norm in self._exact:
+            return [(1.0, self.entries[i]) for i in self._exact[norm]][:limit]
+
+        # bigram を共有する候補だけを Dice 係数で採点する
+        grams = _ngrams(norm)
+        shared = defaultdict(int)
+        for gram in grams:
+            for entry_id in self._postings.get(gram, ()):
+                shared[entry_id] += 1
+        scored = []
+        for entry_id, count in shared.items():
+            entry = self.entries[entry_id]
+            score = 2.0 * count / (len(grams) + len(entry["grams"]))
+            scored.append((score, entry))
+        scored.sort(key=lambda item: item[0], reverse=True)
+
+        # 同じ場所の単語を含む別のフレーズは、一致度の高いほうだけを残す
+        results = []
+        for score, entry in scored:
+            if any(_overlaps(entry["box"], kept["box"]) for _, kept in results):
+                continue
+            results.append((score, entry))
+            if len(results) >= limit:
+                break
+        return results
+
+
+def _overlaps(a, b):
+    return a[0] < b[2] and b[0] < a[2] and a[1] < b[3] and b[1] < a[3]
+
+
+def run_ocr(image):
+    """
+    画像の単語と位置を OCR で取得する（pytesseract がなければ None）
+
+    Returns:
+        list: OCRIndex に渡す単語のリスト
+    """
+    if pytesseract is None:
+        return None
+    gray = image.convert("L")
+    try:
+        data = pytesseract.image_to_data(gray, lang="jpn+eng", output_type=pytesseract.Output.DICT)
+    except pytesseract.TesseractError:
+        # 日本語の学習データがない場合は英語だけで認識する
+        data = pytesseract.image_to_data(gray, output_type=pytesseract.Output.DICT)
+
+    words = []
+    for i, text in enumerate(data["text"]):
+        text = text.strip()
+        confidence = float(data["conf"][i])
+        if not text or confidence < MIN_WORD_CONFIDENCE:
+            continue
+        left, top = data["left"][i], data["top"][i]
+        words.append({
+            "text": text,
+            "box": (left, top, left + data["width"][i], top + data["height"][i]),
+            "confidence": confidence,
+            "line": (data["block_num"][i], data["par_num"][i], data["line_num"][i]),
+        })
+    return words
+
+
+def tile_key(tile):
+    """タイルの内容のキー（画素のハッシュと大きさ）"""
+    return hashlib.sha1(tile.tobytes()).hexdigest() + f"_{tile.size[0]}x{tile.size[1]}"
+
+
+def _ocr_tile(data, size):
+    """プロセスプールで実行する1タイル分の OCR（画像はバイト列で受け渡す）"""
+    return run_ocr(Image.frombytes("L", size, data)) or []
+
+
+class TiledOCR:
+    """
+    画面をタイルに分けて OCR する（タイルの内容のハッシュごとに結果をキャッシュ）
+
+    - 各タイルは隣と TILE_OVERLAP だけ重ねて切り出し、単語の中心が重ならない部分（コア）にあるタイルの結果だけを採用する
+    - タイルの区切りは画面に対して固定で、キーは重なりを含めた切り出し範囲の内容なので、再利用できるのは
+      同じ位置の内容が変わっていないタイルだけ（スクロールで内容がずれたタイルは読み直しになる）
+    - 1回の実行の統計は run() の戻り値で返す（複数のスレッドから同時に呼んでも混ざらない）
+    """
+
+    def __init__(self, max_workers=None, tile_width=TILE_WIDTH, tile_height=TILE_HEIGHT,
+                 overlap=TILE_OVERLAP, max_cached_tiles=MAX_CACHED_TILES):
+        """
+        Args:
+            max_workers: OCR のプロセス数（省略時は CPU 数 - 1、0 ならプロセスを使わずに順番に実行）
+        """
+        if max_workers is None:
+            max_workers = max(1, (os.cpu_count() or 2) - 1)
+        self.max_workers = max_workers
+        self.tile_width = tile_width
+        self.tile_height = tile_height
+        self.overlap = overlap
+        self.max_cached_tiles = max_cached_tiles
+
+        self._lock = threading.Lock()
+        self._tiles = OrderedDict()
+        self._executor = None
+
+    def _get_executor(self):
+        if self._executor is None and self.max_workers > 0:
+            self._executor = ProcessPoolExecutor(max_workers=self.max_workers)
+        return self._executor
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=True, cancel_futures=True)
+            self._executor = None
+
+    def clear(self):
+        with self._lock:
+            self._tiles.clear()
+
+    def _layout(self, width, height):
+        """(コアの矩形, 重ねて切り出す矩形) のリスト"""
+        tiles = []
+        for top in range(0, height, self.tile_height):
+            for left in range(0, width, self.tile_width):
+                core = (left, top, min(width, left + self.tile_width), min(height, top + self.tile_height))
+                crop = (
+                    max(0, core[0] - self.overlap),
+                    max(0, core[1] - self.overlap),
+                    min(width, core[2] + self.overlap),
+                    min(height, core[3] + self.overlap),
+                )
+                tiles.append((core, crop))
+        return tiles
+
+    def run(self, image):
+        """
+        画面全体の単語を返す（変わっていないタイルはキャッシュを使う）
+
+        Returns:
+            (words, stats): OCRIndex に渡す単語のリスト（画面の座標）と、
+            タイル数の内訳 {"tiles", "cached", "blank", "ocr"} と所要時間 "ms" の統計
+        """
+        started = time.perf_counter()
+        gray = image.convert("L")
+        stats = {"tiles": 0, "cached": 0, "blank": 0, "ocr": 0}
+
+        tiles = []
+        pending = {}
+        for core, crop in self._layout(*gray.size):
+            tile = gray.crop(crop)
+            data = tile.tobytes()
+            key = tile_key(tile)
+            tiles.append((core, crop, key))
+            stats["tiles"] += 1
+
+            with self._lock:
+                cached = key in self._tiles
+                if cached:
+                    self._tiles.move_to_end(key)
+            if cached or key in pending:
+                stats["cached"] += 1
+                continue
+            low, high = tile.getextrema()
+            if high - low < BLANK_TILE_RANGE:
+                stats["blank"] += 1
+                self._store(key, [])
+                continue
+            pending[key] = (data, tile.size)
+
+        # 変わったタイルだけを並列に OCR する
+        stats["ocr"] = len(pending)
+        for key, words in self._ocr(pending).items():
+            self._store(key, words)
+
+        words = []
+        with self._lock:
+            results = {key: self._tiles.get(key, []) for _, _, key in tiles}
+        for core, crop, key in tiles:
+            for word in results[key]:
+                left, top, right, bottom = word["box"]
+                box = (left + crop[0], top + crop[1], right + crop[0], bottom + crop[1])
+                center_x, center_y = (box[0] + box[2]) / 2, (box[1] + box[3]) / 2
+                # 重なった部分の単語は、中心がコアに入っているタイルの結果だけを使う
+                if not (core[0] <= center_x < core[2] and core[1] <= center_y < core[3]):
+                    continue
+                words.append(dict(word, box=box, line=(crop[0], crop[1]) + tuple(word["line"]), tile=(crop, key)))
+
+        stats["ms"] = round((time.perf_counter() - started) * 1000, 1)
+        return words, stats
+
+    def _ocr(self, pending):
+        if not pending:
+            return {}
+        executor = self._get_executor()
+        if executor is None:
+            return {key: _ocr_tile(data, size) for key, (data, size) in pending.items()}
+        futures = {key: executor.submit(_ocr_tile, data, size) for key, (data, size) in pending.items()}
+        return {key: future.result() for key, future in futures.items()}
+
+    def _store(self, key, words):
+        with self._lock:
+            self._tiles[key] = words
+            self._tiles.move_to_end(key)
+            while len(self._tiles) > self.max_cached_tiles:
+                self._tiles.popitem(last=False)
+
+
+class OCRIndexCache:
+    """
+    画面のフィンガープリントごとの OCR 索引（スレッドセーフ、古いものから捨てる）
+    """
+
+    def __init__(self, max_screens=MAX_SCREENS, ocr=None, max_distance=MAX_FINGERPRINT_DISTANCE):
+        """
+        Args:
+            ocr: 索引の作成に使う TiledOCR（省略時は既定の設定で作る）
+            max_distance: 同じ画面とみなすフィンガープリントのハミング距離の上限
+        """
+        self.max_screens = max_screens
+        self.max_distance = max_distance
+        self.ocr = ocr or TiledOCR()
+        self._lock = threading.Lock()
+        self._built = threading.Condition(self._lock)
+        self._indexes = OrderedDict()
+        self._building = set()
+
+    @staticmethod
+    def available():
+        return pytesseract is not None
+
+    def _nearest_locked(self, fingerprint, fingerprints):
+        """fingerprints のうち、同じ画面とみなせる最も近いもの（なければ None）"""
+        best, best_distance = None, self.max_distance + 1
+        for other in fingerprints:
+            distance = fingerprint_distance(fingerprint, other)
+            if distance < best_distance:
+                best, best_distance = other, distance
+        return best
+
+    def get(self, fingerprint, timeout=0.0):
+        """
+        同じ画面とみなせる索引を返す
+
+        Args:
+            timeout: 索引を作成中なら、できあがるまで待つ最長の秒数
+
+        Returns:
+            OCRIndex: 索引（まだ作られていなければ None）
+        """
+        deadline = time.monotonic() + timeout
+        with self._built:
+            while True:
+                key = self._nearest_locked(fingerprint, self._indexes)
+                if key is not None:
+                    self._indexes.move_to_end(key)
+                    return self._indexes[key]
+                remaining = deadline - time.monotonic()
+                if remaining <= 0 or self._nearest_locked(fingerprint, self._building) is None:
+                    return None
+                self._built.wait(remaining)
+
+    @staticmethod
+    def is_current(image, entries):
+        """
+        索引の単語を読んだタイルが、今の画面でも同じ内容か
+        （近い画面の索引には、開いたメニューや編集した文字などの小さな変化が反映されていないため）
+        """
+        gray = image.convert("L")
+        for entry in entries:
+            if not entry["tiles"]:
+                return False
+            for crop, key in entry["tiles"]:
+                if tile_key(gray.crop(crop)) != key:
+                    return False
+        return True
+
+    def discard(self, index):
+        """今の画面と合わなくなった索引を捨てる（次の build_async で作り直す）"""
+        with self._lock:
+            for key, value in list(self._indexes.items()):
+                if value is index:
+                    del self._indexes[key]
+
+    def build_async(self, image, fingerprint):
+        """索引をバックグラウンドで作る（同じ画面とみなせる索引があるか作成中なら何もしない）"""
+        if not self.available():
+            return
+        with self._lock:
+            if (self._nearest_locked(fingerprint, self._indexes) is not None
+                    or self._nearest_locked(fingerprint, self._building) is not None):
+                return
+            self._building.add(fingerprint)
+        threading.Thread(target=self._build, args=(image, fingerprint), daemon=True).start()
+
+    def _build(self, image, fingerprint):
+        started = time.perf_counter()
+        try:
+            words, stats = self.ocr.run(image)
+            index = OCRIndex(words)
+            print(f"OCR index built: {len(words)} words, {len(index)} entries "
+                  f"in {(time.perf_counter() - started) * 1000:.0f}ms "
+                  f"(tiles: {stats['ocr']} read, {stats['cached']} cached, {stats['blank']} blank)")
+        except Exception as e:
+            print(f"OCR index error: {e}")
+            index = None
+        with self._built:
+            self._building.discard(fingerprint)
+            if index is not None:
+                self._indexes[fingerprint] = index
+                while len(self._indexes) > self.max_screens:
+                    self._indexes.popitem(last=False)
+            self._built.notify_all()
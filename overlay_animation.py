@@ -0,0 +1,143 @@
+"""
+Overlay Animation Module
+オーバーレイ（矢印・強調枠）のアニメーションを低コストで動かすエンジン
+
+- キーフレーム（各フレームの座標・色）は表示開始時に一度だけ計算しておく
+- 毎回のティックでは、前回から値が変わったキャンバスアイテムだけを更新する
+- 最初の数秒は滑らかに動かし、その後はティックの間隔を広げる
+- オーバーレイが非表示・対象が隠れている間は更新を止め、まれに状態だけを確認する
+"""
+
+import sys
+import time
+
+
+def triangle_wave(limit, step=1.0):
+    """0 → limit → 0 と往復する値の列（1周期分）"""
+    up = []
+    value = 0.0
+    while value <= limit:
+        up.append(value)
+        value += step
+    return up + up[-2:0:-1]
+
+
+def window_at_point(x, y):
+    """
+    画面上の (x, y) にあるトップレベルウィンドウのハンドル（Windows 以外では None）
+    透明色で抜いたオーバーレイの内側はヒットテストを素通りするので、その下のウィンドウが返る
+    """
+    if sys.platform != "win32":
+        return None
+    try:
+        import ctypes
+        from ctypes import wintypes
+        user32 = ctypes.windll.user32
+        user32.WindowFromPoint.restype = wintypes.HWND
+        user32.GetAncestor.restype = wintypes.HWND
+        hwnd = user32.WindowFromPoint(wintypes.POINT(int(x), int(y)))
+        return user32.GetAncestor(hwnd, 2) if hwnd else None  # GA_ROOT
+    except Exception:
+        return None
+
+
+class OverlayAnimator:
+    """
+    キャンバスアイテムのキーフレームアニメーション
+    """
+
+    def __init__(self, root, canvas, frame_ms=50, fast_seconds=5.0, slow_interval_ms=200,
+                 idle_check_ms=1000, is_active=None):
+        """
+        Args:
+            root: after() を持つ Tk ウィジェット
+            canvas: アニメーションするアイテムを持つキャンバス
+            frame_ms: キーフレームの間隔（ミリ秒）。フレームは経過時間から決めるので、ティックの間隔を広げても速さは変わらない
+            fast_seconds: 開始からこの秒数までは frame_ms ごとにティックする
+            slow_interval_ms: fast_seconds を過ぎた後のティックの間隔
+            idle_check_ms: 停止中に再開できるかを確認する間隔
+            is_active: アニメーションを続けるかを返す呼び出し可能オブジェクト（非表示・対象が隠れている場合は False）
+        """
+        self.root = root
+        self.canvas = canvas
+        self.frame_ms = frame_ms
+        self.fast_seconds = fast_seconds
+        self.slow_interval_ms = slow_interval_ms
+        self.idle_check_ms = idle_check_ms
+        self.is_active = is_active
+
+        # (アイテムID またはタグ, オプション名 または None（座標）, キーフレームのリスト)
+        self._tracks = []
+        self._applied = {}
+        self._after_id = None
+        self._started_at = None
+        self.paused = False
+        self.stats = {"ticks": 0, "updates": 0, "skipped": 0, "paused_checks": 0}
+
+    def add_coords_track(self, item, frames):
+        """座標のキーフレーム（各フレームは座標のタプル）"""
+        self._tracks.append((item, None, [tuple(frame) for frame in frames]))
+
+    def add_option_track(self, item, option, frames):
+        """オプション（outline / fill など）のキーフレーム。タグを渡すと該当アイテムをまとめて1回で更新する"""
+        self._tracks.append((item, option, list(frames)))
+
+    def translate(self, dx, dy):
+        """
+        座標のキーフレームをまとめて平行移動する（ガイドの対象が画面上で動いたとき）
+        アイテム自体は呼び出し元が canvas.move で同じだけ動かしておく
+        """
+        for index, (item, option, frames) in enumerate(self._tracks):
+            if option is not None:
+                continue
+            frames[:] = [self._shift(frame, dx, dy) for frame in frames]
+            if index in self._applied:
+                self._applied[index] = self._shift(self._applied[index], dx, dy)
+
+    @staticmethod
+    def _shift(coords, dx, dy):
+        return tuple(value + (dx if i % 2 == 0 else dy) for i, value in enumerate(coords))
+
+    def start(self):
+        self.stop()
+        self._started_at = time.monotonic()
+        self._applied.clear()
+        self._tick()
+
+    def stop(self):
+        if self._after_id is not None:
+            try:
+                self.root.after_cancel(self._after_id)
+            except Exception:
+                pass
+            self._after_id = None
+
+    def _tick(self):
+        self._after_id = None
+        if not self.canvas.winfo_exists():
+            return
+        if self.is_active is not None and not self.is_active():
+            # 見えていない間は何も描画せず、再開できるかだけを時々確認する
+            self.paused = True
+            self.stats["paused_checks"] += 1
+            self._after_id = self.root.after(self.idle_check_ms, self._tick)
+            return
+        self.paused = False
+
+        elapsed = time.monotonic() - self._started_at
+        frame = int(elapsed * 1000 / self.frame_ms)
+        self.stats["ticks"] += 1
+        for index, (item, option, frames) in enumerate(self._tracks):
+            value = frames[frame % len(frames)]
+            if self._applied.get(index) == value:
+                self.stats["skipped"] += 1
+                continue
+            if option is None:
+                self.canvas.coords(item, *value)
+            else:
+                self.canvas.itemconfig(item, **{option: value})
+            self._applied[index] = value
+            self.stats["updates"] += 1
+
+        interval = self.frame_ms if elapsed < self.fast_seconds else self.slow_interval_ms
+        self._after_id = self.root.after(interval, self._tick)
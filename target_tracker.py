@@ -0,0 +1,233 @@
+"""
+Target Tracker Module
+強調表示した対象を画面上で追いかけるローカルのトラッカー
+
+- 分析に使ったスクリーンショットから強調表示中の領域を切り出してテンプレートにする
+- 一定間隔で対象の周辺（ROI）だけをキャプチャし、縮小してから cv2 のテンプレートマッチングで探す
+- 見つかった位置が動いていれば、その分だけガイドを移動する（スクロールやウィンドウの移動に追従）
+- 見つからない間は探す範囲を広げ、続けて見つからなければ見失ったとして通知する
+"""
+
+import threading
+import time
+
+import cv2
+import numpy as np
+from PIL import Image, ImageGrab
+
+
+class TargetTracker:
+    """
+    強調表示中の領域をテンプレートマッチングで追跡する（バックグラウンドスレッドで動作）
+    """
+
+    def __init__(self, on_move, on_lost=None, is_alive=None, interval=0.5, scale=0.5,
+                 search_margin=160, match_threshold=0.75, max_misses=4, timeout=180.0):
+        """
+        Args:
+            on_move: 対象が動いたときに (dx, dy)（論理ピクセル）を渡して呼ばれる
+            on_lost: 対象を見失ったときに呼ばれる
+            is_alive: 追跡を続けるかを返す呼び出し可能オブジェクト（ガイドが消えたら False）
+            interval: キャプチャの間隔（秒）
+            scale: マッチングに使う縮小率（キャプチャの物理ピクセルに対する倍率）
+            search_margin: 対象の周囲を探す幅（論理ピクセル）。見つからないたびに2倍に広げる
+            match_threshold: 一致とみなす相関値（TM_CCOEFF_NORMED）
+            max_misses: この回数続けて見つからなければ見失ったとみなす
+            timeout: 追跡を続ける最長の秒数（ガイドの自動消滅と同じ）
+        """
+        self.on_move = on_move
+        self.on_lost = on_lost
+        self.is_alive = is_alive
+        self.interval = interval
+        self.scale = scale
+        self.search_margin = search_margin
+        self.match_threshold = match_threshold
+        self.max_misses = max_misses
+        self.timeout = timeout
+
+        self._targets = []
+        self._ratio = 1.0 # 物理ピクセル / 論理ピクセル
+        self._capture_size = None
+        self._offset = [0.0, 0.0] # 追跡開始からの移動量（物理ピクセル）
+        self._reported = [0, 0] # on_move で通知済みの移動量（論理ピクセル）
+        self._misses = 0
+        self._stop_event = threading.Event()
+        self._thread = None
+        self.stats = {"checks": 0, "matches": 0, "unchanged": 0, "moves": 0, "misses": 0}
+
+    def start(self, frame_path, regions, screen_size):
+        """
+        追跡を開始する
+
+        Args:
+            frame_path: 分析に使ったスクリーンショット（対象が写っている画面）
+            regions: 強調表示中の領域 {"x", "y", "width", "height"} のリスト（論理ピクセル）
+            screen_size: Tk の画面サイズ (width, height)（論理ピクセル）
+
+        Returns:
+            bool: 追跡を開始したか（テンプレートにできる領域がなければ False）
+        """
+        self.stop()
+        try:
+            with Image.open(frame_path) as img:
+                frame = np.array(img.convert("L"))
+        except Exception as e:
+            print(f"Tracker frame load error: {e}")
+            return False
+
+        cap_h, cap_w = frame.shape
+        self._capture_size = (cap_w, cap_h)
+        self._ratio = cap_w / float(screen_size[0])
+        self._targets = []
+        for region in regions:
+            target = self._make_target(frame, region)
+            if target is not None:
+                self._targets.append(target)
+        if not self._targets:
+            return False
+
+        self._offset = [0.0, 0.0]
+        self._reported = [0, 0]
+        self._misses = 0
+        self._stop_event = threading.Event()
+        self._thread = threading.Thread(target=self._loop, args=(self._stop_event,), daemon=True)
+        self._thread.start()
+        return True
+
+    def stop(self):
+        self._stop_event.set()
+        self._thread = None
+
+    def _make_target(self, frame, region):
+        """領域をキャプチャ座標に変換し、縮小したテンプレートを切り出す"""
+        cap_w, cap_h = self._capture_size
+        left = max(0, int(region["x"] * self._ratio))
+        top = max(0, int(region["y"] * self._ratio))
+        right = min(cap_w, int((region["x"] + region["width"]) * self._ratio))
+        bottom = min(cap_h, int((region["y"] + region["height"]) * self._ratio))
+
+        template = self._shrink(frame[top:bottom, left:right])
+        # 小さすぎる・模様のない領域は、どこにでも一致してしまうので追跡しない
+        if template is None or min(template.shape) < 8 or float(template.std()) < 5.0:
+            return None
+        return {"box": (left, top, right, bottom), "template": template, "last_roi": None}
+
+    def _shrink(self, gray):
+        height, width = gray.shape[:2]
+        size = (int(width * self.scale), int(height * self.scale))
+        if size[0] < 1 or size[1] < 1:
+            return None
+        return cv2.resize(gray, size, interpolation=cv2.INTER_AREA)
+
+    def _loop(self, stop_event):
+        started_at = time.monotonic()
+        while not stop_event.wait(self.interval):
+            if time.monotonic() - started_at > self.timeout:
+                break
+            if self.is_alive is not None and not self.is_alive():
+                break
+            try:
+                found = self._check()
+            except Exception as e:
+                print(f"Tracker error: {e}")
+                break
+            if stop_event.is_set():
+                break
+
+            if found:
+                self._misses = 0
+                continue
+            self._misses += 1
+            self.stats["misses"] += 1
+            if self._misses >= self.max_misses:
+                print("Tracker: target lost")
+                if self.on_lost:
+                    self.on_lost()
+                break
+
+    def _check(self):
+        """
+        各対象を現在の画面で探し、見つかった移動量の中央値だけガイドを動かす
+
+        Returns:
+            bool: いずれかの対象が見つかったか
+        """
+        self.stats["checks"] += 1
+        # 見つからないたびに探す範囲を広げる（大きくスクロールされた場合など）
+        margin = int(self.search_margin * self._ratio * (2 ** self._misses))
+        shifts = []
+        for target in self._targets:
+            shift = self._locate(target, margin)
+            if shift is not None:
+                shifts.append(shift)
+        if not shifts:
+            return False
+
+        dx = float(np.median([s[0] for s in shifts]))
+        dy = float(np.median([s[1] for s in shifts]))
+        if dx or dy:
+            for target in self._targets:
+                left, top, right, bottom = target["box"]
+                target["box"] = (left + dx, top + dy, right + dx, bottom + dy)
+                target["last_roi"] = None
+            self._offset[0] += dx
+            self._offset[1] += dy
+            self._report_move()
+        return True
+
+    def _locate(self, target, margin):
+        """
+        対象の周辺をキャプチャしてテンプレートを探す
+
+        Returns:
+            (dx, dy): 前回の位置からの移動量（物理ピクセル）。見つからなければ None
+        """
+        cap_w, cap_h = self._capture_size
+        left, top, right, bottom = target["box"]
+        roi = (
+            max(0, int(left - margin)),
+            max(0, int(top - margin)),
+            min(cap_w, int(right + margin)),
+            min(cap_h, int(bottom + margin)),
+        )
+        if roi[2] <= roi[0] or roi[3] <= roi[1]:
+            return None
+
+        roi_image = self._shrink(np.array(ImageGrab.grab(bbox=roi).convert("L")))
+        if roi_image is None:
+            return None
+
+        # 前回見つけたときと同じ範囲がほとんど変わっていなければ、マッチングせずにそのままとする
+        last = target["last_roi"]
+        target["last_roi"] = None
+        if last is not None and last[0] == roi and last[1].shape == roi_image.shape:
+            if np.mean(np.abs(last[1].astype(int) - roi_image.astype(int))) < 1.0:
+                target["last_roi"] = last
+                self.stats["unchanged"] += 1
+                return (0.0, 0.0)
+
+        template = target["template"]
+        if roi_image.shape[0] < template.shape[0] or roi_image.shape[1] < template.shape[1]:
+            return None
+        result = cv2.matchTemplate(roi_image, template, cv2.TM_CCOEFF_NORMED)
+        _, max_val, _, max_loc = cv2.minMaxLoc(result)
+        if max_val < self.match_threshold:
+            return None
+
+        self.stats["matches"] += 1
+        target["last_roi"] = (roi, roi_image)
+        found_left = roi[0] + max_loc[0] / self.scale
+        found_top = roi[1] + max_loc[1] / self.scale
+        return (found_left - left, found_top - top)
+
+    def _report_move(self):
+        """累積の移動量を論理ピクセルに直し、通知済みの分との差を通知する（2px 未満の揺れは無視）"""
+        total_x = int(round(self._offset[0] / self._ratio))
+        total_y = int(round(self._offset[1] / self._ratio))
+        dx = total_x - self._reported[0]
+        dy = total_y - self._reported[1]
+        if abs(dx) < 2 and abs(dy) < 2:
+            return
+        self._reported = [total_x, total_y]
+        self.stats["moves"] += 1
+        self.on_move(dx, dy)
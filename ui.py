@@ -7,26 +7,72 @@ import tkinter as tk
 from tkinter import font
 import customtkinter as ctk
 import threading
+import functools
+import itertools
 import os
+import time
+from collections import deque
 import shutil
 from PIL import Image
+from history import MessageArchive
+from overlay_animation import OverlayAnimator, triangle_wave, window_at_point
+from ui_dispatch import UIDispatcher
 
 # CustomTkinterの設定
 ctk.set_appearance_mode("System")  # Modes: "System" (standard), "Dark", "Light"
 ctk.set_default_color_theme("blue")  # Themes: "blue" (standard), "green", "dark-blue"
 
+# ストリーミング中の回答を履歴に反映する最短間隔（約30fps）
+STREAM_FLUSH_INTERVAL_MS = 33
+
+# 履歴ペインに表示しておくメッセージ数の上限（溢れた分はディスクに書き出す）
+HISTORY_MAX_MESSAGES = int(os.environ.get("SENP_AI_UI_MAX_MESSAGES", "200"))
+# 過去のメッセージを読み戻すときの1ページの件数と、同時に表示する上限
+HISTORY_PAGE_SIZE = 20
+HISTORY_MAX_PAGED = 100
+
+# ガイドのアニメーションの色（点滅）
+GUIDE_COLOR = "#E04F5F"
+GUIDE_BLINK_COLOR = "#FF8080"
+# ガイド用オーバーレイの透明色（この色の部分は表示されず、クリックも下のウィンドウに届く）
+OVERLAY_TRANSPARENT_COLOR = "#000001"
+
+
+def ui_thread(key=None, wait=False):
+    """
+    ワーカースレッドから呼ばれた場合に、メソッドを Tk のスレッドで実行させるデコレーター
+
+    Args:
+        key: 未実行の同じキーの呼び出しを最新の内容で置き換える（ステータス表示など）
+        wait: Tk のスレッドで実行されるまで待って結果を返す
+    """
+    def decorator(method):
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            dispatcher = getattr(self, "dispatcher", None)
+            if dispatcher is None or dispatcher.in_ui_thread():
+                return method(self, *args, **kwargs)
+            if wait:
+                return dispatcher.call(method, (self, *args), kwargs)
+            dispatcher.post(method, (self, *args), kwargs, key=key)
+        return wrapper
+    return decorator
+
+
 class SettingsWindow(ctk.CTkToplevel):
     def __init__(self, parent, available_models, current_model, tts_enabled, 
-                 on_update_settings, on_model_change, on_tts_toggle):
+                 on_update_settings, on_model_change, on_tts_toggle,
+                 available_latency_modes=None, current_latency_mode=None, on_latency_mode_change=None):
         super().__init__(parent)
         self.title("設定")
-        self.geometry("400x450") # Height reduced
+        self.geometry("400x520")
         self.resizable(False, False)
         
         self.parent = parent
         self.on_update_settings = on_update_settings
         self.on_model_change = on_model_change
         self.on_tts_toggle = on_tts_toggle
+        self.on_latency_mode_change = on_latency_mode_change
         
         # Keep window on top transiently or just normal
         self.transient(parent)
@@ -44,6 +90,10 @@ class SettingsWindow(ctk.CTkToplevel):
         current_model_name = next((name for id, name in available_models if id == current_model), available_models[0][1])
         self.var_model = tk.StringVar(value=current_model_name)
         
+        self.latency_modes_dict = {name: id for id, name in (available_latency_modes or [])}
+        current_mode_name = next((name for id, name in (available_latency_modes or []) if id == current_latency_mode), "")
+        self.var_latency_mode = tk.StringVar(value=current_mode_name)
+        
         self._create_widgets()
         
     def _create_widgets(self):
@@ -111,9 +161,18 @@ class SettingsWindow(ctk.CTkToplevel):
                                             command=self._on_model_select)
         self.option_model.grid(row=1, column=0, padx=10, pady=(5,15), sticky="ew")
         
+        # Latency mode (thinking / answer length)
+        if self.latency_modes_dict:
+            lbl_mode = ctk.CTkLabel(ai_frame, text="回答モード:", anchor="w")
+            lbl_mode.grid(row=2, column=0, padx=10, pady=(10,0), sticky="ew")
+            self.option_latency_mode = ctk.CTkOptionMenu(ai_frame, values=list(self.latency_modes_dict.keys()),
+                                                       variable=self.var_latency_mode,
+                                                       command=self._on_latency_mode_select)
+            self.option_latency_mode.grid(row=3, column=0, padx=10, pady=(5,15), sticky="ew")
+        
         # TTS
         self.switch_tts = ctk.CTkSwitch(ai_frame, text="音声読み上げ (TTS)", variable=self.var_tts, command=self._on_tts_switch)
-        self.switch_tts.grid(row=2, column=0, padx=10, pady=(15,10), sticky="w")
+        self.switch_tts.grid(row=4, column=0, padx=10, pady=(15,10), sticky="w")
         
 
 
@@ -135,12 +194,18 @@ class SettingsWindow(ctk.CTkToplevel):
         if model_id:
             self.on_model_change(model_id)
             
+    def _on_latency_mode_select(self, choice):
+        mode = self.latency_modes_dict.get(choice)
+        if mode and self.on_latency_mode_change:
+            self.on_latency_mode_change(mode)
+            
     def _on_tts_switch(self):
         self.on_tts_toggle(self.var_tts.get())
 
 class SENPAI_UI:
     def __init__(self, available_models, on_question_callback, 
-                 on_voice_input_callback, on_tts_toggle_callback, on_model_change_callback):
+                 on_voice_input_callback, on_tts_toggle_callback, on_model_change_callback,
+                 available_latency_modes=None, on_latency_mode_change_callback=None):
         """
         UIの初期化
         """
@@ -149,6 +214,8 @@ class SENPAI_UI:
         self.on_voice_input = on_voice_input_callback
         self.on_tts_toggle = on_tts_toggle_callback
         self.on_model_change = on_model_change_callback
+        self.available_latency_modes = available_latency_modes or []
+        self.on_latency_mode_change = on_latency_mode_change_callback
         
         # メインウィンドウの設定
         self.root = ctk.CTk()
@@ -157,6 +224,9 @@ class SENPAI_UI:
         # 画面サイズを取得して30%のサイズを計算
         screen_width = self.root.winfo_screenwidth()
         screen_height = self.root.winfo_screenheight()
+        # ワーカースレッドから座標変換に使うので、Tk を呼ばずに読めるように保持しておく
+        self.screen_width = screen_width
+        self.screen_height = screen_height
         
         window_width = int(screen_width * 0.25)
         window_height = int(screen_height * 0.35)
@@ -174,10 +244,35 @@ class SENPAI_UI:
         self.tts_enabled = tk.BooleanVar(value=False)
         # コンボボックス用の変数は文字列そのものを保持
         self.selected_model_id = available_models[0][0] 
+        self.selected_latency_mode = "balanced"
         self.is_recording = False
         
         self.history_font_size = 14 # Default font size
         
+        # ストリーミング表示（受け取ったテキストを溜めて、一定間隔でまとめて描画する）
+        self._stream_lock = threading.Lock()
+        self._stream_buffer = []
+        self._stream_flush_pending = False
+        self._stream_active = False
+        self._stream_record = None
+        self._stream_tag = "assistant"
+        self._stream_last_flush = 0.0
+        self.stream_stats = {"chars": 0, "flushes": 0}
+        
+        # 履歴ペインに表示中のメッセージ（古い順、各メッセージの先頭にマークを置く）と、溢れた分のアーカイブ
+        self._live_messages = deque()
+        self._message_seq = itertools.count()
+        self.message_archive = MessageArchive()
+        self._paged_range = None # 読み戻して表示中のアーカイブの範囲 (start, end)
+        self._search_state = None
+        
+        # ガイド（矢印・強調枠）は全画面のオーバーレイ1枚に描き、ガイドごとにキャンバスのタグで区別する
+        self.overlay_window = None
+        self.guide_canvas = None
+        self._guides = {}
+        self._guide_seq = itertools.count(1)
+        self.highlight_latencies = deque(maxlen=100) # 回答の受信からガイドが表示されるまでの時間（ミリ秒）
+        
         # 歯車アイコン読み込み
         self.gear_image = None
         current_dir = os.path.dirname(os.path.abspath(__file__))
@@ -206,6 +301,10 @@ class SENPAI_UI:
         
         self._create_widgets()
         
+        # ワーカースレッドからの UI 操作は、このキューを経由して Tk のスレッドで実行する
+        self.dispatcher = UIDispatcher(self.root)
+        self.dispatcher.start()
+        
     def _create_widgets(self):
         """モダンなウィジェットの作成"""
         
@@ -251,7 +350,35 @@ class SENPAI_UI:
         self.history_frame = ctk.CTkFrame(self.root, corner_radius=10)
         self.history_frame.grid(row=1, column=0, sticky="nsew", padx=20, pady=5)
         self.history_frame.grid_columnconfigure(0, weight=1)
-        self.history_frame.grid_rowconfigure(0, weight=1)
+        self.history_frame.grid_rowconfigure(1, weight=1)
+        
+        # 履歴ツールバー（過去のメッセージの読み戻し・検索）
+        history_toolbar = ctk.CTkFrame(self.history_frame, fg_color="transparent")
+        history_toolbar.grid(row=0, column=0, columnspan=2, sticky="ew", padx=6, pady=(6, 0))
+        history_toolbar.grid_columnconfigure(1, weight=1)
+        
+        self.older_btn = ctk.CTkButton(
+            history_toolbar,
+            text="▲ 過去のメッセージ",
+            width=120,
+            height=24,
+            font=("Yu Gothic UI", 11),
+            fg_color="transparent",
+            hover_color=("gray75", "gray25"),
+            text_color=("black", "white"),
+            state="disabled",
+            command=self._load_older_messages
+        )
+        self.older_btn.grid(row=0, column=0, sticky="w")
+        
+        self.history_search_entry = ctk.CTkEntry(
+            history_toolbar,
+            placeholder_text="履歴を検索 (Enterで次へ)",
+            height=24,
+            font=("Yu Gothic UI", 11)
+        )
+        self.history_search_entry.grid(row=0, column=1, sticky="ew", padx=(10, 0))
+        self.history_search_entry.bind("<Return>", self._on_history_search)
         
         self.history_text = tk.Text(
             self.history_frame,
@@ -265,11 +392,11 @@ class SENPAI_UI:
             pady=10,
             state=tk.DISABLED
         )
-        self.history_text.grid(row=0, column=0, sticky="nsew", padx=2, pady=2)
+        self.history_text.grid(row=1, column=0, sticky="nsew", padx=2, pady=2)
         
         # スクロールバー
         scrollbar = ctk.CTkScrollbar(self.history_frame, command=self.history_text.yview)
-        scrollbar.grid(row=0, column=1, sticky="ns")
+        scrollbar.grid(row=1, column=1, sticky="ns")
         self.history_text.configure(yscrollcommand=scrollbar.set)
         
         # テキストタグ設定
@@ -356,7 +483,10 @@ class SENPAI_UI:
             self.tts_enabled.get(),
             self._handle_setting_update,
             self.on_model_change,
-            self.on_tts_toggle
+            self.on_tts_toggle,
+            available_latency_modes=self.available_latency_modes,
+            current_latency_mode=self.selected_latency_mode,
+            on_latency_mode_change=self._on_latency_mode_change
         )
         
     def _handle_setting_update(self, key, value):
@@ -391,6 +521,7 @@ class SENPAI_UI:
         self.history_text.tag_config("timestamp", foreground="gray", font=("Yu Gothic UI", small_size))
         self.history_text.tag_config("model", foreground="gray", font=("Yu Gothic UI", small_size, "italic"))
         self.history_text.tag_config("error", foreground="#E04F5F", font=("Yu Gothic UI", base_size))
+        self.history_text.tag_config("search_hit", background="#F2C94C", foreground="black")
 
     def _on_tts_toggle(self, enabled): # Update signature to match usage
         self.tts_enabled.set(enabled)
@@ -405,26 +536,231 @@ class SENPAI_UI:
             model_name = next((name for id, name in self.available_models if id == model_id), model_id)
             self.settings_window.var_model.set(model_name)
 
+    def _on_latency_mode_change(self, mode):
+        self.selected_latency_mode = mode
+        if self.on_latency_mode_change:
+            self.on_latency_mode_change(mode)
+
+    @staticmethod
+    def _message_segments(role, message, timestamp=None, model=None):
+        """1件のメッセージを Text.insert に渡す (テキスト, タグ) の並びにする"""
+        segments = []
+        if timestamp:
+            segments += [f"[{timestamp}] ", "timestamp"]
+        if role == "user":
+            segments += ["あなた: ", "user"]
+        else:
+            segments += ["SENP_AI: ", "assistant"]
+        segments += [f"{message}", role if role != "assistant" else "assistant"]
+        if role == "assistant" and model:
+            segments += [f" ({model})", "model"]
+        segments += ["\n\n", ()]
+        return segments
+
+    def _start_message(self, role, message, timestamp=None, model=None):
+        """表示中のメッセージとして登録し、先頭位置にマークを置く"""
+        record = {"role": role, "message": message, "timestamp": timestamp, "model": model,
+                  "mark": f"msg_{next(self._message_seq)}"}
+        self.history_text.mark_set(record["mark"], "end-1c")
+        self.history_text.mark_gravity(record["mark"], tk.LEFT)
+        self._live_messages.append(record)
+        return record
+
+    @ui_thread()
     def add_message(self, role, message, timestamp=None, model=None):
         self.history_text.config(state=tk.NORMAL)
+        self._start_message(role, message, timestamp, model)
+        self.history_text.insert(tk.END, *self._message_segments(role, message, timestamp, model))
+        self._trim_history()
+        self.history_text.see(tk.END)
+        self.history_text.config(state=tk.DISABLED)
+
+    def _trim_history(self):
+        """表示中のメッセージが上限を超えたら、古いものから削除してアーカイブに書き出す"""
+        while len(self._live_messages) > HISTORY_MAX_MESSAGES:
+            oldest = self._live_messages.popleft()
+            if self._stream_active and oldest is self._stream_record:
+                self._live_messages.appendleft(oldest)
+                break
+            self.history_text.delete(oldest["mark"], self._live_messages[0]["mark"])
+            self.history_text.mark_unset(oldest["mark"])
+            self.message_archive.append({key: oldest[key] for key in ("role", "message", "timestamp", "model")})
+        self._update_older_button()
+
+    def _update_older_button(self):
+        has_older = len(self.message_archive) > 0 and (self._paged_range is None or self._paged_range[0] > 0)
+        self.older_btn.configure(state="normal" if has_older else "disabled")
+
+    def _render_page(self, start, end):
+        """アーカイブの start〜end 番目を、表示中のメッセージの上に表示する（以前に読み戻した分は置き換える）"""
+        if not self._live_messages:
+            return
+        total = len(self.message_archive)
+        records = self.message_archive.page(start, end)
+        boundary = self._live_messages[0]["mark"]
         
-        if timestamp:
-            self.history_text.insert(tk.END, f"[{timestamp}] ", "timestamp")
+        segments = [f"── 過去のメッセージ {start + 1}〜{end} / {total}件 ──\n\n", "timestamp"]
+        for record in records:
+            segments += self._message_segments(record["role"], record["message"], record.get("timestamp"), record.get("model"))
+        if end < total:
+            segments += [f"── {total - end}件省略 ──\n\n", "timestamp"]
         
-        if role == "user":
-            self.history_text.insert(tk.END, "あなた: ", "user")
+        self.history_text.config(state=tk.NORMAL)
+        self.history_text.delete("1.0", boundary)
+        # 先頭に挿入した分の後ろに表示中のメッセージの境界が来るように、一時的に右寄りにする
+        self.history_text.mark_gravity(boundary, tk.RIGHT)
+        self.history_text.insert("1.0", *segments)
+        self.history_text.mark_gravity(boundary, tk.LEFT)
+        self.history_text.config(state=tk.DISABLED)
+        
+        self._paged_range = (start, end)
+        self._update_older_button()
+
+    def _load_older_messages(self):
+        """アーカイブから1ページ分さかのぼって読み戻す"""
+        total = len(self.message_archive)
+        if total == 0:
+            return
+        if self._paged_range is None:
+            start, end = max(0, total - HISTORY_PAGE_SIZE), total
         else:
-            self.history_text.insert(tk.END, "SENP_AI: ", "assistant")
-            
-        self.history_text.insert(tk.END, f"{message}", role if role != "assistant" else "assistant")
+            start = max(0, self._paged_range[0] - HISTORY_PAGE_SIZE)
+            end = min(self._paged_range[1], start + HISTORY_MAX_PAGED)
+        self._render_page(start, end)
+        self.history_text.see("1.0")
+
+    def _on_history_search(self, event=None):
+        """履歴を新しい方から検索（同じ語で Enter を押すたびに1つ前の一致へ、表示外はアーカイブから読み戻す）"""
+        query = self.history_search_entry.get().strip()
+        self.history_text.tag_remove("search_hit", "1.0", tk.END)
+        if not query:
+            self._search_state = None
+            return
+        if self._search_state is None or self._search_state["query"] != query:
+            self._search_state = {"query": query, "cursor": tk.END}
+        
+        hit = self.history_text.search(query, self._search_state["cursor"], stopindex="1.0", backwards=True, nocase=True)
+        if not hit:
+            before = self._paged_range[0] if self._paged_range else len(self.message_archive)
+            index = self.message_archive.search(query, before=before)
+            if index is None or not self._live_messages:
+                self.set_status(f"「{query}」はこれ以上見つかりません", "gray")
+                self._search_state["cursor"] = tk.END # 次は最新から探し直す
+                return
+            start = max(0, index - HISTORY_PAGE_SIZE // 2)
+            self._render_page(start, min(before, index + HISTORY_PAGE_SIZE // 2 + 1))
+            hit = self.history_text.search(query, self._live_messages[0]["mark"], stopindex="1.0", backwards=True, nocase=True)
+            if not hit:
+                return
+        
+        self.history_text.tag_add("search_hit", hit, f"{hit}+{len(query)}c")
+        self.history_text.see(hit)
+        self._search_state["cursor"] = hit
+
+    @ui_thread()
+    def begin_stream(self, role="assistant", timestamp=None):
+        """
+        ストリーミングで届く回答の表示を開始する（以降 append_stream で本文を追記し、end_stream で閉じる）
+        """
+        if self._stream_active:
+            self.end_stream()
         
-        if role == "assistant" and model:
-            self.history_text.insert(tk.END, f" ({model})", "model")
-            
+        at_bottom = self._is_history_at_bottom()
+        self.history_text.config(state=tk.NORMAL)
+        self._stream_record = self._start_message(role, "", timestamp)
+        if timestamp:
+            self.history_text.insert(tk.END, f"[{timestamp}] ", "timestamp")
+        self.history_text.insert(tk.END, "あなた: " if role == "user" else "SENP_AI: ", "user" if role == "user" else "assistant")
         self.history_text.insert(tk.END, "\n\n")
-        self.history_text.see(tk.END)
+        # 本文の挿入位置（末尾の空行の手前）。右寄りのマークなので、挿入した本文の後ろに付いていく
+        self.history_text.mark_set("stream_end", "end-3c")
+        self.history_text.mark_gravity("stream_end", tk.RIGHT)
+        # 本文の先頭（アーカイブに書き出すときに本文を取り出す）
+        self.history_text.mark_set("stream_body", "stream_end")
+        self.history_text.mark_gravity("stream_body", tk.LEFT)
+        self._trim_history()
+        self.history_text.config(state=tk.DISABLED)
+        if at_bottom:
+            self.history_text.see(tk.END)
+        
+        self._stream_tag = "user" if role == "user" else "assistant"
+        self._stream_active = True
+        # 開始より先に届いていたテキストを反映する
+        with self._stream_lock:
+            schedule = bool(self._stream_buffer) and not self._stream_flush_pending
+            if schedule:
+                self._stream_flush_pending = True
+        if schedule:
+            self._schedule_stream_flush()
+
+    def append_stream(self, text):
+        """
+        ストリーミング中の回答にテキストを追記する（どのスレッドから呼んでもよい）
+        テキストはバッファに溜め、STREAM_FLUSH_INTERVAL_MS ごとに1回だけウィジェットに反映する
+        """
+        if not text:
+            return
+        with self._stream_lock:
+            self._stream_buffer.append(text)
+            if self._stream_flush_pending:
+                return
+            self._stream_flush_pending = True
+        if self.dispatcher.in_ui_thread():
+            self._schedule_stream_flush()
+        else:
+            self.dispatcher.post(self._schedule_stream_flush)
+
+    @ui_thread()
+    def end_stream(self, model=None):
+        """ストリーミング表示を終える（残りのバッファを反映し、モデル名を添える）"""
+        if not self._stream_active:
+            return
+        self._flush_stream()
+        self._stream_record["message"] = self.history_text.get("stream_body", "stream_end")
+        self._stream_record["model"] = model
+        if model:
+            at_bottom = self._is_history_at_bottom()
+            self.history_text.config(state=tk.NORMAL)
+            self.history_text.insert("stream_end", f" ({model})", "model")
+            self.history_text.config(state=tk.DISABLED)
+            if at_bottom:
+                self.history_text.see(tk.END)
+        self.history_text.mark_unset("stream_end", "stream_body")
+        self._stream_active = False
+        self._stream_record = None
+
+    def _schedule_stream_flush(self):
+        elapsed_ms = (time.monotonic() - self._stream_last_flush) * 1000
+        self.root.after(max(0, int(STREAM_FLUSH_INTERVAL_MS - elapsed_ms)), self._flush_stream)
+
+    def _flush_stream(self):
+        """溜まったテキストをまとめて1回で挿入（Tk のスレッドで実行）"""
+        with self._stream_lock:
+            self._stream_flush_pending = False
+            if not self._stream_active:
+                # 表示中のストリームがない（begin_stream より先に届いた）: 捨てずに、開始されるまでバッファに残す
+                return
+            text = "".join(self._stream_buffer)
+            self._stream_buffer.clear()
+        if not text:
+            return
+        
+        # 過去の履歴を読んでいる（最下部にいない）ときはスクロール位置を動かさない
+        at_bottom = self._is_history_at_bottom()
+        self.history_text.config(state=tk.NORMAL)
+        self.history_text.insert("stream_end", text, self._stream_tag)
         self.history_text.config(state=tk.DISABLED)
+        if at_bottom:
+            self.history_text.see(tk.END)
+        
+        self._stream_last_flush = time.monotonic()
+        self.stream_stats["chars"] += len(text)
+        self.stream_stats["flushes"] += 1
 
+    def _is_history_at_bottom(self):
+        return self.history_text.yview()[1] >= 0.999
+
+    @ui_thread(key="status")
     def set_status(self, message, color="gray"):
         # CustomTkinterは色名ではなくHEX推奨だが、tkinterの色名も大体通る
         # color引数が "red" などの場合、モダンな色に置き換える
@@ -437,6 +773,7 @@ class SENPAI_UI:
         actual_color = color_map.get(color, color)
         self.status_label.configure(text=message, text_color=actual_color)
 
+    @ui_thread(key="input_text")
     def set_input_text(self, text):
         self.input_entry.delete(0, tk.END)
         self.input_entry.insert(0, text)
@@ -445,12 +782,17 @@ class SENPAI_UI:
         self.root.mainloop()
 
     def close(self):
+        self.dispatcher.stop()
         self.root.quit()
         self.root.destroy()
         
+    @ui_thread(wait=True)
     def hide_window(self):
         self.root.withdraw()
+        # 呼び出し元はこの後すぐにスクリーンショットを撮るので、非表示を画面に反映させてから戻る
+        self.root.update_idletasks()
 
+    @ui_thread(wait=True)
     def show_window(self):
         self.root.deiconify()
 
@@ -462,206 +804,269 @@ class SENPAI_UI:
         # 今回はオーバーレイ版を優先するため、呼び出し側で使い分ける。
         pass
 
-    def show_global_arrow(self, x, y):
+    @ui_thread()
+    def show_global_arrow(self, x, y, replace=True, requested_at=None):
         """
-        画面上の指定座標(x, y)に赤い矢印を表示する（透明ウィンドウを使用）
+        画面上の指定座標(x, y)に赤い矢印を表示する（共通の透明オーバーレイに描画）
+
+        Args:
+            replace: True なら表示中のガイドを消してから表示する（False なら追加で表示する）
+            requested_at: 回答を受け取った時刻（time.perf_counter()）。指定すると表示までの時間を記録する
         """
-        # 既存のガイドがあれば消す
-        self.hide_visual_guide()
-        
-        # オーバーレイウィンドウ作成
-        self.overlay_window = tk.Toplevel(self.root)
-        
-        # ウィンドウ装飾なし
-        self.overlay_window.overrideredirect(True)
-        self.overlay_window.attributes("-topmost", True)
-        
-        # 透明化設定
-        transparent_color = "#000001"
-        self.overlay_window.attributes("-transparentcolor", transparent_color)
-        self.overlay_window.config(bg=transparent_color)
+        guide_id, tag, canvas = self._begin_guide(replace)
         
         # 矢印サイズ
         arrow_w = 40
         arrow_h = 60
-        canvas_w = arrow_w
-        canvas_h = arrow_h + 20
-        
-        base_wx = int(x - (canvas_w / 2))
-        base_wy = int(y - canvas_h)
-        
-        self.overlay_window.geometry(f"{canvas_w}x{canvas_h}+{base_wx}+{base_wy}")
-        
-        self.guide_canvas = tk.Canvas(
-            self.overlay_window,
-            width=canvas_w,
-            height=canvas_h,
-            bg=transparent_color,
-            highlightthickness=0,
-            bd=0
-        )
-        self.guide_canvas.pack()
-        
-        pointer_x = canvas_w / 2
-        pointer_y = arrow_h
-        
-        points = [
-            pointer_x, pointer_y,
-            0, pointer_y * 0.6,
-            canvas_w * 0.3, pointer_y * 0.6,
-            canvas_w * 0.3, 0,
-            canvas_w * 0.7, 0,
-            canvas_w * 0.7, pointer_y * 0.6,
-            canvas_w, pointer_y * 0.6
-        ]
-        
-        self.arrow_id = self.guide_canvas.create_polygon(points, fill="#E04F5F", outline="#C03F4F", width=2)
-        
-        # イベントバインド
-        self.overlay_window.bind("<Button-3>", self.hide_visual_guide)
-        self.guide_canvas.bind("<Button-3>", self.hide_visual_guide)
-        
-        self.arrow_anim_offset = 0
-        self.arrow_anim_direction = 1
-        self._animate_overlay_guide()
-        
-        # 自動消滅
-        self.guide_timeout = self.root.after(180000, self.hide_visual_guide)
+        base_x = x - (arrow_w / 2)
+        base_y = y - (arrow_h + 20)
+        
+        # 上下に揺れる矢印のキーフレーム（オフセットごとの座標）を最初に計算しておく
+        pointer_x = base_x + arrow_w / 2
+        frames = []
+        for offset in triangle_wave(10):
+            pointer_y = base_y + arrow_h + offset
+            shoulder_y = pointer_y - (arrow_h * 0.4)
+            frames.append((
+                pointer_x, pointer_y,
+                base_x, shoulder_y,
+                base_x + arrow_w * 0.3, shoulder_y,
+                base_x + arrow_w * 0.3, base_y + offset,
+                base_x + arrow_w * 0.7, base_y + offset,
+                base_x + arrow_w * 0.7, shoulder_y,
+                base_x + arrow_w, shoulder_y
+            ))
+        
+        arrow_id = canvas.create_polygon(frames[0], fill=GUIDE_COLOR, outline="#C03F4F", width=2, tags=tag)
+        
+        # 矢印の先端のすぐ下（透明部分）にある対象を見張る
+        animator = self._start_guide_animation(guide_id, tag, (x, y + 5))
+        animator.add_coords_track(arrow_id, frames)
+        self._present_guide(guide_id, requested_at)
+        return guide_id
 
+    @ui_thread()
     def show_target_highlight(self, x, y, width, height):
         """
         指定された領域(x, y, width, height)を強調表示（赤い枠）する
         """
-        self.hide_visual_guide()
+        self.show_target_highlights([{"x": x, "y": y, "width": width, "height": height}])
+
+    @ui_thread()
+    def show_target_highlights(self, regions, replace=True, requested_at=None, guide_id=None):
+        """
+        複数の領域を1つのガイドとしてまとめて強調表示（赤い枠）する
+        
+        Args:
+            regions: {"x", "y", "width", "height", "label"(任意)} のリスト
+            replace: True なら表示中のガイドを消してから表示する（False なら追加で表示する）
+            requested_at: 回答を受け取った時刻（time.perf_counter()）。指定すると表示までの時間を記録する
+            guide_id: new_guide_id() で払い出しておいた ID（ワーカースレッドから後で移動・削除する場合）
+        """
+        if replace:
+            self.hide_visual_guide()
+        if not regions:
+            return None
+        guide_id, tag, canvas = self._begin_guide(replace=False, guide_id=guide_id)
         
         padding = 10
-        win_x = x - padding
-        win_y = y - padding
-        win_w = width + padding * 2
-        win_h = height + padding * 2
+        c_len = 20
+        c_width = 6
+        for region in regions:
+            # 枠の外側に余白を取る（オーバーレイは全画面なので画面座標をそのまま使う）
+            left = region["x"] - padding
+            top = region["y"] - padding
+            right = region["x"] + region["width"] + padding
+            bottom = region["y"] + region["height"] + padding
+            
+            # 枠線（短形）の描画（点滅はガイドごとのタグ単位でまとめて更新する）
+            canvas.create_rectangle(
+                left, top, right, bottom,
+                outline=GUIDE_COLOR, width=4, tags=(tag, f"{tag}_rect")
+            )
+            
+            # コーナーの装飾（より「ターゲット」らしく）
+            corner_tags = (tag, f"{tag}_corner")
+            # Top-Left
+            canvas.create_line(left, top+c_len, left, top, left+c_len, top, fill=GUIDE_COLOR, width=c_width, tags=corner_tags)
+            # Top-Right
+            canvas.create_line(right-c_len, top, right, top, right, top+c_len, fill=GUIDE_COLOR, width=c_width, tags=corner_tags)
+            # Bottom-Left
+            canvas.create_line(left, bottom-c_len, left, bottom, left+c_len, bottom, fill=GUIDE_COLOR, width=c_width, tags=corner_tags)
+            # Bottom-Right
+            canvas.create_line(right-c_len, bottom, right, bottom, right, bottom-c_len, fill=GUIDE_COLOR, width=c_width, tags=corner_tags)
+            
+            # ラベル（複数の要素を区別できるように枠の左上に表示）
+            if region.get("label"):
+                text_id = canvas.create_text(
+                    left + 4, top - 4, text=region["label"], anchor="sw",
+                    fill="white", font=("Yu Gothic UI", 10, "bold"), tags=tag
+                )
+                bg_id = canvas.create_rectangle(canvas.bbox(text_id), fill="#E04F5F", outline="#E04F5F", width=3, tags=tag)
+                canvas.tag_lower(bg_id, text_id)
+        
+        # 点滅アニメーション（20フレーム中、前半は通常色・後半は明るい色）
+        blink = [GUIDE_COLOR] * 10 + [GUIDE_BLINK_COLOR] * 10
+        first = regions[0]
+        animator = self._start_guide_animation(guide_id, tag, (first["x"] + first["width"] / 2, first["y"] + first["height"] / 2))
+        animator.add_option_track(f"{tag}_rect", "outline", blink)
+        animator.add_option_track(f"{tag}_corner", "fill", blink)
+        self._present_guide(guide_id, requested_at)
+        return guide_id
+
+    def _ensure_overlay(self):
+        """
+        ガイドを描く全画面の透明オーバーレイのキャンバスを返す
+        最初に使うときに1度だけ作り、以降はガイドがなくなっても隠すだけで使い回す
+        （ウィンドウの作成・破棄はウィンドウマネージャとのやり取りがあり、表示までに目に見える遅れが出るため）
+        """
+        if self.overlay_window is not None and self.overlay_window.winfo_exists():
+            return self.guide_canvas
         
         self.overlay_window = tk.Toplevel(self.root)
+        self.overlay_window.withdraw()
+        
+        # ウィンドウ装飾なし
         self.overlay_window.overrideredirect(True)
         self.overlay_window.attributes("-topmost", True)
         
-        transparent_color = "#000001"
-        self.overlay_window.attributes("-transparentcolor", transparent_color)
-        self.overlay_window.config(bg=transparent_color)
-        
-        self.overlay_window.geometry(f"{win_w}x{win_h}+{win_x}+{win_y}")
+        # 透明化設定（透明色の部分はクリックも下のウィンドウに届く）
+        self.overlay_window.attributes("-transparentcolor", OVERLAY_TRANSPARENT_COLOR)
+        self.overlay_window.config(bg=OVERLAY_TRANSPARENT_COLOR)
+        self.overlay_window.geometry(f"{self.screen_width}x{self.screen_height}+0+0")
         
         self.guide_canvas = tk.Canvas(
             self.overlay_window,
-            width=win_w,
-            height=win_h,
-            bg=transparent_color,
+            width=self.screen_width,
+            height=self.screen_height,
+            bg=OVERLAY_TRANSPARENT_COLOR,
             highlightthickness=0,
             bd=0
         )
         self.guide_canvas.pack()
         
-        # 枠線（短形）の描画
-        # target_id として保存してアニメーションさせることも可能
-        self.rect_id = self.guide_canvas.create_rectangle(
-            padding, padding, padding + width, padding + height,
-            outline="#E04F5F", width=4
-        )
-        
-        # コーナーの装飾（より「ターゲット」らしく）
-        self.corners = []
-        c_len = 20
-        c_width = 6
-        # Top-Left
-        self.corners.append(self.guide_canvas.create_line(padding, padding+c_len, padding, padding, padding+c_len, padding, fill="#E04F5F", width=c_width))
-        # Top-Right
-        self.corners.append(self.guide_canvas.create_line(padding+width-c_len, padding, padding+width, padding, padding+width, padding+c_len, fill="#E04F5F", width=c_width))
-        # Bottom-Left
-        self.corners.append(self.guide_canvas.create_line(padding, padding+height-c_len, padding, padding+height, padding+c_len, padding+height, fill="#E04F5F", width=c_width))
-        # Bottom-Right
-        self.corners.append(self.guide_canvas.create_line(padding+width-c_len, padding+height, padding+width, padding+height, padding+width, padding+height-c_len, fill="#E04F5F", width=c_width))
-
-        # イベントバインド
-        self.overlay_window.bind("<Button-3>", self.hide_visual_guide)
-        self.guide_canvas.bind("<Button-3>", self.hide_visual_guide)
-        
-        # 点滅アニメーション
-        self.rect_anim_state = 0
-        self._animate_overlay_guide()
-        
-        self.guide_timeout = self.root.after(180000, self.hide_visual_guide)
-
-    def _animate_overlay_guide(self):
-        if not hasattr(self, 'overlay_window') or not self.overlay_window or not self.overlay_window.winfo_exists():
+        # イベントバインド（右クリックしたガイドだけを消す）
+        self.guide_canvas.bind("<Button-3>", self._on_guide_right_click)
+        return self.guide_canvas
+
+    def _begin_guide(self, replace, guide_id=None):
+        """新しいガイドの ID・キャンバスのタグ・描画先のキャンバスを用意する"""
+        if replace:
+            self.hide_visual_guide()
+        canvas = self._ensure_overlay()
+        if guide_id is None:
+            guide_id = self.new_guide_id()
+        return guide_id, f"guide_{guide_id}", canvas
+
+    def new_guide_id(self):
+        """ガイドの ID を払い出す（どのスレッドからでも呼べる）"""
+        return next(self._guide_seq)
+
+    def has_guide(self, guide_id):
+        """ガイドが表示中か（どのスレッドからでも呼べる）"""
+        return guide_id in self._guides
+
+    @ui_thread()
+    def move_guide(self, guide_id, dx, dy):
+        """表示中のガイドを (dx, dy) だけ移動する（指している対象がスクロールなどで動いたとき）"""
+        guide = self._guides.get(guide_id)
+        if guide is None:
             return
-            
-        # 矢印アニメーション
-        if hasattr(self, 'arrow_id'):
-            step = 1.0
-            limit = 10
-            self.arrow_anim_offset += step * self.arrow_anim_direction
-            
-            if self.arrow_anim_offset > limit: self.arrow_anim_direction = -1
-            elif self.arrow_anim_offset < 0: self.arrow_anim_direction = 1
-            
-            # 再描画
-            arrow_w = 40
-            arrow_h = 60
-            canvas_w = arrow_w
-            current_base_y = self.arrow_anim_offset
-            pointer_x = canvas_w / 2
-            pointer_y = arrow_h + current_base_y
-            
-            points = [
-                pointer_x, pointer_y,
-                0, pointer_y - (arrow_h * 0.4),
-                canvas_w * 0.3, pointer_y - (arrow_h * 0.4),
-                canvas_w * 0.3, current_base_y,
-                canvas_w * 0.7, current_base_y,
-                canvas_w * 0.7, pointer_y - (arrow_h * 0.4),
-                canvas_w, pointer_y - (arrow_h * 0.4)
-            ]
-            self.guide_canvas.coords(self.arrow_id, *points)
-
-        # 矩形アニメーション（点滅）
-        if hasattr(self, 'rect_id'):
-            self.rect_anim_state = (self.rect_anim_state + 1) % 20
-            # 5-15の間は表示, それ以外は少し明るい色にするか消す
-            if self.rect_anim_state < 10:
-                color = "#E04F5F"
-            else:
-                color = "#FF8080"
-            
-            self.guide_canvas.itemconfig(self.rect_id, outline=color)
-            for c in self.corners:
-                self.guide_canvas.itemconfig(c, fill=color)
+        self.guide_canvas.move(guide["tag"], dx, dy)
+        guide["animator"].translate(dx, dy)
+        x, y = guide["target_point"]
+        guide["target_point"] = (x + dx, y + dy)
+
+    def _start_guide_animation(self, guide_id, tag, target_point):
+        """
+        ガイドを登録してアニメーションを用意する（呼び出し元がキーフレームを追加してから _present_guide する）
         
-        self.guide_anim_id = self.root.after(50, self._animate_overlay_guide)
+        Args:
+            target_point: ガイドが指している画面上の点（対象が他のウィンドウに隠れたかの判定に使う）
+        """
+        guide = {
+            "tag": tag,
+            "target_point": target_point,
+            "target_window": window_at_point(*target_point),
+            "timeout": None,
+        }
+        guide["animator"] = OverlayAnimator(self.root, self.guide_canvas, is_active=lambda: self._guide_visible(guide))
+        self._guides[guide_id] = guide
+        return guide["animator"]
 
-    def hide_visual_guide(self, event=None):
-        """ガイドを消す（オーバーレイ削除）"""
-        if hasattr(self, 'guide_timeout') and self.guide_timeout:
-            self.root.after_cancel(self.guide_timeout)
-            self.guide_timeout = None
-            
-        if hasattr(self, 'guide_anim_id') and self.guide_anim_id:
-            self.root.after_cancel(self.guide_anim_id)
-            self.guide_anim_id = None
-            
-        if hasattr(self, 'guide_canvas') and self.guide_canvas:
-            try: self.guide_canvas.destroy()
-            except: pass
-            self.guide_canvas = None
-            
-        if hasattr(self, 'overlay_window') and self.overlay_window:
-            try: self.overlay_window.destroy()
+    def _present_guide(self, guide_id, requested_at=None):
+        """オーバーレイを表示してガイドのアニメーションを開始する"""
+        guide = self._guides[guide_id]
+        if self.overlay_window.state() == "withdrawn":
+            self.overlay_window.deiconify()
+        self.overlay_window.lift()
+        guide["animator"].start()
+        
+        # 自動消滅
+        guide["timeout"] = self.root.after(180000, lambda: self.hide_visual_guide(guide_id=guide_id))
+        
+        if requested_at is not None:
+            # キャンバスの再描画はアイドル処理で行われるので、その後に実行される after_idle で表示された時刻を記録する
+            self.root.after_idle(self._record_time_to_highlight, requested_at)
+
+    def _record_time_to_highlight(self, requested_at):
+        """回答の受信からガイドが描画されるまでの時間を記録する"""
+        elapsed_ms = (time.perf_counter() - requested_at) * 1000
+        self.highlight_latencies.append(elapsed_ms)
+        print(f"Time to highlight: {elapsed_ms:.0f}ms")
+
+    def highlight_stats(self):
+        """ガイド表示までの時間の集計（直近の分）"""
+        samples = sorted(self.highlight_latencies)
+        if not samples:
+            return {"count": 0}
+        return {
+            "count": len(samples),
+            "last_ms": round(self.highlight_latencies[-1], 1),
+            "p50_ms": round(samples[len(samples) // 2], 1),
+            "p95_ms": round(samples[min(len(samples) - 1, int(len(samples) * 0.95))], 1),
+        }
+
+    def _guide_visible(self, guide):
+        """オーバーレイが表示されていて、ガイドが指している対象が他のウィンドウに隠れていないか"""
+        overlay = self.overlay_window
+        if not overlay or not overlay.winfo_exists() or not overlay.winfo_viewable():
+            return False
+        if guide["target_window"] is not None:
+            # 表示したときと別のウィンドウが対象の位置に来ていれば、対象は隠れている
+            return window_at_point(*guide["target_point"]) == guide["target_window"]
+        return True
+
+    def _on_guide_right_click(self, event):
+        """右クリックされたガイドを消す"""
+        for tag in self.guide_canvas.gettags("current"):
+            for guide_id, guide in list(self._guides.items()):
+                if guide["tag"] == tag:
+                    self.hide_visual_guide(guide_id=guide_id)
+                    return
+
+    @ui_thread()
+    def hide_visual_guide(self, event=None, guide_id=None):
+        """
+        ガイドを消す（オーバーレイは破棄せずに隠して、次のガイドで使い回す）
+
+        Args:
+            guide_id: 消すガイド（省略時はすべて）
+        """
+        guide_ids = list(self._guides) if guide_id is None else [guide_id]
+        for gid in guide_ids:
+            guide = self._guides.pop(gid, None)
+            if guide is None:
+                continue
+            if guide["timeout"]:
+                self.root.after_cancel(guide["timeout"])
+            guide["animator"].stop()
+            try: self.guide_canvas.delete(guide["tag"])
             except: pass
-            self.overlay_window = None
         
-        # クリーンアップ
-        if hasattr(self, 'arrow_id'): del self.arrow_id
-        if hasattr(self, 'rect_id'): 
-            del self.rect_id
-            del self.corners
+        if not self._guides and self.overlay_window is not None:
+            try: self.overlay_window.withdraw()
+            except: pass
 
 
 if __name__ == "__main__":
@@ -0,0 +1,187 @@
+"""
+UI Dispatch Module
+ワーカースレッドからの UI 操作を Tk のスレッドで実行するためのコマンドキュー
+
+- Tk のウィジェットはメインスレッド（mainloop を回しているスレッド）以外から触ってはいけない
+- ワーカースレッドは post() / call() でコマンドを積み、Tk のスレッドが root.after で定期的に取り出して実行する
+- 同じキーのコマンド（ステータス表示の更新など）は、未実行のものを最新の内容で置き換えて1回にまとめる
+- ウォッチドッグが Tk のイベントループの遅れ（長い処理で固まっている時間）を検出して報告する
+"""
+
+import os
+import threading
+import time
+from collections import deque
+
+
+class UIDispatcher:
+    """
+    Tk のスレッドで実行するコマンドのキュー（スレッドセーフ）
+    """
+
+    def __init__(self, root, interval_ms=16, budget_ms=8, lag_warn_ms=None):
+        """
+        Args:
+            root: Tk のルートウィンドウ
+            interval_ms: キューを取り出す間隔（ミリ秒）
+            budget_ms: 1回の取り出しで実行に使う時間の上限（超えた分は次の回に回す）
+            lag_warn_ms: イベントループがこの時間以上止まったら警告する（ミリ秒）
+        """
+        if lag_warn_ms is None:
+            lag_warn_ms = int(os.environ.get("SENP_AI_UI_LAG_WARN_MS", "250"))
+
+        self.root = root
+        self.interval_ms = interval_ms
+        self.budget_ms = budget_ms
+        self.lag_warn_ms = lag_warn_ms
+        self.ui_thread_id = threading.get_ident()
+
+        self._lock = threading.Lock()
+        # [key, func, args, kwargs] のリスト（キー付きのコマンドは置き換えられるように list で持つ）
+        self._queue = deque()
+        self._pending = {}
+        self._after_id = None
+        self._running = False
+
+        # イベントループの遅れの計測
+        self._expected_at = None
+        self._last_tick = time.monotonic()
+        self._stalled = False
+        self._stats = {
+            "executed": 0,
+            "coalesced": 0,
+            "errors": 0,
+            "stalls": 0,
+            "max_lag_ms": 0.0,
+            "max_stall_ms": 0.0,
+        }
+        self._watchdog = None
+
+    def in_ui_thread(self):
+        return threading.get_ident() == self.ui_thread_id
+
+    def start(self):
+        """取り出しとウォッチドッグを開始（Tk のスレッドから呼ぶ）"""
+        self._running = True
+        self._last_tick = time.monotonic()
+        self._schedule(self.interval_ms)
+        self._watchdog = threading.Thread(target=self._watchdog_loop, daemon=True)
+        self._watchdog.start()
+
+    def stop(self):
+        self._running = False
+        if self._after_id is not None:
+            try:
+                self.root.after_cancel(self._after_id)
+            except Exception:
+                pass
+            self._after_id = None
+
+    def post(self, func, args=(), kwargs=None, key=None):
+        """
+        コマンドを積む（結果を待たない）
+
+        Args:
+            key: 同じキーの未実行のコマンドがあれば、そのコマンドを今回の内容で置き換える
+        """
+        with self._lock:
+            if key is not None and key in self._pending:
+                entry = self._pending[key]
+                entry[1], entry[2], entry[3] = func, args, kwargs or {}
+                self._stats["coalesced"] += 1
+                return
+            entry = [key, func, args, kwargs or {}]
+            self._queue.append(entry)
+            if key is not None:
+                self._pending[key] = entry
+
+    def call(self, func, args=(), kwargs=None, timeout=2.0):
+        """
+        コマンドを Tk のスレッドで実行して結果を返す（Tk のスレッドから呼んだ場合はその場で実行）
+        ウィンドウを隠してからスクリーンショットを撮る場合など、実行の完了を待つ必要があるときに使う
+        """
+        if self.in_ui_thread():
+            return func(*args, **(kwargs or {}))
+        done = threading.Event()
+        outcome = {}
+
+        def run():
+            try:
+                outcome["result"] = func(*args, **(kwargs or {}))
+            except Exception as e:
+                outcome["error"] = e
+            finally:
+                done.set()
+
+        self.post(run)
+        if not done.wait(timeout):
+            print(f"WARNING: UI command {getattr(func, '__name__', func)} did not run within {timeout}s")
+            return None
+        if "error" in outcome:
+            raise outcome["error"]
+        return outcome.get("result")
+
+    def stats(self):
+        with self._lock:
+            return dict(self._stats, queued=len(self._queue))
+
+    def _schedule(self, delay_ms):
+        if not self._running:
+            return
+        self._expected_at = time.monotonic() + delay_ms / 1000
+        self._after_id = self.root.after(delay_ms, self._drain)
+
+    def _drain(self):
+        """キューのコマンドを時間の上限まで実行"""
+        now = time.monotonic()
+        lag_ms = max(0.0, (now - self._expected_at) * 1000) if self._expected_at else 0.0
+        self._last_tick = now
+
+        with self._lock:
+            self._stats["max_lag_ms"] = max(self._stats["max_lag_ms"], lag_ms)
+
+        deadline = now + self.budget_ms / 1000
+        while True:
+            with self._lock:
+                if not self._queue:
+                    break
+                entry = self._queue.popleft()
+                if entry[0] is not None:
+                    self._pending.pop(entry[0], None)
+            _, func, args, kwargs = entry
+            try:
+                func(*args, **kwargs)
+            except Exception as e:
+                print(f"UI command error ({getattr(func, '__name__', func)}): {e}")
+                with self._lock:
+                    self._stats["errors"] += 1
+            with self._lock:
+                self._stats["executed"] += 1
+            if time.monotonic() >= deadline:
+                break
+
+        with self._lock:
+            backlog = bool(self._queue)
+        # 残りがあればすぐに続きを実行する（その間にも他のイベントは処理される）
+        self._schedule(1 if backlog else self.interval_ms)
+
+    def _watchdog_loop(self):
+        """Tk のスレッドが取り出しに来ない時間を監視して、止まっていれば報告する"""
+        check_interval = max(0.05, self.lag_warn_ms / 4000)
+        while self._running:
+            time.sleep(check_interval)
+            stalled_ms = (time.monotonic() - self._last_tick) * 1000 - self.interval_ms
+            if stalled_ms >= self.lag_warn_ms:
+                if not self._stalled:
+                    self._stalled = True
+                    with self._lock:
+                        self._stats["stalls"] += 1
+                        queued = len(self._queue)
+                    print(f"WARNING: UI event loop stalled for {stalled_ms:.0f}ms ({queued} commands queued)")
+                with self._lock:
+                    self._stats["max_stall_ms"] = max(self._stats["max_stall_ms"], stalled_ms)
+            elif self._stalled:
+                self._stalled = False
+                with self._lock:
+                    worst = self._stats["max_stall_ms"]
+                print(f"UI event loop recovered (worst stall so far: {worst:.0f}ms)")